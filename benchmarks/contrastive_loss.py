@@ -0,0 +1,80 @@
+"""
+Compares the VSE++ hinge loss (`ContrastiveLoss.hinge_loss`) with the previous
+implementation building the two N x N cost matrices and the diagonal mask at
+every call.
+
+    python benchmarks/contrastive_loss.py --batch_size 2048 4096
+
+Each measure runs in a fresh process so that the peak RSS only accounts for one
+implementation.
+"""
+
+import argparse
+
+import torch
+from utils import peak_rss_mb, run_isolated, time_per_call
+
+from shimmer_ssd.modules.contrastive_loss import ContrastiveLoss
+
+
+def unfused_hinge_loss(
+    scores: torch.Tensor, margin: float, max_violation: bool
+) -> torch.Tensor:
+    diagonal = scores.diag().view(scores.size(0), 1)
+    d1 = diagonal.expand_as(scores)
+    d2 = diagonal.t().expand_as(scores)
+    cost_s = (margin + scores - d1).clamp(min=0)
+    cost_im = (margin + scores - d2).clamp(min=0)
+    mask = torch.eye(scores.size(0), device=scores.device) > 0.5
+    cost_s = cost_s.masked_fill_(mask, 0)
+    cost_im = cost_im.masked_fill_(mask, 0)
+    if max_violation:
+        cost_s = cost_s.max(1)[0]
+        cost_im = cost_im.max(0)[0]
+    return cost_s.sum() + cost_im.sum()
+
+
+def measure(
+    name: str, batch_size: int, max_violation: bool, repeats: int
+) -> tuple[float, float]:
+    """
+    Returns:
+        `tuple[float, float]`: seconds per forward + backward and peak RSS in MB
+    """
+    torch.manual_seed(0)
+    scores = torch.randn(batch_size, batch_size, requires_grad=True)
+    loss = ContrastiveLoss(0.2, "cosine", max_violation)
+
+    def step():
+        if name == "unfused":
+            value = unfused_hinge_loss(scores, 0.2, max_violation)
+        else:
+            value = loss.hinge_loss(scores)
+        value.backward()
+
+    duration = time_per_call(step, repeats)
+    return duration, peak_rss_mb()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--batch_size", type=int, nargs="+", default=[2048, 4096])
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument(
+        "--sum_violation",
+        action="store_true",
+        help="Benchmark the sum over all negatives instead of the hardest one",
+    )
+    args = parser.parse_args()
+
+    print("impl\tbatch_size\ttime (ms)\tpeak RSS (MB)")
+    for batch_size in args.batch_size:
+        for name in ["unfused", "fused"]:
+            duration, rss = run_isolated(
+                measure, name, batch_size, not args.sum_violation, args.repeats
+            )
+            print(f"{name}\t{batch_size}\t{duration * 1000:.1f}\t{rss:.0f}")
+
+
+if __name__ == "__main__":
+    main()
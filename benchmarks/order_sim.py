@@ -0,0 +1,69 @@
+"""
+Compares the tiled `order_sim` with the previous implementation that expands the
+(N, N, D) differences.
+
+    python benchmarks/order_sim.py --batch_size 2056 --latent_dim 12 64
+
+Each measure runs in a fresh process so that the peak RSS only accounts for one
+implementation.
+"""
+
+import argparse
+from collections.abc import Callable
+
+import torch
+from utils import peak_rss_mb, run_isolated, time_per_call
+
+from shimmer_ssd.modules.contrastive_loss import order_sim
+
+
+def expanded_order_sim(im: torch.Tensor, s: torch.Tensor) -> torch.Tensor:
+    YmX = s.unsqueeze(1).expand(s.size(0), im.size(0), s.size(1)) - im.unsqueeze(
+        0
+    ).expand(s.size(0), im.size(0), s.size(1))
+    return -YmX.clamp(min=0).pow(2).sum(2).sqrt().t()
+
+
+def measure(
+    name: str, batch_size: int, latent_dim: int, tile_size: int, repeats: int
+) -> tuple[float, float]:
+    """
+    Returns:
+        `tuple[float, float]`: seconds per forward + backward and peak RSS in MB
+    """
+    sim: Callable[[torch.Tensor, torch.Tensor], torch.Tensor]
+    if name == "expanded":
+        sim = expanded_order_sim
+    else:
+        sim = lambda im, s: order_sim(im, s, tile_size)  # noqa: E731
+
+    torch.manual_seed(0)
+    im = torch.randn(batch_size, latent_dim, requires_grad=True)
+    s = torch.randn(batch_size, latent_dim, requires_grad=True)
+    duration = time_per_call(lambda: sim(im, s).sum().backward(), repeats)
+    return duration, peak_rss_mb()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--batch_size", type=int, nargs="+", default=[512, 2056])
+    parser.add_argument("--latent_dim", type=int, nargs="+", default=[12, 64])
+    parser.add_argument("--tile_size", type=int, default=256)
+    parser.add_argument("--repeats", type=int, default=3)
+    args = parser.parse_args()
+
+    print("impl\tbatch_size\tlatent_dim\ttime (ms)\tpeak RSS (MB)")
+    for batch_size in args.batch_size:
+        for latent_dim in args.latent_dim:
+            for name in ["expanded", "tiled"]:
+                duration, rss = run_isolated(
+                    measure, name, batch_size, latent_dim, args.tile_size, args.repeats
+                )
+                print(
+                    f"{name}\t{batch_size}\t{latent_dim}\t"
+                    f"{duration * 1000:.1f}\t{rss:.0f}"
+                )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,350 @@
+"""
+Throughput and memory benchmarks of the domain modules hot paths and of the
+contrastive losses, on CPU.
+
+    python benchmarks/suite.py --save-baseline baseline.json
+    python benchmarks/suite.py --baseline baseline.json
+    python benchmarks/suite.py -k step --compile  # compiled vs eager steps
+
+Every case (benchmark x batch size x latent dim) runs in a fresh process, so that
+its peak RSS only accounts for this case. Baselines depend on the machine, so none
+is committed: save one with `--save-baseline` on the reference commit, on the
+machine used for the comparisons, and save it again when the machine, the
+dependencies or the reference commit change. With `--baseline`, the script exits
+with an error if the baseline file does not exist, or if a case is slower or uses
+more memory than the baseline by more than `--tolerance`.
+"""
+
+import argparse
+import json
+import sys
+from collections.abc import Callable
+from pathlib import Path
+from typing import Any
+
+import torch
+from shimmer import ContrastiveLoss
+from utils import peak_rss_mb, run_isolated, time_per_call
+
+from shimmer_ssd.config import Compile
+from shimmer_ssd.modules.compile import compile_step
+from shimmer_ssd.modules.contrastive_loss import VSEPPContrastiveLoss
+from shimmer_ssd.modules.domains.attribute import (
+    AttributeDomainModule,
+    AttributeWithUnpairedDomainModule,
+)
+from shimmer_ssd.modules.domains.text import GRUTextDomainModule, Text2Attr
+from shimmer_ssd.modules.domains.visual import VisualDomainModule
+
+# Returns the function to time for a batch size and a latent dim
+BenchmarkSetup = Callable[[int, int], Callable[[], Any]]
+
+BENCHMARKS: dict[str, BenchmarkSetup] = {}
+
+# whether the ".step" benchmarks compile the step (set by `measure`)
+COMPILE_STEP = False
+
+
+def benchmark(name: str) -> Callable[[BenchmarkSetup], BenchmarkSetup]:
+    def register(setup: BenchmarkSetup) -> BenchmarkSetup:
+        BENCHMARKS[name] = setup
+        return setup
+
+    return register
+
+
+def attribute_batch(batch_size: int) -> list[torch.Tensor]:
+    categories = torch.nn.functional.one_hot(torch.randint(3, (batch_size,)), 3).float()
+    return [categories, torch.rand(batch_size, 8) * 2 - 1]
+
+
+def text_module(latent_dim: int) -> GRUTextDomainModule:
+    return GRUTextDomainModule(latent_dim, 256, vocab_size=822, seq_length=64)
+
+
+def no_grad(fn: Callable[[], Any]) -> Callable[[], Any]:
+    """Times `fn` as inference."""
+
+    def run():
+        with torch.no_grad():
+            return fn()
+
+    return run
+
+
+def backward(fn: Callable[[], torch.Tensor]) -> Callable[[], None]:
+    """Times the forward and backward passes of the loss returned by `fn`."""
+    return lambda: fn().backward()
+
+
+def training_step(module: torch.nn.Module, x: Any) -> Callable[[], None]:
+    """Times the `step_losses` of a domain module and the backward pass."""
+    if COMPILE_STEP:
+        compile_step(module, Compile(enabled=True))
+    return backward(lambda: module.step_losses(x)["loss"])
+
+
+@benchmark("visual.encode")
+def visual_encode(batch_size: int, latent_dim: int) -> Callable[[], Any]:
+    module = VisualDomainModule(3, latent_dim, 256).eval()
+    x = torch.rand(batch_size, 3, 32, 32)
+    return no_grad(lambda: module.encode(x))
+
+
+@benchmark("visual.decode")
+def visual_decode(batch_size: int, latent_dim: int) -> Callable[[], Any]:
+    module = VisualDomainModule(3, latent_dim, 256).eval()
+    z = torch.randn(batch_size, latent_dim)
+    return no_grad(lambda: module.decode(z))
+
+
+@benchmark("visual.step")
+def visual_step(batch_size: int, latent_dim: int) -> Callable[[], Any]:
+    module = VisualDomainModule(3, latent_dim, 256)
+    return training_step(module, torch.rand(batch_size, 3, 32, 32))
+
+
+@benchmark("attr.encode")
+def attr_encode(batch_size: int, latent_dim: int) -> Callable[[], Any]:
+    module = AttributeDomainModule(latent_dim, 64).eval()
+    x = attribute_batch(batch_size)
+    return no_grad(lambda: module.encode(x))
+
+
+@benchmark("attr.decode")
+def attr_decode(batch_size: int, latent_dim: int) -> Callable[[], Any]:
+    module = AttributeDomainModule(latent_dim, 64).eval()
+    z = torch.randn(batch_size, latent_dim)
+    return no_grad(lambda: module.decode(z))
+
+
+@benchmark("attr.step")
+def attr_step(batch_size: int, latent_dim: int) -> Callable[[], Any]:
+    module = AttributeDomainModule(latent_dim, 64)
+    return training_step(module, attribute_batch(batch_size))
+
+
+@benchmark("attr_unpaired.encode")
+def attr_unpaired_encode(batch_size: int, latent_dim: int) -> Callable[[], Any]:
+    module = AttributeWithUnpairedDomainModule(latent_dim, 64).eval()
+    x = [*attribute_batch(batch_size), torch.rand(batch_size, 1)]
+    return no_grad(lambda: module.encode(x))
+
+
+@benchmark("attr_unpaired.decode")
+def attr_unpaired_decode(batch_size: int, latent_dim: int) -> Callable[[], Any]:
+    module = AttributeWithUnpairedDomainModule(latent_dim, 64).eval()
+    z = torch.randn(batch_size, latent_dim + 1)
+    return no_grad(lambda: module.decode(z))
+
+
+@benchmark("text.decode")
+def text_decode(batch_size: int, latent_dim: int) -> Callable[[], Any]:
+    module = text_module(latent_dim).eval()
+    z = torch.randn(batch_size, latent_dim)
+    return no_grad(lambda: module.decode(z))
+
+
+@benchmark("text.text_token_loss")
+def text_token_loss(batch_size: int, latent_dim: int) -> Callable[[], Any]:
+    module = text_module(latent_dim)
+    z = torch.randn(batch_size, latent_dim)
+    target = {"tokens": torch.randint(module.vocab_size, (batch_size, 64))}
+    return backward(lambda: module.text_token_loss(z, target)[0])
+
+
+@benchmark("text.step")
+def text_step(batch_size: int, latent_dim: int) -> Callable[[], Any]:
+    module = text_module(latent_dim)
+    x = {
+        "bert": torch.randn(batch_size, module.in_dim),
+        "tokens": torch.randint(module.vocab_size, (batch_size, 64)),
+    }
+    return training_step(module, x)
+
+
+@benchmark("text2attr.compute_loss")
+def text2attr_compute_loss(batch_size: int, latent_dim: int) -> Callable[[], Any]:
+    module = Text2Attr(latent_dim, 256, text_module(latent_dim))
+    pred = torch.randn(batch_size, latent_dim, requires_grad=True)
+    target = torch.randn(batch_size, latent_dim)
+    return backward(lambda: module.compute_loss(pred, target, None).loss)
+
+
+@benchmark("contrastive.clip")
+def clip_loss(batch_size: int, latent_dim: int) -> Callable[[], Any]:
+    loss = ContrastiveLoss(torch.tensor([1 / 0.07]).log())
+    x = torch.randn(batch_size, latent_dim, requires_grad=True)
+    y = torch.randn(batch_size, latent_dim, requires_grad=True)
+    return backward(lambda: loss(x, y).loss)
+
+
+def vsepp_loss(measure: str, batch_size: int, latent_dim: int) -> Callable[[], Any]:
+    loss = VSEPPContrastiveLoss(0.2, measure, True, torch.tensor([1 / 0.07]).log())
+    x = torch.randn(batch_size, latent_dim, requires_grad=True)
+    y = torch.randn(batch_size, latent_dim, requires_grad=True)
+    return backward(lambda: loss(x, y).loss)
+
+
+@benchmark("contrastive.vsepp_cosine")
+def vsepp_cosine_loss(batch_size: int, latent_dim: int) -> Callable[[], Any]:
+    return vsepp_loss("cosine", batch_size, latent_dim)
+
+
+@benchmark("contrastive.vsepp_order")
+def vsepp_order_loss(batch_size: int, latent_dim: int) -> Callable[[], Any]:
+    return vsepp_loss("order", batch_size, latent_dim)
+
+
+def measure(
+    name: str,
+    batch_size: int,
+    latent_dim: int,
+    repeats: int,
+    num_threads: int,
+    compiled: bool = False,
+) -> dict[str, float]:
+    """
+    With `compiled`, the ".step" benchmarks compile the step. The first call is
+    not timed, so the compilation time is excluded.
+
+    Returns:
+        `dict[str, float]`: the samples per second, the peak RSS of the process in
+        MB and the part of this peak allocated by the case (setup included), i.e.
+        without the interpreter and the imported libraries.
+    """
+    global COMPILE_STEP
+    COMPILE_STEP = compiled
+    torch.set_num_threads(num_threads)
+    torch.manual_seed(0)
+    rss_before = peak_rss_mb()
+    fn = BENCHMARKS[name](batch_size, latent_dim)
+    duration = time_per_call(fn, repeats)
+    rss = peak_rss_mb()
+    return {
+        "samples_per_s": batch_size / duration,
+        "peak_rss_mb": rss,
+        "case_rss_mb": rss - rss_before,
+    }
+
+
+def case_name(name: str, batch_size: int, latent_dim: int, compiled: bool) -> str:
+    compiled_suffix = ",compiled" if compiled else ""
+    return f"{name}[batch_size={batch_size},latent_dim={latent_dim}{compiled_suffix}]"
+
+
+def regressions(
+    results: dict[str, dict[str, float]],
+    baseline: dict[str, dict[str, float]],
+    tolerance: float,
+    memory_slack_mb: float,
+) -> list[str]:
+    """
+    Compares the results to the baseline. Cases missing from the baseline are
+    ignored. The memory of a case is allowed to grow by `tolerance` (relative)
+    plus `memory_slack_mb`, as small allocations are noisy.
+
+    Returns:
+        `list[str]`: a description of each regression
+    """
+    messages: list[str] = []
+    for case, result in results.items():
+        if case not in baseline:
+            continue
+        expected = baseline[case]
+        if result["samples_per_s"] < expected["samples_per_s"] * (1 - tolerance):
+            messages.append(
+                f"{case}: {result['samples_per_s']:.1f} samples/s "
+                f"(baseline {expected['samples_per_s']:.1f})"
+            )
+        max_rss = expected["case_rss_mb"] * (1 + tolerance) + memory_slack_mb
+        if result["case_rss_mb"] > max_rss:
+            messages.append(
+                f"{case}: {result['case_rss_mb']:.0f} MB allocated "
+                f"(baseline {expected['case_rss_mb']:.0f})"
+            )
+    return messages
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--batch_size", type=int, nargs="+", default=[32, 256])
+    parser.add_argument("--latent_dim", type=int, nargs="+", default=[12, 64])
+    parser.add_argument(
+        "-k",
+        "--filter",
+        default="",
+        help="Only run the benchmarks whose name contains this string",
+    )
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--num_threads", type=int, default=1)
+    parser.add_argument("--baseline", type=Path, help="Baseline JSON to compare to")
+    parser.add_argument(
+        "--save-baseline", type=Path, help="Write the results to this JSON file"
+    )
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.2,
+        help="Allowed relative slowdown or memory increase before failing",
+    )
+    parser.add_argument("--memory_slack_mb", type=float, default=16)
+    parser.add_argument(
+        "--compile",
+        action="store_true",
+        help="Also run the training step benchmarks (.step) with a compiled step",
+    )
+    args = parser.parse_args()
+    if args.baseline is not None and not args.baseline.is_file():
+        parser.error(
+            f"the baseline {args.baseline} does not exist. Baselines depend on the "
+            "machine and are not committed: save one on the reference commit with "
+            f"`--save-baseline {args.baseline}`."
+        )
+
+    results: dict[str, dict[str, float]] = {}
+    print(
+        "benchmark\tbatch_size\tlatent_dim\tcompiled\tsamples/s\t"
+        "peak RSS (MB)\tcase RSS (MB)"
+    )
+    for name in BENCHMARKS:
+        if args.filter not in name:
+            continue
+        compiled_modes = (
+            [False, True] if args.compile and name.endswith(".step") else [False]
+        )
+        for batch_size in args.batch_size:
+            for latent_dim in args.latent_dim:
+                for compiled in compiled_modes:
+                    result = run_isolated(
+                        measure,
+                        name,
+                        batch_size,
+                        latent_dim,
+                        args.repeats,
+                        args.num_threads,
+                        compiled,
+                    )
+                    results[case_name(name, batch_size, latent_dim, compiled)] = result
+                    print(
+                        f"{name}\t{batch_size}\t{latent_dim}\t{compiled}\t"
+                        f"{result['samples_per_s']:.1f}\t"
+                        f"{result['peak_rss_mb']:.0f}\t{result['case_rss_mb']:.0f}"
+                    )
+
+    if args.save_baseline is not None:
+        args.save_baseline.write_text(json.dumps(results, indent=2) + "\n")
+
+    if args.baseline is not None:
+        baseline = json.loads(args.baseline.read_text())
+        messages = regressions(results, baseline, args.tolerance, args.memory_slack_mb)
+        for message in messages:
+            print(f"REGRESSION {message}")
+        if messages:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,30 @@
+import multiprocessing
+import resource
+import time
+from collections.abc import Callable
+from typing import Any
+
+
+def peak_rss_mb() -> float:
+    """Peak resident set size of the current process in MB."""
+    # ru_maxrss is in KB on linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def time_per_call(fn: Callable[[], Any], repeats: int, warmup: int = 1) -> float:
+    """Mean duration in seconds of `fn()` after `warmup` calls."""
+    for _ in range(warmup):
+        fn()
+    start = time.perf_counter()
+    for _ in range(repeats):
+        fn()
+    return (time.perf_counter() - start) / repeats
+
+
+def run_isolated(fn: Callable[..., Any], *args: Any) -> Any:
+    """
+    Runs `fn(*args)` in a fresh process, so that its peak RSS only accounts for
+    this call. `fn` must be importable (defined at the top level of a module).
+    """
+    with multiprocessing.get_context("spawn").Pool(1) as pool:
+        return pool.apply(fn, args)
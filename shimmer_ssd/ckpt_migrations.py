@@ -1,7 +1,10 @@
-from collections.abc import Sequence
+import hashlib
+import inspect
+import json
+from collections.abc import Mapping, Sequence
 from os import PathLike
 from pathlib import Path
-from typing import Any
+from typing import Any, TypeVar
 
 import torch
 from lightning.pytorch import Callback, LightningModule, Trainer
@@ -10,19 +13,108 @@ from migrate_ckpt import (
     ckpt_migration_key,
     migrate_from_folder,
 )
+from migrate_ckpt.migrate import get_folder_migrations
 from shimmer import migrate_model as migrate_shimmer_model
+from shimmer.version import __version__ as shimmer_version
 
 from shimmer_ssd import LOGGER
 
+_T_module = TypeVar("_T_module", bound=LightningModule)
+
+
+def fingerprint_path(ckpt_path: Path) -> Path:
+    """Sidecar file recording that the checkpoint is already migrated."""
+    return ckpt_path.with_name(ckpt_path.name + ".migrations.json")
+
+
+def file_sha256(path: Path, chunk_size: int = 1 << 20) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(chunk_size):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def expected_migrations(migration_path: str | PathLike) -> dict[str, Any]:
+    """The migrations a migrated checkpoint should have gone through."""
+    migrations: dict[str, Any] = {
+        "migrations": [
+            migration.name for migration in get_folder_migrations(Path(migration_path))
+        ]
+    }
+    if Path(migration_path).name == "gw":
+        migrations["shimmer_version"] = shimmer_version
+    return migrations
+
+
+def is_migrated(ckpt_path: Path, migration_path: str | PathLike) -> bool:
+    """
+    Whether the checkpoint was already migrated with the current migrations,
+    according to its fingerprint (see `save_fingerprint`). The checkpoint is only
+    hashed if its modification time changed.
+    """
+    if not fingerprint_path(ckpt_path).exists():
+        return False
+    fingerprint = json.loads(fingerprint_path(ckpt_path).read_text())
+    if any(
+        fingerprint.get(key) != value
+        for key, value in expected_migrations(migration_path).items()
+    ):
+        return False
+    stat = ckpt_path.stat()
+    if fingerprint["size"] != stat.st_size:
+        return False
+    if fingerprint["mtime_ns"] == stat.st_mtime_ns:
+        return True
+    if fingerprint["sha256"] != file_sha256(ckpt_path):
+        return False
+    save_fingerprint(ckpt_path, migration_path, fingerprint["sha256"])
+    return True
+
+
+def save_fingerprint(
+    ckpt_path: Path, migration_path: str | PathLike, sha256: str | None = None
+):
+    """
+    Saves the size, modification time and hash of the migrated checkpoint with
+    the names of the migrations it went through.
+    """
+    stat = ckpt_path.stat()
+    fingerprint = {
+        "size": stat.st_size,
+        "mtime_ns": stat.st_mtime_ns,
+        "sha256": sha256 or file_sha256(ckpt_path),
+        **expected_migrations(migration_path),
+    }
+    try:
+        fingerprint_path(ckpt_path).write_text(json.dumps(fingerprint))
+    except OSError as e:
+        LOGGER.debug(f"Could not save the migration fingerprint of {ckpt_path}: {e}")
+
 
 def migrate_model(ckpt_path: str | PathLike, migration_path: str | PathLike, **kwargs):
+    """
+    Migrates the checkpoint file if needed.
+
+    Checkpoints migrated with the current migrations are recognized from their
+    fingerprint file and are not loaded.
+
+    Args:
+        ckpt_path (`str | PathLike`): path to the checkpoint
+        migration_path (`str | PathLike`): folder of the migrations to apply
+        kwargs: additional arguments for `torch.load`
+    """
+    ckpt_path = Path(ckpt_path)
+    if is_migrated(ckpt_path, migration_path):
+        LOGGER.debug(f"{ckpt_path} is already migrated.")
+        return
+
     default_torch_kwargs: dict[str, Any] = {"weights_only": False}
     default_torch_kwargs.update(kwargs)
 
     if Path(migration_path).name == "gw":
         migrate_shimmer_model(ckpt_path, **default_torch_kwargs)
 
-    ckpt_path = Path(ckpt_path)
     ckpt = torch.load(ckpt_path, **default_torch_kwargs)
     new_ckpt, done_migrations = migrate_from_folder(ckpt, migration_path)
     done_migration_log = ", ".join(map(lambda x: x.name, done_migrations))
@@ -33,6 +125,60 @@ def migrate_model(ckpt_path: str | PathLike, migration_path: str | PathLike, **k
             version = len(ckpt[ckpt_migration_key])
         torch.save(ckpt, ckpt_path.with_stem(f"{ckpt_path.stem}-{version}"))
         torch.save(new_ckpt, ckpt_path)
+    save_fingerprint(ckpt_path, migration_path)
+
+
+def load_checkpoint(ckpt_path: str | PathLike, **kwargs) -> dict[str, Any]:
+    """
+    Loads the checkpoint on CPU with its tensors memory-mapped, so they are only
+    read when they are used (e.g. copied in the module by `module_from_checkpoint`).
+
+    Args:
+        ckpt_path (`str | PathLike`): path to the checkpoint
+        kwargs: additional arguments for `torch.load`
+
+    Returns:
+        `dict[str, Any]`: the checkpoint
+    """
+    torch_kwargs: dict[str, Any] = {
+        "weights_only": False,
+        "map_location": "cpu",
+        "mmap": True,
+    }
+    torch_kwargs.update(kwargs)
+    try:
+        return torch.load(ckpt_path, **torch_kwargs)
+    except RuntimeError:
+        if not torch_kwargs["mmap"]:
+            raise
+        # legacy (non zip) checkpoints cannot be memory-mapped
+        return torch.load(ckpt_path, **(torch_kwargs | {"mmap": False}))
+
+
+def module_from_checkpoint(
+    cls: type[_T_module], ckpt: Mapping[str, Any], strict: bool = True, **kwargs
+) -> _T_module:
+    """
+    Same as `cls.load_from_checkpoint` but from a checkpoint loaded with
+    `load_checkpoint`: the module is created from the saved hyperparameters
+    (overridden by `kwargs`, the arguments that the module does not accept are
+    ignored) and the state dict is loaded in it.
+
+    Args:
+        cls (`type[LightningModule]`): the module class to instantiate
+        ckpt (`Mapping[str, Any]`): the checkpoint
+        strict (`bool`): whether the state dict keys must match exactly
+        kwargs: arguments of the module overriding the saved hyperparameters
+
+    Returns:
+        the module with the checkpoint weights
+    """
+    params = inspect.signature(cls).parameters
+    hparams = {**ckpt.get(cls.CHECKPOINT_HYPER_PARAMS_KEY, {}), **kwargs}
+    module = cls(**{key: val for key, val in hparams.items() if key in params})
+    module.on_load_checkpoint(dict(ckpt))
+    module.load_state_dict(ckpt["state_dict"], strict=strict)
+    return module
 
 
 class SaveMigrations(Callback):
@@ -0,0 +1,359 @@
+import json
+import tempfile
+from collections.abc import Mapping
+from typing import Any
+
+import click
+from cfg_tools.utils import Path
+from lightning.pytorch import Trainer, seed_everything
+from shimmer import DomainModule
+
+from shimmer_ssd import DEBUG_MODE, LOGGER
+from shimmer_ssd.cli.train_gw import get_data_module, get_gw_module
+from shimmer_ssd.config import Config, load_config
+from shimmer_ssd.dataset.synthetic import save_synthetic_dataset
+from shimmer_ssd.errors import ConfigurationError
+from shimmer_ssd.modules.compile import compile_modules
+from shimmer_ssd.modules.contrastive_loss import ContrastiveLossStepCallback
+from shimmer_ssd.modules.domains import load_pretrained_domain
+from shimmer_ssd.modules.domains.pretrained import init_domain_module
+from shimmer_ssd.profiling import (
+    StepTimingCallback,
+    Timings,
+    loss_method_names,
+    timed_methods,
+)
+
+# attribute of the latent domain modules holding the module of the pre-saved latents
+LATENT_MODULE_ATTRIBUTES = {
+    "v_latents": "visual_module",
+    "attr_latents": "attr_module",
+    "t_latents": "text_module",
+}
+
+
+def presaved_latent_dims(
+    config: Config, domain_modules: Mapping[str, DomainModule]
+) -> dict[str, int]:
+    """
+    Dimension of the pre-saved latents loaded by the latent domains of the config,
+    for each latent file name.
+    """
+    latent_dims: dict[str, int] = {}
+    for domain in config.domains:
+        kind = domain.domain_type.kind.value.kind
+        if kind not in LATENT_MODULE_ATTRIBUTES:
+            continue
+        presaved_path = config.domain_data_args.get(kind, {}).get("presaved_path")
+        if presaved_path is None:
+            raise ConfigurationError(
+                f'Set `domain_data_args.{kind}.presaved_path` to use "{kind}".'
+            )
+        latent_module = getattr(domain_modules[kind], LATENT_MODULE_ATTRIBUTES[kind])
+        latent_dims[presaved_path] = latent_module.latent_dim
+    return latent_dims
+
+
+def bench_gw(
+    config_path: Path,
+    num_steps: int = 100,
+    warmup_steps: int = 10,
+    dataset_path: Path | None = None,
+    dataset_size: int | None = None,
+    output: Path | None = None,
+    debug_mode: bool | None = None,
+    log_config: bool = False,
+    extra_config_files: list[str] | None = None,
+    argv: list[str] | None = None,
+) -> dict[str, Any]:
+    """
+    Runs training steps of the Global Workspace of `ssd train gw` on CPU, with
+    randomly initialized domain modules (their checkpoints are not loaded), and
+    reports its throughput.
+
+    Args:
+        config_path (`Path`): the config folder
+        num_steps (`int`): number of measured steps
+        warmup_steps (`int`): number of steps run before the measured steps
+        dataset_path (`Path | None`): dataset to use. By default, a synthetic
+            dataset is generated in a temporary folder.
+        dataset_size (`int | None`): number of train samples of the synthetic
+            dataset. Defaults to 16 batches.
+        output (`Path | None`): if set, the results are also saved in this JSON file
+        debug_mode (`bool | None`): load the debug config
+        log_config (`bool`): print the config
+        extra_config_files (`list[str] | None`): config files to load. Defaults to
+            `train_gw.yaml`.
+        argv (`list[str] | None`): config values overridden from the command line
+
+    Returns:
+        `dict[str, Any]`: the number of steps per second, the fraction of the time
+        spent waiting for the dataloader, the mean time per step and the mean time
+        per step spent in each loss component (in ms).
+    """
+    if debug_mode is None:
+        debug_mode = DEBUG_MODE
+    if extra_config_files is None:
+        extra_config_files = ["train_gw.yaml"]
+    if argv is None:
+        argv = []
+
+    LOGGER.debug(f"Debug mode: {debug_mode}")
+
+    config = load_config(
+        config_path,
+        load_files=extra_config_files,
+        debug_mode=debug_mode,
+        log_config=log_config,
+        argv=argv,
+    )
+
+    seed_everything(config.seed, workers=True)
+
+    domain_modules: dict[str, DomainModule] = {}
+    gw_encoders = {}
+    gw_decoders = {}
+    for domain in config.domains:
+        kind = domain.domain_type.kind.value.kind
+        if dataset_path is None and kind == "v":
+            raise ConfigurationError(
+                'The synthetic dataset has no images, use "v_latents" instead of "v" '
+                "or give a dataset path."
+            )
+        (
+            domain_modules[kind],
+            gw_encoders[kind],
+            gw_decoders[kind],
+        ) = load_pretrained_domain(
+            domain,
+            config.global_workspace.latent_dim,
+            config.global_workspace.encoders.hidden_dim,
+            config.global_workspace.encoders.n_layers,
+            config.global_workspace.decoders.hidden_dim,
+            config.global_workspace.decoders.n_layers,
+            is_linear=config.global_workspace.linear_domains,
+            bias=config.global_workspace.linear_domains_use_bias,
+            module=init_domain_module(domain, config.domain_modules),
+        )
+    module, _ = get_gw_module(config, domain_modules, gw_encoders, gw_decoders)
+    if config.training.compile.enabled:
+        compile_modules(
+            [*gw_encoders.values(), *gw_decoders.values()], config.training.compile
+        )
+
+    timings = Timings()
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        if dataset_path is None:
+            batch_size = config.training.batch_size
+            if dataset_size is None:
+                dataset_size = 16 * batch_size
+            dataset_path = save_synthetic_dataset(
+                tmp_dir,
+                {
+                    "train": dataset_size,
+                    "val": min(batch_size, dataset_size),
+                    "test": min(batch_size, dataset_size),
+                },
+                config.domain_proportions,
+                seed=config.seed,
+                latent_dims=presaved_latent_dims(config, domain_modules),
+            )
+            LOGGER.debug(f"Generated a synthetic dataset in {dataset_path}.")
+
+        trainer = Trainer(
+            logger=False,
+            max_steps=warmup_steps + num_steps,
+            max_epochs=-1,
+            limit_val_batches=0,
+            num_sanity_val_steps=0,
+            enable_checkpointing=False,
+            enable_progress_bar=False,
+            enable_model_summary=False,
+            callbacks=[
+                StepTimingCallback(timings, warmup_steps),
+                ContrastiveLossStepCallback(),
+            ],
+            accelerator="cpu",
+            devices=1,
+        )
+        with timed_methods(
+            module.loss_mod, loss_method_names(module.loss_mod), timings
+        ):
+            trainer.fit(module, get_data_module(config, dataset_path))
+
+    num_measured = timings.count("step")
+    total = timings.total("step") + timings.total("dataloader")
+    results: dict[str, Any] = {
+        "steps": num_measured,
+        "steps_per_s": num_measured / total,
+        "dataloader_wait_fraction": timings.total("dataloader") / total,
+        "step_ms": 1000 * timings.total("step") / num_measured,
+        "loss_ms": {
+            name: 1000 * timings.total(name) / num_measured
+            for name in loss_method_names(module.loss_mod)
+            if timings.count(name)
+        },
+    }
+
+    click.echo(f"steps/s: {results['steps_per_s']:.2f}")
+    click.echo(f"dataloader wait: {100 * results['dataloader_wait_fraction']:.1f}%")
+    click.echo(f"step (without dataloader): {results['step_ms']:.1f} ms")
+    for name, duration in results["loss_ms"].items():
+        click.echo(f"  {name}: {duration:.1f} ms/step")
+
+    if output is not None:
+        output.write_text(json.dumps(results, indent=2))
+    return results
+
+
+@click.command(
+    "gw",
+    context_settings={
+        "ignore_unknown_options": True,
+        "allow_extra_args": True,
+    },
+    help=(
+        "Benchmark the training steps of the Global Workspace on CPU, with randomly "
+        "initialized domain modules and a synthetic dataset."
+    ),
+)
+@click.option(
+    "--config_path",
+    "-c",
+    default="./config",
+    type=click.Path(exists=True, dir_okay=True, file_okay=False, path_type=Path),  # type: ignore
+)
+@click.option(
+    "--num_steps", "-n", default=100, type=click.IntRange(min=1), help="Measured steps."
+)
+@click.option(
+    "--warmup_steps",
+    default=10,
+    type=int,
+    help="Steps run before the measured steps.",
+)
+@click.option(
+    "--dataset_path",
+    "-p",
+    default=None,
+    type=click.Path(exists=True, file_okay=False, dir_okay=True, path_type=Path),  # type: ignore
+    help="Use this dataset instead of a synthetic one.",
+)
+@click.option(
+    "--dataset_size",
+    default=None,
+    type=int,
+    help="Number of train samples of the synthetic dataset. Defaults to 16 batches.",
+)
+@click.option(
+    "--output",
+    "-o",
+    default=None,
+    type=click.Path(dir_okay=False, path_type=Path),  # type: ignore
+    help="Save the results in this JSON file.",
+)
+@click.option("--debug", "-d", is_flag=True, default=None)
+@click.option("--log_config", is_flag=True, default=False)
+@click.option(
+    "--extra_config_files",
+    "-e",
+    multiple=True,
+    type=str,
+    help=(
+        "Additional files to `local.yaml` to load in the config path. "
+        "By default `train_gw.yaml`"
+    ),
+)
+@click.pass_context
+def bench_gw_command(
+    ctx: click.Context,
+    config_path: Path,
+    num_steps: int,
+    warmup_steps: int,
+    dataset_path: Path | None,
+    dataset_size: int | None,
+    output: Path | None,
+    debug: bool | None,
+    log_config: bool,
+    extra_config_files: list[str],
+):
+    bench_gw(
+        config_path,
+        num_steps,
+        warmup_steps,
+        dataset_path,
+        dataset_size,
+        output,
+        debug,
+        log_config,
+        extra_config_files if len(extra_config_files) else None,
+        ctx.args,
+    )
+
+
+@click.command(
+    "dataset",
+    context_settings={
+        "ignore_unknown_options": True,
+        "allow_extra_args": True,
+    },
+    help=(
+        "Generate a synthetic dataset with the layout of the Simple Shapes dataset "
+        "for the domains and domain proportions of the config."
+    ),
+)
+@click.argument(
+    "dataset_path",
+    type=click.Path(file_okay=False, dir_okay=True, path_type=Path),  # type: ignore
+)
+@click.option(
+    "--config_path",
+    "-c",
+    default="./config",
+    type=click.Path(exists=True, dir_okay=True, file_okay=False, path_type=Path),  # type: ignore
+)
+@click.option("--train_size", default=500_000, type=int)
+@click.option("--val_size", default=1000, type=int)
+@click.option("--test_size", default=1000, type=int)
+@click.option("--debug", "-d", is_flag=True, default=None)
+@click.option(
+    "--extra_config_files",
+    "-e",
+    multiple=True,
+    type=str,
+    help=(
+        "Additional files to `local.yaml` to load in the config path. "
+        "By default `train_gw.yaml`"
+    ),
+)
+@click.pass_context
+def synthetic_dataset_command(
+    ctx: click.Context,
+    dataset_path: Path,
+    config_path: Path,
+    train_size: int,
+    val_size: int,
+    test_size: int,
+    debug: bool | None,
+    extra_config_files: list[str],
+):
+    config = load_config(
+        config_path,
+        load_files=list(extra_config_files) or ["train_gw.yaml"],
+        debug_mode=DEBUG_MODE if debug is None else debug,
+        argv=ctx.args,
+    )
+    domain_modules = {
+        domain.domain_type.kind.value.kind: init_domain_module(
+            domain, config.domain_modules
+        )
+        for domain in config.domains
+    }
+    save_synthetic_dataset(
+        dataset_path,
+        {"train": train_size, "val": val_size, "test": test_size},
+        config.domain_proportions,
+        seed=config.seed,
+        latent_dims=presaved_latent_dims(config, domain_modules),
+    )
+    click.echo(f"Saved in {dataset_path}.")
@@ -1,39 +1,148 @@
+import importlib
+from collections.abc import Mapping
+
 import click
 
 from shimmer_ssd.cli.config import config_group
 from shimmer_ssd.cli.download import download_group
-from shimmer_ssd.cli.extract import save_v_latents_command
-from shimmer_ssd.cli.migrate import migrate_domains_command
-from shimmer_ssd.cli.train_attr import train_attr_command
-from shimmer_ssd.cli.train_gw import train_gw_command
-from shimmer_ssd.cli.train_t import train_t_command
-from shimmer_ssd.cli.train_v import train_v_command
 
 
-@click.group()
+class LazyGroup(click.Group):
+    def __init__(
+        self,
+        *args,
+        lazy_subcommands: Mapping[str, tuple[str, str]] | None = None,
+        **kwargs,
+    ):
+        """
+        Click group whose subcommands are only imported when they are invoked.
+        The subcommand modules import torch, lightning, simple_shapes_dataset...
+        which would otherwise be imported for every `ssd` call, even `ssd --help`.
+
+        Args:
+            lazy_subcommands (`Mapping[str, tuple[str, str]] | None`): for each
+                subcommand name, the import path of the command
+                ("module.path:command_name") and its short help displayed in the
+                group help.
+        """
+        super().__init__(*args, **kwargs)
+        self.lazy_subcommands = dict(lazy_subcommands or {})
+
+    def list_commands(self, ctx: click.Context) -> list[str]:
+        return sorted([*super().list_commands(ctx), *self.lazy_subcommands])
+
+    def get_command(self, ctx: click.Context, cmd_name: str) -> click.Command | None:
+        if cmd_name in self.lazy_subcommands:
+            return self._load_command(cmd_name)
+        return super().get_command(ctx, cmd_name)
+
+    def _load_command(self, cmd_name: str) -> click.Command:
+        import_path, _ = self.lazy_subcommands[cmd_name]
+        module_name, command_name = import_path.split(":")
+        command = getattr(importlib.import_module(module_name), command_name)
+        if not isinstance(command, click.Command):
+            raise ValueError(f"{import_path} is not a click command.")
+        return command
+
+    def format_commands(
+        self, ctx: click.Context, formatter: click.HelpFormatter
+    ) -> None:
+        # Same as `click.Group.format_commands` but uses the registered short help
+        # of the lazy subcommands instead of importing them.
+        commands: list[tuple[str, click.Command]] = []
+        for name in self.list_commands(ctx):
+            if name in self.lazy_subcommands:
+                short_help = self.lazy_subcommands[name][1]
+                commands.append((name, click.Command(name, short_help=short_help)))
+                continue
+            command = super().get_command(ctx, name)
+            if command is not None and not command.hidden:
+                commands.append((name, command))
+
+        if not commands:
+            return
+        limit = formatter.width - 6 - max(len(name) for name, _ in commands)
+        rows = [(name, command.get_short_help_str(limit)) for name, command in commands]
+        with formatter.section("Commands"):
+            formatter.write_dl(rows)
+
+
+@click.group(
+    cls=LazyGroup,
+    lazy_subcommands={
+        "migrate": (
+            "shimmer_ssd.cli.migrate:migrate_domains_command",
+            "Migrate checkpoint",
+        ),
+    },
+)
 def cli():
     pass
 
 
-cli.add_command(migrate_domains_command)
 cli.add_command(download_group)
 cli.add_command(config_group)
 
 
-@cli.group("train")
+@cli.group(
+    "train",
+    cls=LazyGroup,
+    lazy_subcommands={
+        "v": ("shimmer_ssd.cli.train_v:train_v_command", "Train the visual domain"),
+        "attr": (
+            "shimmer_ssd.cli.train_attr:train_attr_command",
+            "Train the attr domain",
+        ),
+        "t": ("shimmer_ssd.cli.train_t:train_t_command", "Train the text domain"),
+        "gw": (
+            "shimmer_ssd.cli.train_gw:train_gw_command",
+            "Train the Global Workspace",
+        ),
+    },
+)
 def train_group():
     pass
 
 
-train_group.add_command(train_v_command)
-train_group.add_command(train_attr_command)
-train_group.add_command(train_t_command)
-train_group.add_command(train_gw_command)
-
-
-@cli.group("extract")
+@cli.group(
+    "extract",
+    cls=LazyGroup,
+    lazy_subcommands={
+        "v": (
+            "shimmer_ssd.cli.extract:save_v_latents_command",
+            "Extract and save the visual VAE latent representations.",
+        ),
+        "attr": (
+            "shimmer_ssd.cli.extract:save_attr_latents_command",
+            "Extract and save the attribute VAE latent representations.",
+        ),
+        "t": (
+            "shimmer_ssd.cli.extract:save_t_latents_command",
+            "Extract and save the text latent representations.",
+        ),
+        "tokens": (
+            "shimmer_ssd.cli.extract:save_tokens_command",
+            "Tokenize and save the captions of all splits.",
+        ),
+    },
+)
 def extract_group():
     pass
 
 
-extract_group.add_command(save_v_latents_command)
+@cli.group(
+    "bench",
+    cls=LazyGroup,
+    lazy_subcommands={
+        "gw": (
+            "shimmer_ssd.cli.bench:bench_gw_command",
+            "Benchmark the training steps of the Global Workspace on CPU.",
+        ),
+        "dataset": (
+            "shimmer_ssd.cli.bench:synthetic_dataset_command",
+            "Generate a synthetic dataset.",
+        ),
+    },
+)
+def bench_group():
+    pass
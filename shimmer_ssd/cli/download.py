@@ -2,7 +2,6 @@ import tarfile
 from pathlib import Path
 
 import click
-from simple_shapes_dataset.cli.download import downlad_file
 
 CHECKPOINTS_URL = (
     "https://zenodo.org/records/14747474/files/simple_shapes_checkpoints.tar.gz"
@@ -34,6 +33,8 @@ def download_group():
     help="If the file already exist, his will override with a new file.",
 )
 def download_dataset(path: Path, force: bool = False):
+    from simple_shapes_dataset.cli.download import downlad_file
+
     click.echo(f"Downloading in {str(path)}.")
     if path.exists() and not force:
         click.echo("Checkpoint path already exists. Skipping.")
@@ -65,6 +66,8 @@ def download_dataset(path: Path, force: bool = False):
     help="If the file already exist, his will override with a new file.",
 )
 def download_tokenizer(path: Path, force: bool = False):
+    from simple_shapes_dataset.cli.download import downlad_file
+
     click.echo(f"Downloading in {str(path)}.")
     click.echo(f"Downloading in {str(path)}.")
     if path.exists() and not force:
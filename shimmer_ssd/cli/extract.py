@@ -1,25 +1,270 @@
-from collections.abc import Callable
+import json
+import multiprocessing
+import os
+from collections.abc import Callable, Iterable
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
-from typing import Any, cast
+from typing import Any, Literal, cast, get_args
 
 import click
 import numpy as np
 import torch
+from lightning.pytorch.utilities import CombinedLoader
+from shimmer import DomainModule
 from simple_shapes_dataset import (
     SimpleShapesDataModule,
+    Text,
     color_blind_visual_domain,
     get_default_domains,
+    nullify_attribute_rotation,
 )
+from torch.utils.data import DataLoader, Subset
 from tqdm import tqdm
 
 from shimmer_ssd import DEBUG_MODE, LOGGER
 from shimmer_ssd.config import DomainModuleVariant, LoadedDomainConfig, load_config
+from shimmer_ssd.dataset.latents import (
+    LatentStorage,
+    convert_latents,
+    metadata_path,
+)
+from shimmer_ssd.dataset.pre_process import save_tokens_cache, tokens_cache_path
+from shimmer_ssd.modules.domains.attribute import AttributeDomainModule
 from shimmer_ssd.modules.domains.pretrained import load_pretrained_module
+from shimmer_ssd.modules.domains.text import GRUTextDomainModule
 from shimmer_ssd.modules.domains.visual import VisualDomainModule
 
 
-def save_v_latents(
-    checkpoin_path: Path,
+def progress_path(path: Path) -> Path:
+    return path.with_name(path.name + ".progress")
+
+
+def is_extracted(path: Path) -> bool:
+    """Whether the latent file exists and its extraction was completed."""
+    return path.exists() and not progress_path(path).exists()
+
+
+def save_progress(path: Path, n_done: int, total: int):
+    progress_file = progress_path(path)
+    tmp_file = progress_file.with_name(progress_file.name + ".tmp")
+    tmp_file.write_text(json.dumps({"n_done": n_done, "total": total}))
+    os.replace(tmp_file, progress_file)
+
+
+def get_torch_dataloader(dataloader: Iterable[Any]) -> DataLoader:
+    if isinstance(dataloader, CombinedLoader):
+        (dataloader,) = dataloader.flattened
+    assert isinstance(dataloader, DataLoader)
+    return dataloader
+
+
+def shard_path(path: Path, shard: int, num_shards: int) -> Path:
+    return path.with_name(f"{path.stem}.shard-{shard}-of-{num_shards}{path.suffix}")
+
+
+def shard_indices(total: int, shard: int, num_shards: int) -> range:
+    """Contiguous range of the dataset indices extracted by the shard."""
+    return range(shard * total // num_shards, (shard + 1) * total // num_shards)
+
+
+def merge_shards(path: Path, total: int, num_shards: int) -> bool:
+    """
+    Merges the shards into `path` once all of them are complete.
+
+    Shards are extracted by independent processes, each of them calls this after
+    finishing its own shard. A lock file makes sure only one process merges.
+
+    Args:
+        path (`Path`): path of the merged .npy file
+        total (`int`): total number of samples
+        num_shards (`int`): number of shards
+
+    Returns:
+        `bool`: whether the shards were merged by this call.
+    """
+    paths = [shard_path(path, shard, num_shards) for shard in range(num_shards)]
+    if not all(is_extracted(shard_file) for shard_file in paths):
+        return False
+
+    lock_file = path.with_name(path.name + ".lock")
+    try:
+        fd = os.open(lock_file, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+    except FileExistsError:
+        LOGGER.info(
+            f"{lock_file} exists: the shards are being merged by another process "
+            "(or a previous merge was interrupted, then remove it and retry)."
+        )
+        return False
+    try:
+        # another process could have merged and removed the shards in the meantime
+        if not all(is_extracted(shard_file) for shard_file in paths):
+            return False
+        shards = [np.load(shard_file, mmap_mode="r") for shard_file in paths]
+        for shard, (shard_file, latents) in enumerate(zip(paths, shards, strict=True)):
+            indices = shard_indices(total, shard, num_shards)
+            if (
+                latents.shape[0] != len(indices)
+                or latents.shape[1:] != shards[0].shape[1:]
+                or latents.dtype != shards[0].dtype
+            ):
+                raise ValueError(
+                    f"Shard {shard_file} has shape {latents.shape} ({latents.dtype}) "
+                    f"but {len(indices)} samples like {shards[0].shape[1:]} "
+                    f"({shards[0].dtype}) are expected."
+                )
+
+        tmp_file = path.with_name(path.stem + ".tmp" + path.suffix)
+        merged = np.lib.format.open_memmap(
+            tmp_file,
+            mode="w+",
+            dtype=shards[0].dtype,
+            shape=(total, *shards[0].shape[1:]),
+        )
+        for shard, latents in enumerate(shards):
+            indices = shard_indices(total, shard, num_shards)
+            merged[indices.start : indices.stop] = latents
+        merged.flush()  # type: ignore
+        del merged, shards
+        os.replace(tmp_file, path)
+        progress_path(path).unlink(missing_ok=True)
+        for shard_file in paths:
+            shard_file.unlink()
+        return True
+    finally:
+        os.close(fd)
+        lock_file.unlink()
+
+
+def get_device(shard: tuple[int, int] | None = None) -> torch.device:
+    """Device to extract with, shards are spread over the available GPUs."""
+    if not torch.cuda.is_available():
+        return torch.device("cpu")
+    if shard is None:
+        return torch.device("cuda")
+    return torch.device(f"cuda:{shard[0] % torch.cuda.device_count()}")
+
+
+def _run_shard(extract_fn: Callable[..., Any], num_threads: int, **kwargs: Any) -> Any:
+    torch.set_num_threads(num_threads)
+    return extract_fn(**kwargs)
+
+
+def run_sharded(extract_fn: Callable[..., Any], workers: int, **kwargs: Any):
+    """
+    Runs `extract_fn(**kwargs, shard=(shard, workers))` for every shard, each in its
+    own process. The CPU threads are split between the processes.
+    """
+    num_threads = max(1, (os.cpu_count() or 1) // workers)
+    with ProcessPoolExecutor(
+        workers, mp_context=multiprocessing.get_context("spawn")
+    ) as executor:
+        futures = [
+            executor.submit(
+                _run_shard, extract_fn, num_threads, **kwargs, shard=(shard, workers)
+            )
+            for shard in range(workers)
+        ]
+        for future in futures:
+            future.result()
+
+
+def stream_latents(
+    path: Path,
+    dataloader: Iterable[Any],
+    encode: Callable[[Any], torch.Tensor],
+    force: bool = False,
+    shard: tuple[int, int] | None = None,
+) -> bool:
+    """
+    Encodes all the samples of the dataloader and writes each batch directly in its
+    slice of the memory-mapped `path`.
+
+    The number of written samples is saved in `path` + ".progress" after each batch
+    (and removed at the end) so that an interrupted extraction resumes from the
+    last written batch.
+
+    Args:
+        path (`Path`): path of the .npy file to create
+        dataloader (`Iterable[Any]`): dataloader (or single `CombinedLoader`) that
+            is not shuffled
+        encode (`Callable[[Any], torch.Tensor]`): returns the latents of a batch of
+            the dataloader
+        force (`bool`): start from scratch even if a previous extraction was
+            interrupted
+        shard (`tuple[int, int] | None`): (shard, num_shards) to only extract the
+            shard-th part of the dataset in its own file (see `shard_path`). The
+            shards are merged into `path` by the last shard to finish.
+
+    Returns:
+        `bool`: whether `path` was completed by this call (always the case without
+        shards).
+    """
+    loader = get_torch_dataloader(dataloader)
+    dataset = loader.dataset
+    dataset_size = len(dataset)  # type: ignore
+    if shard is None:
+        indices = range(dataset_size)
+        out_path = path
+    else:
+        indices = shard_indices(dataset_size, *shard)
+        out_path = shard_path(path, *shard)
+        if not len(indices):
+            raise ValueError(f"Shard {shard} of the {dataset_size} samples is empty.")
+    total = len(indices)
+
+    n_done = 0
+    latents: np.ndarray | None = None
+    if is_extracted(out_path) and shard is not None and not force:
+        n_done = total
+    elif progress_path(out_path).exists() and out_path.exists() and not force:
+        progress = json.loads(progress_path(out_path).read_text())
+        latents = np.load(out_path, mmap_mode="r+")
+        if progress["total"] != total or latents.shape[0] != total:
+            raise ValueError(
+                f"Cannot resume {out_path}: it was started with {progress['total']} "
+                f"samples but {total} are expected. Use --force to restart."
+            )
+        n_done = progress["n_done"]
+        click.echo(f"Resuming from sample {n_done}/{total}.")
+
+    remaining = DataLoader(
+        Subset(dataset, indices[n_done:]),
+        batch_size=loader.batch_size,
+        num_workers=loader.num_workers,
+        collate_fn=loader.collate_fn,
+        pin_memory=loader.pin_memory,
+    )
+    for batch in tqdm(iter(remaining), total=len(remaining)):
+        latent = encode(batch).detach().cpu().numpy()
+        if latents is None:
+            # mark the file as incomplete before creating it, so that an
+            # interruption never leaves a file that looks extracted
+            save_progress(out_path, 0, total)
+            metadata_path(path).unlink(missing_ok=True)
+            latents = np.lib.format.open_memmap(
+                out_path,
+                mode="w+",
+                dtype=latent.dtype,
+                shape=(total, *latent.shape[1:]),
+            )
+        latents[n_done : n_done + latent.shape[0]] = latent
+        latents.flush()  # type: ignore
+        n_done += latent.shape[0]
+        save_progress(out_path, n_done, total)
+
+    progress_path(out_path).unlink(missing_ok=True)
+    if shard is not None:
+        return merge_shards(path, dataset_size, shard[1])
+    return True
+
+
+def text_bert(x: Text) -> dict[str, torch.Tensor]:
+    return {"bert": x.bert}
+
+
+def save_latents(
+    domain: Literal["v", "attr", "t"],
+    checkpoint_path: Path,
     config_path: Path,
     dataset_path: Path | None = None,
     latent_name: str | None = None,
@@ -28,6 +273,9 @@ def save_v_latents(
     extra_config_files: list[str] | None = None,
     force: bool = False,
     argv: list[str] | None = None,
+    shard: tuple[int, int] | None = None,
+    workers: int = 1,
+    storage: LatentStorage = "float32",
 ):
     if debug_mode is None:
         debug_mode = DEBUG_MODE
@@ -47,40 +295,109 @@ def save_v_latents(
     if dataset_path is None:
         dataset_path = config.dataset.path
 
-    latent_name = latent_name or (checkpoin_path.stem + ".npy")
-    train_path = dataset_path / f"saved_latents/train/{latent_name}"
-    if train_path.exists() and not force:
+    latent_name = latent_name or (checkpoint_path.stem + ".npy")
+    paths = {
+        split: dataset_path / f"saved_latents/{split}/{latent_name}"
+        for split in ["train", "val", "test"]
+    }
+    if all(is_extracted(path) for path in paths.values()) and not force:
         click.echo("Latent file already exists. Skipping.")
         return
-    elif train_path.exists():
+    elif any(is_extracted(path) for path in paths.values()) and force:
         click.echo("Latent file already exists. Overriding.")
 
+    if workers > 1:
+        run_sharded(
+            save_latents,
+            workers,
+            domain=domain,
+            checkpoint_path=checkpoint_path,
+            config_path=config_path,
+            dataset_path=dataset_path,
+            latent_name=latent_name,
+            debug_mode=debug_mode,
+            log_config=log_config,
+            extra_config_files=extra_config_files,
+            force=force,
+            argv=argv,
+            storage=storage,
+        )
+        return
+
+    device = get_device(shard)
     additional_transforms: dict[str, list[Callable[[Any], Any]]] = {}
-    if config.domain_modules.visual.color_blind:
-        additional_transforms["v"] = [color_blind_visual_domain]
+    domain_args: dict[str, Any] = {}
+    module: DomainModule
+    encode: Callable[[Any], torch.Tensor]
+    match domain:
+        case "v":
+            if config.domain_modules.visual.color_blind:
+                additional_transforms["v"] = [color_blind_visual_domain]
+            visual_domain = cast(
+                VisualDomainModule,
+                load_pretrained_module(
+                    LoadedDomainConfig(
+                        domain_type=DomainModuleVariant.v,
+                        checkpoint_path=checkpoint_path,
+                    )
+                ),
+            )
+            module = visual_domain
+
+            def encode(batch: Any) -> torch.Tensor:
+                return visual_domain.encode(batch["v"].to(device))
+
+        case "attr":
+            if config.domain_modules.attribute.nullify_rotation:
+                additional_transforms["attr"] = [nullify_attribute_rotation]
+            domain_args["attr"] = config.domain_data_args.get("attr", {})
+            attr_domain = cast(
+                AttributeDomainModule,
+                load_pretrained_module(
+                    LoadedDomainConfig(
+                        domain_type=DomainModuleVariant.attr,
+                        checkpoint_path=checkpoint_path,
+                    )
+                ),
+            )
+            module = attr_domain
+
+            def encode(batch: Any) -> torch.Tensor:
+                # without the unpaired attributes
+                return attr_domain.encode([x.to(device) for x in batch["attr"][:2]])
+
+        case "t":
+            additional_transforms["t"] = [text_bert]
+            domain_args["t"] = {
+                "latent_filename": config.domain_modules.text.latent_filename
+            }
+            text_domain = cast(
+                GRUTextDomainModule,
+                load_pretrained_module(
+                    LoadedDomainConfig(
+                        domain_type=DomainModuleVariant.t,
+                        checkpoint_path=checkpoint_path,
+                    )
+                ),
+            )
+            module = text_domain
+
+            def encode(batch: Any) -> torch.Tensor:
+                return text_domain.encode({"bert": batch["t"]["bert"].to(device)})
 
     data_module = SimpleShapesDataModule(
         dataset_path,
-        get_default_domains(["v"]),
-        {frozenset(["v"]): 1.0},
+        get_default_domains([domain]),
+        {frozenset([domain]): 1.0},
         batch_size=config.training.batch_size,
         num_workers=config.training.num_workers,
         seed=config.seed,
+        domain_args=domain_args,
         additional_transforms=additional_transforms,
     )
 
-    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-
-    visual_domain = cast(
-        VisualDomainModule,
-        load_pretrained_module(
-            LoadedDomainConfig(
-                domain_type=DomainModuleVariant.v, checkpoint_path=checkpoin_path
-            )
-        ),
-    )
-    visual_domain.to(device)
-    visual_domain.freeze()
+    module.to(device)
+    module.freeze()
 
     data_module.prepare_data()
     data_module.setup()
@@ -93,37 +410,222 @@ def save_v_latents(
     (dataset_path / "saved_latents").mkdir(exist_ok=True)
 
     for split, dataloader in dataloaders.items():
-        latents: list[np.ndarray] = []
+        path = paths[split]
+        if is_extracted(path) and not force:
+            print(f"{split} already extracted in {path}.")
+            continue
 
         (dataset_path / "saved_latents" / split).mkdir(exist_ok=True)
+        print(f"Saving {split} in {path}.")
+        if stream_latents(path, dataloader, encode, force, shard) and (
+            storage != "float32"
+        ):
+            metadata = convert_latents(path, storage)
+            click.echo(
+                f"Converted to {storage}: RMSE={metadata['rmse']:.3g}, "
+                f"max abs error={metadata['max_abs_error']:.3g}, "
+                f"relative error={metadata['relative_error']:.3g}."
+            )
+
+
+def parse_shard(
+    ctx: click.Context, param: click.Parameter, value: str | None
+) -> tuple[int, int] | None:
+    if value is None:
+        return None
+    try:
+        shard, num_shards = (int(part) for part in value.split("/"))
+    except ValueError as e:
+        raise click.BadParameter('should be "i/N", e.g. "0/4".') from e
+    if not 0 <= shard < num_shards:
+        raise click.BadParameter("i should be in [0, N).")
+    return shard, num_shards
+
 
-        print(f"Saving {split}.")
-        for batch, _, _ in tqdm(iter(dataloader), total=len(dataloader)):
-            if split == "train":
-                images = batch[frozenset(["v"])]["v"].to(device)
-            else:
-                images = batch["v"].to(device)
-            latent = visual_domain.encode(images)
-            latents.append(latent.detach().cpu().numpy())
+def make_save_latents_command(
+    domain: Literal["v", "attr", "t"], help: str
+) -> click.Command:
+    @click.command(
+        domain,
+        context_settings={
+            "ignore_unknown_options": True,
+            "allow_extra_args": True,
+        },
+        help=help,
+    )
+    @click.argument(
+        "model_checkpoint",
+        type=click.Path(exists=True, file_okay=True, dir_okay=False, path_type=Path),  # type: ignore
+    )
+    @click.option(
+        "--config_path",
+        "-c",
+        default="./config",
+        type=click.Path(exists=True, dir_okay=True, file_okay=False, path_type=Path),  # type: ignore
+    )
+    @click.option(
+        "--dataset_path",
+        "-p",
+        default=None,
+        type=click.Path(exists=True, file_okay=False, dir_okay=True, path_type=Path),  # type: ignore
+    )
+    @click.option(
+        "--latent_name",
+        "-n",
+        default=None,
+        type=str,
+        help="Name of the latent file to use in `presaved_path`.",
+    )
+    @click.option("--debug", "-d", is_flag=True, default=None)
+    @click.option("--log_config", is_flag=True, default=False)
+    @click.option(
+        "--extra_config_files",
+        "-e",
+        multiple=True,
+        type=str,
+        help=(
+            "Additional files to `local.yaml` to load in the config path. "
+            f"By default `save_{domain}_latents.yaml`"
+        ),
+    )
+    @click.option(
+        "--force",
+        is_flag=True,
+        default=False,
+        type=bool,
+        help="If the file already exist, his will override with a new file.",
+    )
+    @click.option(
+        "--workers",
+        "-w",
+        default=1,
+        type=click.IntRange(min=1),
+        help="Number of processes extracting a shard of each split in parallel.",
+    )
+    @click.option(
+        "--shard",
+        default=None,
+        callback=parse_shard,
+        help=(
+            'Only extract the shard "i/N" of each split (e.g. from several jobs). '
+            "The last shard to finish merges them."
+        ),
+    )
+    @click.option(
+        "--storage",
+        default="float32",
+        type=click.Choice(get_args(LatentStorage)),
+        help=(
+            "Storage of the latents. int8 is quantized per dimension. "
+            "The reconstruction error is reported after conversion."
+        ),
+    )
+    @click.pass_context
+    def save_latents_command(
+        ctx: click.Context,
+        model_checkpoint: Path,
+        config_path: Path,
+        dataset_path: Path | None,
+        latent_name: str | None,
+        debug: bool | None,
+        log_config: bool,
+        extra_config_files: list[str],
+        force: bool = False,
+        workers: int = 1,
+        shard: tuple[int, int] | None = None,
+        storage: LatentStorage = "float32",
+    ):
+        if workers > 1 and shard is not None:
+            raise click.UsageError("--workers and --shard cannot be used together.")
+        return save_latents(
+            domain,
+            model_checkpoint,
+            config_path,
+            dataset_path,
+            latent_name,
+            debug,
+            log_config,
+            extra_config_files if len(extra_config_files) else None,
+            force,
+            ctx.args,
+            shard,
+            workers,
+            storage,
+        )
+
+    return save_latents_command
+
+
+save_v_latents_command = make_save_latents_command(
+    "v", "Extract and save the visual VAE latent representations."
+)
+save_attr_latents_command = make_save_latents_command(
+    "attr", "Extract and save the attribute VAE latent representations."
+)
+save_t_latents_command = make_save_latents_command(
+    "t", "Extract and save the text latent representations (projected BERT vectors)."
+)
+
+
+def save_tokens(
+    config_path: Path,
+    dataset_path: Path | None = None,
+    debug_mode: bool | None = None,
+    log_config: bool = False,
+    extra_config_files: list[str] | None = None,
+    force: bool = False,
+    argv: list[str] | None = None,
+):
+    if debug_mode is None:
+        debug_mode = DEBUG_MODE
+    if argv is None:
+        argv = []
+
+    LOGGER.debug(f"Debug mode: {debug_mode}")
+
+    config = load_config(
+        config_path,
+        load_files=extra_config_files,
+        debug_mode=debug_mode,
+        log_config=log_config,
+        argv=argv,
+    )
+
+    if dataset_path is None:
+        dataset_path = config.dataset.path
 
-        latent_vectors = np.concatenate(latents, axis=0)
+    text_config = config.domain_modules.text
+    path = tokens_cache_path(
+        dataset_path,
+        text_config.vocab_path,
+        text_config.merges_path,
+        text_config.seq_length,
+    )
+    if path.exists() and not force:
+        click.echo("Token file already exists. Skipping.")
+        return
+    elif path.exists():
+        click.echo("Token file already exists. Overriding.")
 
-        path = dataset_path / f"saved_latents/{split}/{latent_name}"
-        print(f"Saving in {path}.")
-        np.save(path, latent_vectors)
+    path = save_tokens_cache(
+        dataset_path,
+        text_config.vocab_path,
+        text_config.merges_path,
+        text_config.seq_length,
+    )
+    print(f"Saved in {path}.")
 
 
 @click.command(
-    "v",
+    "tokens",
     context_settings={
         "ignore_unknown_options": True,
         "allow_extra_args": True,
     },
-    help="Extract and save the visual VAE latent representations.",
-)
-@click.argument(
-    "model_checkpoint",
-    type=click.Path(exists=True, file_okay=True, dir_okay=False, path_type=Path),  # type: ignore
+    help=(
+        "Tokenize and save the captions of all splits "
+        "(used with `domain_modules.text.tokenization: cache`)."
+    ),
 )
 @click.option(
     "--config_path",
@@ -137,13 +639,6 @@ def save_v_latents(
     default=None,
     type=click.Path(exists=True, file_okay=False, dir_okay=True, path_type=Path),  # type: ignore
 )
-@click.option(
-    "--latent_name",
-    "-n",
-    default=None,
-    type=str,
-    help="Name of the latent file to use in `presaved_path`.",
-)
 @click.option("--debug", "-d", is_flag=True, default=None)
 @click.option("--log_config", is_flag=True, default=False)
 @click.option(
@@ -151,10 +646,7 @@ def save_v_latents(
     "-e",
     multiple=True,
     type=str,
-    help=(
-        "Additional files to `local.yaml` to load in the config path. "
-        "By default `save_v_latents.yaml`"
-    ),
+    help="Additional files to `local.yaml` to load in the config path.",
 )
 @click.option(
     "--force",
@@ -164,22 +656,18 @@ def save_v_latents(
     help="If the file already exist, his will override with a new file.",
 )
 @click.pass_context
-def save_v_latents_command(
+def save_tokens_command(
     ctx: click.Context,
-    model_checkpoint: Path,
     config_path: Path,
     dataset_path: Path | None,
-    latent_name: str | None,
     debug: bool | None,
     log_config: bool,
     extra_config_files: list[str],
     force: bool = False,
 ):
-    return save_v_latents(
-        model_checkpoint,
+    return save_tokens(
         config_path,
         dataset_path,
-        latent_name,
         debug,
         log_config,
         extra_config_files if len(extra_config_files) else None,
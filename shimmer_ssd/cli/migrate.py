@@ -2,10 +2,8 @@ from pathlib import Path
 from typing import Literal
 
 import click
-from shimmer import migrate_model as migrate_shimmer_model
 
 from shimmer_ssd import PROJECT_DIR
-from shimmer_ssd.ckpt_migrations import migrate_model
 
 
 def migrate_domains(
@@ -13,6 +11,10 @@ def migrate_domains(
     migration_path: Path | None = None,
     migration_type: Literal["gw", "attr_mod", "text_mod", "visual_mod"] = "gw",
 ):
+    from shimmer import migrate_model as migrate_shimmer_model
+
+    from shimmer_ssd.ckpt_migrations import migrate_model
+
     default_path = PROJECT_DIR / "shimmer_ssd" / "migrations"
     migrate_shimmer_model(checkpoint_path, weights_only=False)
     migrate_model(
@@ -19,7 +19,9 @@ from shimmer_ssd.ckpt_migrations import (
 )
 from shimmer_ssd.config import load_config
 from shimmer_ssd.logging import LogAttributesCallback
+from shimmer_ssd.modules.compile import compile_step
 from shimmer_ssd.modules.domains.attribute import AttributeDomainModule
+from shimmer_ssd.profiling import ProfilingCallback, ThroughputCallback
 
 
 def train_attr_domain(
@@ -94,6 +96,23 @@ def train_attr_domain(
         ),
     ]
 
+    if config.logging.log_throughput_every_n_steps is not None:
+        callbacks.append(
+            ThroughputCallback(config.logging.log_throughput_every_n_steps)
+        )
+
+    if config.training.profiling.enabled:
+        callbacks.append(
+            ProfilingCallback(
+                config.training.profiling,
+                media_callbacks=[
+                    callback
+                    for callback in callbacks
+                    if isinstance(callback, LogAttributesCallback)
+                ],
+            )
+        )
+
     if config.training.enable_progress_bar:
         callbacks.append(RichProgressBar())
 
@@ -138,6 +157,9 @@ def train_attr_domain(
 
     torch.set_float32_matmul_precision(config.training.float32_matmul_precision)
 
+    if config.training.compile.enabled:
+        compile_step(attr_domain_module, config.training.compile)
+
     trainer = pl.Trainer(
         logger=wandb_logger,
         fast_dev_run=config.training.fast_dev_run,
@@ -1,5 +1,5 @@
 import logging
-from collections.abc import Callable
+from collections.abc import Callable, Mapping
 from typing import Any
 
 import click
@@ -14,6 +14,7 @@ from lightning.pytorch.callbacks import (
 from lightning.pytorch.loggers.wandb import WandbLogger
 from shimmer import (
     ContrastiveLossType,
+    DomainModule,
     GlobalWorkspaceBase,
     SaveMigrations,
 )
@@ -22,51 +23,47 @@ from shimmer.modules.global_workspace import (
     GlobalWorkspaceFusion,
 )
 from simple_shapes_dataset import (
-    SimpleShapesDataModule,
     color_blind_visual_domain,
-    get_default_domains,
     nullify_attribute_rotation,
 )
 from torch import set_float32_matmul_precision
+from torch.nn import Module
 from torch.optim.lr_scheduler import OneCycleLR
 from torch.optim.optimizer import Optimizer
 
 from shimmer_ssd import DEBUG_MODE, LOGGER
-from shimmer_ssd.config import load_config
-from shimmer_ssd.dataset.pre_process import TokenizeCaptions
-from shimmer_ssd.logging import LogGWImagesCallback
-from shimmer_ssd.modules.contrastive_loss import VSEPPContrastiveLoss
+from shimmer_ssd.config import Config, load_config
+from shimmer_ssd.dataset.data_module import BatchTransformsDataModule
+from shimmer_ssd.dataset.latents import get_domain_classes
+from shimmer_ssd.dataset.pre_process import get_text_transform
+from shimmer_ssd.logging import AsyncMediaLogger, LogGWImagesCallback
+from shimmer_ssd.modules.compile import compile_modules
+from shimmer_ssd.modules.contrastive_loss import (
+    ContrastiveLossStepCallback,
+    VSEPPContrastiveLoss,
+)
 from shimmer_ssd.modules.domains import load_pretrained_domains
+from shimmer_ssd.profiling import ProfilingCallback, ThroughputCallback
 
 
-def train_gw(
-    config_path: Path,
-    debug_mode: bool | None = None,
-    log_config: bool = False,
-    extra_config_files: list[str] | None = None,
-    argv: list[str] | None = None,
-):
-    if debug_mode is None:
-        debug_mode = DEBUG_MODE
-    if extra_config_files is None:
-        extra_config_files = ["train_gw.yaml"]
-    if argv is None:
-        argv = []
-
-    LOGGER.debug(f"Debug mode: {debug_mode}")
-
-    config = load_config(
-        config_path,
-        load_files=extra_config_files,
-        debug_mode=debug_mode,
-        log_config=log_config,
-        argv=argv,
-    )
+def get_data_module(
+    config: Config, dataset_path: Path | None = None
+) -> BatchTransformsDataModule:
+    """
+    Data module of the GW training.
 
-    seed_everything(config.seed, workers=True)
+    Args:
+        config (`Config`): the config
+        dataset_path (`Path | None`): path to the dataset. Defaults to
+            `config.dataset.path`.
+    """
+    if dataset_path is None:
+        dataset_path = config.dataset.path
 
-    domain_classes = get_default_domains(
-        {domain.domain_type.kind.value for domain in config.domains}
+    domain_classes = get_domain_classes(
+        {domain.domain_type.kind.value for domain in config.domains},
+        dataset_path,
+        config.domain_data_args,
     )
 
     additional_transforms: dict[str, list[Callable[[Any], Any]]] = {}
@@ -77,15 +74,11 @@ def train_gw(
         logging.info("v domain will be color blind.")
         additional_transforms["v"] = [color_blind_visual_domain]
     additional_transforms["t"] = [
-        TokenizeCaptions(
-            config.domain_modules.text.vocab_path,
-            config.domain_modules.text.merges_path,
-            config.domain_modules.text.seq_length,
-        )
+        get_text_transform(config.domain_modules.text, dataset_path)
     ]
 
-    data_module = SimpleShapesDataModule(
-        config.dataset.path,
+    return BatchTransformsDataModule(
+        dataset_path,
         domain_classes,
         config.domain_proportions,
         batch_size=config.training.batch_size,
@@ -96,25 +89,49 @@ def train_gw(
         additional_transforms=additional_transforms,
     )
 
-    domain_modules, gw_encoders, gw_decoders = load_pretrained_domains(
-        config.domains,
-        config.global_workspace.latent_dim,
-        config.global_workspace.encoders.hidden_dim,
-        config.global_workspace.encoders.n_layers,
-        config.global_workspace.decoders.hidden_dim,
-        config.global_workspace.decoders.n_layers,
-        is_linear=config.global_workspace.linear_domains,
-        bias=config.global_workspace.linear_domains_use_bias,
+
+def get_contrastive_fn(config: Config) -> ContrastiveLossType | None:
+    """
+    The VSEPP contrastive loss if enabled in the config, None for the default
+    contrastive loss.
+    """
+    if not config.global_workspace.vsepp_contrastive_loss:
+        return None
+
+    # the contrastive loss is called at each step for each group of exactly two
+    # domains
+    domain_pairs = {
+        domains
+        for domains, proportion in config.domain_proportions.items()
+        if proportion > 0 and len(domains) == 2
+    }
+    return VSEPPContrastiveLoss(
+        config.global_workspace.vsepp_margin,
+        config.global_workspace.vsepp_measure,
+        config.global_workspace.vsepp_max_violation,
+        torch.tensor([1 / 0.07]).log(),
+        config.global_workspace.vsepp_order_tile_size,
+        config.global_workspace.vsepp_clip_metric_every_n_steps,
+        config.global_workspace.vsepp_queue_size,
+        max(len(domain_pairs), 1),
+        config.global_workspace.contrastive_micro_batch_size,
     )
 
-    contrastive_fn: ContrastiveLossType | None = None
-    if config.global_workspace.vsepp_contrastive_loss:
-        contrastive_fn = VSEPPContrastiveLoss(
-            config.global_workspace.vsepp_margin,
-            config.global_workspace.vsepp_measure,
-            config.global_workspace.vsepp_max_violation,
-            torch.tensor([1 / 0.07]).log(),
-        )
+
+def get_gw_module(
+    config: Config,
+    domain_modules: Mapping[str, DomainModule],
+    gw_encoders: Mapping[str, Module],
+    gw_decoders: Mapping[str, Module],
+) -> tuple[GlobalWorkspaceBase, str]:
+    """
+    Global Workspace to train, with its optimizer and scheduler config.
+
+    Returns:
+        `tuple[GlobalWorkspaceBase, str]`: the GW module and its type ("gw" or
+        "gw_fusion")
+    """
+    contrastive_fn = get_contrastive_fn(config)
 
     def get_scheduler(optimizer: Optimizer) -> OneCycleLR:
         return OneCycleLR(
@@ -127,11 +144,8 @@ def train_gw(
             / config.training.optim.end_lr,
         )
 
-    module: GlobalWorkspaceBase
-    gw_type: str
     if config.global_workspace.use_fusion_model:
-        gw_type = "gw_fusion"
-        module = GlobalWorkspaceFusion(
+        return GlobalWorkspaceFusion(
             domain_modules,
             gw_encoders,
             gw_decoders,
@@ -143,21 +157,65 @@ def train_gw(
             learn_logit_scale=config.global_workspace.learn_logit_scale,
             contrastive_loss=contrastive_fn,
             scheduler=get_scheduler,
-        )
-    else:
-        gw_type = "gw"
+        ), "gw_fusion"
 
-        module = GlobalWorkspace2Domains(
-            domain_modules,
-            gw_encoders,
-            gw_decoders,
-            config.global_workspace.latent_dim,
-            config.global_workspace.loss_coefficients,
-            config.training.optim.lr,
-            config.training.optim.weight_decay,
-            learn_logit_scale=config.global_workspace.learn_logit_scale,
-            contrastive_loss=contrastive_fn,
-            scheduler=get_scheduler,
+    return GlobalWorkspace2Domains(
+        domain_modules,
+        gw_encoders,
+        gw_decoders,
+        config.global_workspace.latent_dim,
+        config.global_workspace.loss_coefficients,
+        config.training.optim.lr,
+        config.training.optim.weight_decay,
+        learn_logit_scale=config.global_workspace.learn_logit_scale,
+        contrastive_loss=contrastive_fn,
+        scheduler=get_scheduler,
+    ), "gw"
+
+
+def train_gw(
+    config_path: Path,
+    debug_mode: bool | None = None,
+    log_config: bool = False,
+    extra_config_files: list[str] | None = None,
+    argv: list[str] | None = None,
+):
+    if debug_mode is None:
+        debug_mode = DEBUG_MODE
+    if extra_config_files is None:
+        extra_config_files = ["train_gw.yaml"]
+    if argv is None:
+        argv = []
+
+    LOGGER.debug(f"Debug mode: {debug_mode}")
+
+    config = load_config(
+        config_path,
+        load_files=extra_config_files,
+        debug_mode=debug_mode,
+        log_config=log_config,
+        argv=argv,
+    )
+
+    seed_everything(config.seed, workers=True)
+
+    data_module = get_data_module(config)
+
+    domain_modules, gw_encoders, gw_decoders = load_pretrained_domains(
+        config.domains,
+        config.global_workspace.latent_dim,
+        config.global_workspace.encoders.hidden_dim,
+        config.global_workspace.encoders.n_layers,
+        config.global_workspace.decoders.hidden_dim,
+        config.global_workspace.decoders.n_layers,
+        is_linear=config.global_workspace.linear_domains,
+        bias=config.global_workspace.linear_domains_use_bias,
+    )
+
+    module, gw_type = get_gw_module(config, domain_modules, gw_encoders, gw_decoders)
+    if config.training.compile.enabled:
+        compile_modules(
+            [*gw_encoders.values(), *gw_decoders.values()], config.training.compile
         )
 
     train_samples = data_module.get_samples("train", 32)
@@ -170,6 +228,10 @@ def train_gw(
             test_samples[frozenset([domain])] = {domain: test_samples[domains][domain]}
         break
 
+    media_logger = None
+    if config.logging.async_media_logging:
+        media_logger = AsyncMediaLogger(config.logging.media_logging_queue_size)
+
     callbacks: list[Callback] = [
         LearningRateMonitor(logging_interval="step"),
         LogGWImagesCallback(
@@ -178,6 +240,7 @@ def train_gw(
             mode="val",
             every_n_epochs=config.logging.log_val_medias_every_n_epochs,
             filter=config.logging.filter_images,
+            media_logger=media_logger,
             vocab=config.domain_modules.text.vocab_path,
             merges=config.domain_modules.text.merges_path,
         ),
@@ -187,6 +250,7 @@ def train_gw(
             mode="test",
             every_n_epochs=None,
             filter=config.logging.filter_images,
+            media_logger=media_logger,
             vocab=config.domain_modules.text.vocab_path,
             merges=config.domain_modules.text.merges_path,
         ),
@@ -196,6 +260,7 @@ def train_gw(
             mode="train",
             every_n_epochs=config.logging.log_train_medias_every_n_epochs,
             filter=config.logging.filter_images,
+            media_logger=media_logger,
             vocab=config.domain_modules.text.vocab_path,
             merges=config.domain_modules.text.merges_path,
         ),
@@ -224,6 +289,7 @@ def train_gw(
                     mode="val",
                     every_n_epochs=config.logging.log_val_medias_every_n_epochs,
                     filter=config.logging.filter_images,
+                    media_logger=media_logger,
                 ),
                 LogGWImagesCallback(
                     val_samples_ood,
@@ -231,6 +297,7 @@ def train_gw(
                     mode="test",
                     every_n_epochs=None,
                     filter=config.logging.filter_images,
+                    media_logger=media_logger,
                 ),
                 LogGWImagesCallback(
                     train_samples_ood,
@@ -238,10 +305,31 @@ def train_gw(
                     mode="train",
                     every_n_epochs=config.logging.log_train_medias_every_n_epochs,
                     filter=config.logging.filter_images,
+                    media_logger=media_logger,
                 ),
             ]
         )
 
+    if config.global_workspace.vsepp_contrastive_loss:
+        callbacks.append(ContrastiveLossStepCallback())
+
+    if config.logging.log_throughput_every_n_steps is not None:
+        callbacks.append(
+            ThroughputCallback(config.logging.log_throughput_every_n_steps)
+        )
+
+    if config.training.profiling.enabled:
+        callbacks.append(
+            ProfilingCallback(
+                config.training.profiling,
+                media_callbacks=[
+                    callback
+                    for callback in callbacks
+                    if isinstance(callback, LogGWImagesCallback)
+                ],
+            )
+        )
+
     if config.training.enable_progress_bar:
         callbacks.append(RichProgressBar())
 
@@ -11,14 +11,17 @@ from lightning.pytorch.callbacks import (
 )
 from lightning.pytorch.loggers.wandb import WandbLogger
 from migrate_ckpt.migrate import get_folder_migrations
-from simple_shapes_dataset import SimpleShapesDataModule, get_default_domains
+from simple_shapes_dataset import get_default_domains
 
 from shimmer_ssd import DEBUG_MODE, LOGGER, PROJECT_DIR
 from shimmer_ssd.ckpt_migrations import SaveMigrations
 from shimmer_ssd.config import load_config
-from shimmer_ssd.dataset.pre_process import TokenizeCaptions
+from shimmer_ssd.dataset.data_module import BatchTransformsDataModule
+from shimmer_ssd.dataset.pre_process import get_text_transform
 from shimmer_ssd.logging import LogTextCallback
+from shimmer_ssd.modules.compile import compile_step
 from shimmer_ssd.modules.domains.text import GRUTextDomainModule
+from shimmer_ssd.profiling import ProfilingCallback, ThroughputCallback
 
 
 def train_t_domain(
@@ -47,7 +50,7 @@ def train_t_domain(
 
     pl.seed_everything(config.seed, workers=True)
 
-    data_module = SimpleShapesDataModule(
+    data_module = BatchTransformsDataModule(
         config.dataset.path,
         get_default_domains(["t"]),
         {frozenset(["t"]): 1.0},
@@ -57,13 +60,7 @@ def train_t_domain(
             "t": {"latent_filename": config.domain_modules.text.latent_filename}
         },
         additional_transforms={
-            "t": [
-                TokenizeCaptions(
-                    config.domain_modules.text.vocab_path,
-                    config.domain_modules.text.merges_path,
-                    config.domain_modules.text.seq_length,
-                )
-            ]
+            "t": [get_text_transform(config.domain_modules.text, config.dataset.path)]
         },
     )
 
@@ -107,6 +104,23 @@ def train_t_domain(
         ),
     ]
 
+    if config.logging.log_throughput_every_n_steps is not None:
+        callbacks.append(
+            ThroughputCallback(config.logging.log_throughput_every_n_steps)
+        )
+
+    if config.training.profiling.enabled:
+        callbacks.append(
+            ProfilingCallback(
+                config.training.profiling,
+                media_callbacks=[
+                    callback
+                    for callback in callbacks
+                    if isinstance(callback, LogTextCallback)
+                ],
+            )
+        )
+
     if config.training.enable_progress_bar:
         callbacks.append(RichProgressBar())
 
@@ -151,6 +165,9 @@ def train_t_domain(
 
     torch.set_float32_matmul_precision(config.training.float32_matmul_precision)
 
+    if config.training.compile.enabled:
+        compile_step(text_domain_module, config.training.compile)
+
     trainer = pl.Trainer(
         logger=wandb_logger,
         fast_dev_run=config.training.fast_dev_run,
@@ -22,7 +22,9 @@ from shimmer_ssd import DEBUG_MODE, LOGGER, PROJECT_DIR
 from shimmer_ssd.ckpt_migrations import SaveMigrations
 from shimmer_ssd.config import load_config
 from shimmer_ssd.logging import LogVisualCallback
+from shimmer_ssd.modules.compile import compile_step
 from shimmer_ssd.modules.domains.visual import VisualDomainModule
+from shimmer_ssd.profiling import ProfilingCallback, ThroughputCallback
 
 
 def train_visual_domain(
@@ -102,6 +104,23 @@ def train_visual_domain(
         ),
     ]
 
+    if config.logging.log_throughput_every_n_steps is not None:
+        callbacks.append(
+            ThroughputCallback(config.logging.log_throughput_every_n_steps)
+        )
+
+    if config.training.profiling.enabled:
+        callbacks.append(
+            ProfilingCallback(
+                config.training.profiling,
+                media_callbacks=[
+                    callback
+                    for callback in callbacks
+                    if isinstance(callback, LogVisualCallback)
+                ],
+            )
+        )
+
     if config.training.enable_progress_bar:
         callbacks.append(RichProgressBar())
 
@@ -147,6 +166,9 @@ def train_visual_domain(
 
     torch.set_float32_matmul_precision(config.training.float32_matmul_precision)
 
+    if config.training.compile.enabled:
+        compile_step(v_domain_module, config.training.compile)
+
     trainer = pl.Trainer(
         logger=wandb_logger,
         fast_dev_run=config.training.fast_dev_run,
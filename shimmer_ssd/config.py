@@ -22,6 +22,7 @@ from simple_shapes_dataset import DomainType
 from typing_extensions import TypedDict
 
 from shimmer_ssd import PROJECT_DIR
+from shimmer_ssd.dataset.latents import LatentDomainType
 
 
 class DomainModuleVariant(Enum):
@@ -45,6 +46,9 @@ class DomainModuleVariant(Enum):
     # Same as "attr" but adds an unpaired attributes (information not available in the
     # other domains).
     attr_unpaired = (DomainType.attr, "unpaired")
+    # Same as "attr", but uses pre-saved latent representations (`ssd extract attr`)
+    # instead of encoding the attributes.
+    attr_latents = (LatentDomainType.attr_latents, "default")
 
     # Visual modules
     # --------------
@@ -64,8 +68,11 @@ class DomainModuleVariant(Enum):
     # Text domain.
     t = (DomainType.t, "default")
     t_attr = (DomainType.t, "t2attr")
+    # Same as "t", but uses pre-saved latent representations (`ssd extract t`)
+    # instead of projecting the BERT vectors.
+    t_latents = (LatentDomainType.t_latents, "default")
 
-    def __init__(self, kind: DomainType, model_variant: str) -> None:
+    def __init__(self, kind: DomainType | LatentDomainType, model_variant: str) -> None:
         """
         The two elements of the tuple are put in the the `kind` and the `model_variant`
         properties.
@@ -120,6 +127,16 @@ class Logging(BaseModel):
     filter_images: Sequence[str] | None = None
     log_train_medias_every_n_epochs: int | None = 10
     log_val_medias_every_n_epochs: int | None = 10
+    # Render and upload the medias in a background thread instead of the training
+    # loop. The callbacks only do the forward passes.
+    async_media_logging: bool = False
+    # Maximum number of medias waiting to be logged by the background thread
+    # before the training loop waits for it.
+    media_logging_queue_size: int = 8
+    # Log the samples per second, the time waiting for the dataloader, the fraction
+    # of the time spent in the steps and the peak memory every n steps (in
+    # "throughput/"). Set to null to disable.
+    log_throughput_every_n_steps: int | None = 50
 
 
 class Slurm(BaseModel):
@@ -158,6 +175,46 @@ class Optim(BaseModel):
     weight_decay: float = 1e-5
 
 
+class Profiling(BaseModel):
+    """
+    Step time breakdown of the training commands (see
+    `shimmer_ssd.profiling.ProfilingCallback`).
+    """
+
+    enabled: bool = False
+    # number of steps used to compute the percentiles
+    window: int = 100
+    # log the percentiles of each stage every n steps
+    log_every_n_steps: int = 50
+    percentiles: Sequence[float] = (50, 90, 99)
+    # Chrome trace of the first `trace_steps` training steps. Defaults to
+    # `{default_root_dir}/profiling_trace.json`. Set `trace_steps` to 0 to disable.
+    trace_path: Path | None = None
+    trace_steps: int = 100
+    # wait for the CUDA kernels before reading the clock, so that each stage
+    # includes its kernels. This slows down the training.
+    cuda_synchronize: bool = True
+
+
+class Compile(BaseModel):
+    """
+    torch.compile of the training steps, see
+    https://pytorch.org/docs/stable/generated/torch.compile.html
+    """
+
+    enabled: bool = False
+    # one of "default", "reduce-overhead", "max-autotune",
+    # "max-autotune-no-cudagraphs"
+    mode: str = "default"
+    # None to only compile a dynamic-shape graph after a shape change (e.g. for the
+    # last batch of an epoch)
+    dynamic: bool | None = None
+    backend: str = "inductor"
+    # fail on graph breaks instead of running the parts that cannot be compiled
+    # eagerly
+    fullgraph: bool = False
+
+
 class Training(BaseModel):
     """
     Training related config.
@@ -187,6 +244,12 @@ class Training(BaseModel):
     # Optimizer config
     optim: Optim = Optim()
 
+    # Step time breakdown
+    profiling: Profiling = Profiling()
+
+    # torch.compile of the training steps
+    compile: Compile = Compile()
+
 
 class ExploreVAE(BaseModel):
     # the VAE checkpoint to use
@@ -283,6 +346,12 @@ class TextModule(BaseModel):
     # max sequence length of text sequence
     seq_length: int = 64
     vocab_size: int = 822
+    # How captions are tokenized in the dataloader workers:
+    # "sample" runs the tokenizer on each sample,
+    # "cache" reads the tokens saved with `ssd extract tokens`,
+    # "batch" tokenizes the whole batch at once after collation, in the dataloader
+    # workers
+    tokenization: Literal["sample", "cache", "batch"] = "sample"
 
     # VAE configuration
     latent_dim: int = 64
@@ -360,6 +429,20 @@ class GlobalWorkspace(BaseModel):
     vsepp_margin: float = 0.2
     vsepp_measure: Literal["cosine", "order"] = "cosine"
     vsepp_max_violation: bool = True
+    # number of rows of the score matrix computed at once by the order measure.
+    # Lower values use less memory, the peak is tile_size x batch_size x latent_dim
+    vsepp_order_tile_size: int = 256
+    # the CLIP loss is logged as a metric with the VSEPP loss. It is computed without
+    # gradient for every domain pair every n training steps. None to never compute it.
+    vsepp_clip_metric_every_n_steps: int | None = 1
+    # size of the FIFO queue of past GW representations used as additional
+    # negatives in the VSEPP loss (one queue per domain pair). 0 to disable.
+    vsepp_queue_size: int = 0
+    # if set, the VSEPP loss (with max violation) computes the score matrix by
+    # micro-batches of rows without gradient to find the hardest negatives, then
+    # only recomputes the needed scores with gradient. The memory is
+    # micro_batch_size x batch_size instead of batch_size x batch_size.
+    contrastive_micro_batch_size: int | None = None
     # whether to use linear encoders and decoders for the GW
     linear_domains: bool = False
     # whether to use bias when using linear encoders and decoders
@@ -0,0 +1,106 @@
+from collections.abc import Callable, Mapping
+from typing import Any
+
+from lightning.pytorch.utilities.combined_loader import CombinedLoader
+from simple_shapes_dataset import SimpleShapesDataModule
+from torch.utils.data import DataLoader
+
+from shimmer_ssd.dataset.pre_process import BatchTransform
+
+
+def apply_batch_transforms(
+    batch: Any, batch_transforms: Mapping[str, Callable[[Any], Any]]
+) -> Any:
+    """
+    Applies the batch transforms to the values of the matching domain keys,
+    wherever they are in the (nested) batch.
+    """
+    if isinstance(batch, Mapping):
+        return {
+            key: batch_transforms[key](value)
+            if isinstance(key, str) and key in batch_transforms
+            else apply_batch_transforms(value, batch_transforms)
+            for key, value in batch.items()
+        }
+    if type(batch) in (list, tuple):
+        return type(batch)(
+            apply_batch_transforms(value, batch_transforms) for value in batch
+        )
+    return batch
+
+
+class BatchTransformsCollate:
+    def __init__(
+        self,
+        collate_fn: Callable[[list[Any]], Any],
+        batch_transforms: Mapping[str, Callable[[Any], Any]],
+    ):
+        """
+        Collate function applying the batch transforms to the collated batch, so
+        that they run in the dataloader workers.
+
+        Args:
+            collate_fn (`Callable[[list[Any]], Any]`): the collate function of the
+                dataloader
+            batch_transforms (`Mapping[str, Callable[[Any], Any]]`): the batch
+                transform of each domain
+        """
+        self.collate_fn = collate_fn
+        self.batch_transforms = batch_transforms
+
+    def __call__(self, samples: list[Any]) -> Any:
+        return apply_batch_transforms(self.collate_fn(samples), self.batch_transforms)
+
+
+class BatchTransformsDataModule(SimpleShapesDataModule):
+    """
+    `SimpleShapesDataModule` that finishes the `BatchTransform`s of the
+    `additional_transforms` on the whole batch, once collated, in the collate
+    function of the dataloaders (so in the dataloader workers).
+    """
+
+    def __init__(
+        self,
+        *args: Any,
+        additional_transforms: Mapping[str, list[Callable[[Any], Any]]] | None = None,
+        **kwargs: Any,
+    ):
+        super().__init__(*args, additional_transforms=additional_transforms, **kwargs)
+        self.batch_transforms: dict[str, Callable[[Any], Any]] = {}
+        for domain, transforms in (additional_transforms or {}).items():
+            for transform in transforms:
+                if isinstance(transform, BatchTransform):
+                    assert domain not in self.batch_transforms, (
+                        "Only one batch transform per domain is supported."
+                    )
+                    self.batch_transforms[domain] = transform.batch_transform
+
+    def _with_batch_transforms(self, loader: Any) -> Any:
+        if not self.batch_transforms:
+            return loader
+        loaders = loader.flattened if isinstance(loader, CombinedLoader) else [loader]
+        for dataloader in loaders:
+            if isinstance(dataloader, DataLoader) and not isinstance(
+                dataloader.collate_fn, BatchTransformsCollate
+            ):
+                dataloader.collate_fn = BatchTransformsCollate(
+                    dataloader.collate_fn, self.batch_transforms
+                )
+        return loader
+
+    def train_dataloader(self, *args: Any, **kwargs: Any) -> Any:
+        return self._with_batch_transforms(super().train_dataloader(*args, **kwargs))
+
+    def val_dataloader(self, *args: Any, **kwargs: Any) -> Any:
+        return self._with_batch_transforms(super().val_dataloader(*args, **kwargs))
+
+    def test_dataloader(self, *args: Any, **kwargs: Any) -> Any:
+        return self._with_batch_transforms(super().test_dataloader(*args, **kwargs))
+
+    def predict_dataloader(self, *args: Any, **kwargs: Any) -> Any:
+        return self._with_batch_transforms(super().predict_dataloader(*args, **kwargs))
+
+    def get_samples(self, *args: Any, **kwargs: Any) -> Any:
+        return apply_batch_transforms(
+            super().get_samples(*args, **kwargs), self.batch_transforms
+        )
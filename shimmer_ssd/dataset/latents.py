@@ -0,0 +1,272 @@
+import json
+import math
+import os
+from collections.abc import Callable, Iterable, Mapping
+from enum import Enum
+from pathlib import Path
+from typing import Any, Literal, NamedTuple
+
+import numpy as np
+import torch
+from simple_shapes_dataset import get_default_domains
+from torch.utils.data import Dataset
+
+
+class LatentDomainDesc(NamedTuple):
+    """Same fields as simple_shapes_dataset's `DomainDesc`."""
+
+    base: str
+    kind: str
+
+
+class LatentDomainType(Enum):
+    """
+    Domains loading the latent representations pre-saved with `ssd extract`,
+    in addition to simple_shapes_dataset's `DomainType`.
+    """
+
+    attr_latents = LatentDomainDesc("attr", "attr_latents")
+    t_latents = LatentDomainDesc("t", "t_latents")
+
+
+LatentStorage = Literal["float32", "float16", "bfloat16", "int8"]
+
+# numpy dtype of the saved array. bfloat16 values are saved as their int16 bits.
+STORAGE_DTYPES: dict[str, type[np.generic]] = {
+    "float32": np.float32,
+    "float16": np.float16,
+    "bfloat16": np.int16,
+    "int8": np.int8,
+}
+
+
+def metadata_path(path: Path) -> Path:
+    """Sidecar file describing the storage of the latent file."""
+    return path.with_name(path.name + ".json")
+
+
+def load_metadata(path: Path) -> dict[str, Any]:
+    if not metadata_path(path).exists():
+        return {"storage": "float32"}
+    return json.loads(metadata_path(path).read_text())
+
+
+class LatentsDequantizer:
+    def __init__(self, metadata: Mapping[str, Any]):
+        """
+        Converts the saved latents back to float32.
+
+        Args:
+            metadata (`Mapping[str, Any]`): the content of the metadata file (see
+                `convert_latents`)
+        """
+        self.storage: LatentStorage = metadata["storage"]
+        if self.storage == "int8":
+            self.scale = torch.tensor(metadata["scale"], dtype=torch.float32)
+            self.zero_point = torch.tensor(metadata["zero_point"], dtype=torch.float32)
+
+    def __call__(self, x: torch.Tensor) -> torch.Tensor:
+        match self.storage:
+            case "float32" | "float16":
+                return x.float()
+            case "bfloat16":
+                return x.view(torch.bfloat16).float()
+            case "int8":
+                return (x.float() - self.zero_point) * self.scale
+
+
+def quantize(x: np.ndarray, metadata: Mapping[str, Any]) -> np.ndarray:
+    """
+    Converts float32 latents to the storage of the metadata.
+    """
+    match metadata["storage"]:
+        case "float32" | "float16":
+            return x.astype(STORAGE_DTYPES[metadata["storage"]])
+        case "bfloat16":
+            return torch.from_numpy(x).to(torch.bfloat16).view(torch.int16).numpy()
+        case "int8":
+            scale = np.asarray(metadata["scale"], dtype=np.float32)
+            zero_point = np.asarray(metadata["zero_point"], dtype=np.float32)
+            return np.clip(np.round(x / scale) + zero_point, -128, 127).astype(np.int8)
+        case storage:
+            raise ValueError(f"Unknown latent storage {storage}.")
+
+
+def convert_latents(
+    path: Path, storage: LatentStorage, chunk_size: int = 65536
+) -> dict[str, Any]:
+    """
+    Converts a float32 latent file to another storage in place and saves its
+    metadata file with the reconstruction errors.
+
+    int8 is quantized per dimension, with the scale and zero point (saved in the
+    metadata) mapping the range of the dimension to [-128, 127].
+
+    Args:
+        path (`Path`): the .npy latent file
+        storage (`LatentStorage`): the storage to convert to
+        chunk_size (`int`): number of samples converted at once
+
+    Returns:
+        `dict[str, Any]`: the metadata, with the "rmse", "max_abs_error" and
+        "relative_error" (RMSE divided by the root mean square of the latents) of
+        the stored latents.
+    """
+    latents = np.load(path, mmap_mode="r")
+    if latents.dtype != np.float32:
+        raise ValueError(f"{path} should be float32 to be converted.")
+
+    metadata: dict[str, Any] = {"storage": storage}
+    if storage == "int8":
+        mins = np.full(latents.shape[1:], np.inf, dtype=np.float32)
+        maxs = np.full(latents.shape[1:], -np.inf, dtype=np.float32)
+        for start in range(0, latents.shape[0], chunk_size):
+            chunk = latents[start : start + chunk_size]
+            mins = np.minimum(mins, chunk.min(axis=0))
+            maxs = np.maximum(maxs, chunk.max(axis=0))
+        scale = (maxs - mins) / 255
+        scale[scale == 0] = 1
+        metadata["scale"] = scale.tolist()
+        metadata["zero_point"] = np.round(-128 - mins / scale).tolist()
+
+    dequantize = LatentsDequantizer(metadata)
+    tmp_path = path.with_name(path.stem + ".tmp" + path.suffix)
+    converted = np.lib.format.open_memmap(
+        tmp_path, mode="w+", dtype=STORAGE_DTYPES[storage], shape=latents.shape
+    )
+    squared_error = 0.0
+    squared_norm = 0.0
+    max_abs_error = 0.0
+    for start in range(0, latents.shape[0], chunk_size):
+        chunk = np.array(latents[start : start + chunk_size])
+        stored = quantize(chunk, metadata)
+        converted[start : start + chunk_size] = stored
+        error = dequantize(torch.from_numpy(stored)).numpy() - chunk
+        squared_error += float(np.square(error, dtype=np.float64).sum())
+        squared_norm += float(np.square(chunk, dtype=np.float64).sum())
+        max_abs_error = max(max_abs_error, float(np.abs(error).max(initial=0)))
+    converted.flush()  # type: ignore
+    num_values = max(1, latents.size)
+    del converted, latents
+
+    metadata["rmse"] = math.sqrt(squared_error / num_values)
+    metadata["max_abs_error"] = max_abs_error
+    metadata["relative_error"] = math.sqrt(squared_error / max(squared_norm, 1e-12))
+    os.replace(tmp_path, path)
+    metadata_path(path).write_text(json.dumps(metadata))
+    return metadata
+
+
+class PresavedLatentsDomain(Dataset):
+    def __init__(
+        self,
+        dataset_path: str | Path,
+        split: str,
+        transform: Callable[[torch.Tensor], Any] | None = None,
+        additional_args: Mapping[str, Any] | None = None,
+    ) -> None:
+        """
+        Latent representations saved in
+        `dataset_path/saved_latents/{split}/{presaved_path}`.
+
+        The latents are memory-mapped in their storage format (see
+        `convert_latents`) and converted to float32 when accessed.
+
+        Args:
+            dataset_path (`str | Path`): path to the simple-shapes-dataset
+            split (`str`): the split to load
+            transform (`Callable[[torch.Tensor], Any] | None`): applied on each sample
+            additional_args (`Mapping[str, Any] | None`): must contain
+                "presaved_path", the name of the latent file. If "use_unpaired" is
+                True, the first unpaired value of `{split}_unpaired.npy` is
+                appended to the latents.
+        """
+        if additional_args is None or "presaved_path" not in additional_args:
+            raise ValueError(
+                'The "presaved_path" of the latent file must be given in '
+                "`domain_data_args`."
+            )
+        self.dataset_path = Path(dataset_path)
+        self.split = split
+        self.transform = transform
+        self.presaved_path = (
+            self.dataset_path
+            / f"saved_latents/{split}/{additional_args['presaved_path']}"
+        )
+        self.latents = np.load(self.presaved_path, mmap_mode="r")
+        metadata = load_metadata(self.presaved_path)
+        if self.latents.dtype != STORAGE_DTYPES[metadata["storage"]]:
+            raise ValueError(
+                f"{self.presaved_path} is {self.latents.dtype} but its metadata says "
+                f"{metadata['storage']}."
+            )
+        self.dequantize = LatentsDequantizer(metadata)
+
+        self.unpaired: torch.Tensor | None = None
+        if additional_args.get("use_unpaired", False):
+            self.unpaired = torch.from_numpy(
+                np.load(self.dataset_path / f"{split}_unpaired.npy")[:, :1]
+            ).float()
+
+    def __len__(self) -> int:
+        return self.latents.shape[0]
+
+    def __getitem__(self, index: int) -> Any:
+        x = self.dequantize(torch.from_numpy(np.array(self.latents[index])))
+        if self.unpaired is not None:
+            x = torch.cat([x, self.unpaired[index]])
+        if self.transform is not None:
+            return self.transform(x)
+        return x
+
+
+def is_converted(path: Path) -> bool:
+    """
+    Whether the latent file was converted to another storage than float32 (see
+    `convert_latents`).
+    """
+    if metadata_path(path).exists():
+        return True
+    return path.exists() and np.load(path, mmap_mode="r").dtype != np.float32
+
+
+def get_domain_classes(
+    domains: Iterable[Any],
+    dataset_path: str | Path | None = None,
+    domain_args: Mapping[str, Mapping[str, Any]] | None = None,
+) -> dict[Any, type[Dataset]]:
+    """
+    Same as simple_shapes_dataset's `get_default_domains` but also accepts the
+    `LatentDomainType` domains, loaded with `PresavedLatentsDomain`.
+
+    "v_latents" is loaded by simple_shapes_dataset, unless one of its latent files
+    was converted to another storage (see `convert_latents`).
+
+    Args:
+        domains (`Iterable[Any]`): the domains to load
+        dataset_path (`str | Path | None`): path to the dataset, to check the
+            storage of the "v_latents" files
+        domain_args (`Mapping[str, Mapping[str, Any]] | None`): the
+            `domain_data_args` of the config, with the "presaved_path" of the
+            "v_latents" files
+    """
+    latent_kinds = {domain_type.value.kind for domain_type in LatentDomainType}
+    v_latents_path = (domain_args or {}).get("v_latents", {}).get("presaved_path")
+    if (
+        dataset_path is not None
+        and v_latents_path is not None
+        and any(
+            is_converted(Path(dataset_path) / "saved_latents" / split / v_latents_path)
+            for split in ["train", "val", "test"]
+        )
+    ):
+        latent_kinds.add("v_latents")
+    domain_classes: dict[Any, type[Dataset]] = {}
+    default_domains = []
+    for domain in domains:
+        if getattr(domain, "kind", domain) in latent_kinds:
+            domain_classes[domain] = PresavedLatentsDomain
+        else:
+            default_domains.append(domain)
+    domain_classes.update(get_default_domains(default_domains))
+    return domain_classes
@@ -1,13 +1,27 @@
+import hashlib
+from collections.abc import Callable, Iterable, Mapping, Sequence
+from pathlib import Path
+from typing import Any, Protocol, runtime_checkable
+
+import numpy as np
 import torch
 from simple_shapes_dataset import Text
 from tokenizers.implementations import ByteLevelBPETokenizer
 
+from shimmer_ssd import LOGGER
+from shimmer_ssd.config import TextModule
+
+
+def make_tokenizer(vocab: str, merges: str, pad_length: int) -> ByteLevelBPETokenizer:
+    tokenizer = ByteLevelBPETokenizer(vocab, merges)
+    tokenizer.enable_padding(pad_token="<pad>", length=pad_length)
+    return tokenizer
+
 
 class TokenizeCaptions:
     def __init__(self, vocab: str, merges: str, pad_length: int):
         self._pad_length = pad_length
-        self.tokenizer = ByteLevelBPETokenizer(vocab, merges)
-        self.tokenizer.enable_padding(pad_token="<pad>", length=self._pad_length)
+        self.tokenizer = make_tokenizer(vocab, merges, pad_length)
 
     def __call__(self, x: Text) -> dict[str, torch.Tensor]:
         text: dict[str, torch.Tensor] = {"bert": x.bert}
@@ -15,3 +29,259 @@ class TokenizeCaptions:
             self.tokenizer.encode(x.caption).ids, dtype=torch.long
         )
         return text
+
+
+@runtime_checkable
+class BatchTransform(Protocol):
+    """
+    Transform that is finished on the whole batch, after collation (see
+    `shimmer_ssd.dataset.data_module.BatchTransformsDataModule`).
+    """
+
+    def __call__(self, x: Any) -> Any: ...
+
+    def batch_transform(self, batch: Any) -> Any: ...
+
+
+class BatchTokenizeCaptions:
+    def __init__(self, vocab: str, merges: str, pad_length: int):
+        """
+        Tokenizes the captions of the whole batch with a single `encode_batch` call.
+
+        Samples only keep the caption (`__call__`), the tokenization happens in
+        `batch_transform` once the batch is collated, or directly in `collate`
+        when used as a collate function.
+
+        Args:
+            vocab (`str`): path to the tokenizer vocab file
+            merges (`str`): path to the tokenizer merges file
+            pad_length (`int`): length of the token sequences
+        """
+        self._pad_length = pad_length
+        self.tokenizer = make_tokenizer(vocab, merges, pad_length)
+
+    def __call__(self, x: Text) -> dict[str, Any]:
+        return {"bert": x.bert, "caption": x.caption}
+
+    def tokenize(self, captions: Sequence[str]) -> torch.Tensor:
+        """
+        Args:
+            captions (`Sequence[str]`): captions to tokenize
+
+        Returns:
+            `torch.Tensor`: tokens of shape (len(captions), pad_length)
+        """
+        tokens = torch.empty((len(captions), self._pad_length), dtype=torch.long)
+        encodings = self.tokenizer.encode_batch(list(captions))
+        if any(len(encoding.ids) != self._pad_length for encoding in encodings):
+            raise ValueError(
+                f"Some captions have more than seq_length={self._pad_length} tokens."
+            )
+        tokens.numpy()[:] = [encoding.ids for encoding in encodings]
+        return tokens
+
+    def batch_transform(self, batch: Mapping[str, Any]) -> dict[str, torch.Tensor]:
+        """
+        Args:
+            batch (`Mapping[str, Any]`): collated outputs of `__call__`
+
+        Returns:
+            `dict[str, torch.Tensor]`: the "bert" and "tokens" of the batch
+        """
+        return {"bert": batch["bert"], "tokens": self.tokenize(batch["caption"])}
+
+    def collate(self, texts: Sequence[Text]) -> dict[str, torch.Tensor]:
+        """
+        Collate function for a list of `Text`.
+        """
+        return {
+            "bert": torch.stack([text.bert for text in texts]),
+            "tokens": self.tokenize([text.caption for text in texts]),
+        }
+
+
+def tokenizer_hash(vocab: str, merges: str) -> str:
+    """
+    Hash of the content of the tokenizer files, used to key the token caches.
+    """
+    digest = hashlib.sha256()
+    for path in (vocab, merges):
+        digest.update(Path(path).read_bytes())
+    return digest.hexdigest()[:16]
+
+
+def caption_hashes(captions: Iterable[str]) -> np.ndarray:
+    """
+    64 bits hashes of the captions, used as keys of the token caches.
+    """
+    return np.array(
+        [
+            int.from_bytes(
+                hashlib.blake2b(caption.encode(), digest_size=8).digest(), "little"
+            )
+            for caption in captions
+        ],
+        dtype=np.uint64,
+    )
+
+
+def tokens_cache_path(
+    dataset_path: str | Path, vocab: str, merges: str, pad_length: int
+) -> Path:
+    """
+    Path of the token cache for the given tokenizer and sequence length.
+    The captions hashes are saved next to it with the "_hashes" suffix.
+    """
+    return (
+        Path(dataset_path)
+        / "saved_tokens"
+        / f"tokens_{tokenizer_hash(vocab, merges)}_{pad_length}.npy"
+    )
+
+
+def hashes_path(cache_path: Path) -> Path:
+    return cache_path.with_name(f"{cache_path.stem}_hashes.npy")
+
+
+def save_tokens_cache(
+    dataset_path: str | Path,
+    vocab: str,
+    merges: str,
+    pad_length: int,
+    splits: Iterable[str] = ("train", "val", "test"),
+    chunk_size: int = 8192,
+) -> Path:
+    """
+    Tokenizes the captions of all splits once and saves them in a single int64
+    array (deduplicated captions, sorted by caption hash) that
+    `CachedTokenizeCaptions` memory-maps and returns without conversion.
+
+    Args:
+        dataset_path (`str | Path`): path to the simple-shapes-dataset
+        vocab (`str`): path to the tokenizer vocab file
+        merges (`str`): path to the tokenizer merges file
+        pad_length (`int`): length of the token sequences
+        splits (`Iterable[str]`): splits to tokenize
+        chunk_size (`int`): number of captions tokenized at once
+
+    Returns:
+        `Path`: path to the token cache
+    """
+    dataset_path = Path(dataset_path)
+    tokenizer = make_tokenizer(vocab, merges, pad_length)
+
+    captions = np.concatenate(
+        [
+            np.load(dataset_path / f"{split}_captions.npy", mmap_mode="r")
+            for split in splits
+        ]
+    )
+    hashes, first_indices = np.unique(caption_hashes(captions), return_index=True)
+
+    cache_path = tokens_cache_path(dataset_path, vocab, merges, pad_length)
+    cache_path.parent.mkdir(exist_ok=True)
+    tokens = np.lib.format.open_memmap(
+        cache_path,
+        mode="w+",
+        dtype=np.int64,
+        shape=(hashes.shape[0], pad_length),
+    )
+    for start in range(0, hashes.shape[0], chunk_size):
+        chunk = captions[first_indices[start : start + chunk_size]].tolist()
+        ids = [encoding.ids for encoding in tokenizer.encode_batch(chunk)]
+        if any(len(seq) > pad_length for seq in ids):
+            raise ValueError(
+                f"Some captions have more than seq_length={pad_length} tokens."
+            )
+        tokens[start : start + len(ids)] = ids
+    tokens.flush()
+    del tokens
+    np.save(hashes_path(cache_path), hashes)
+    return cache_path
+
+
+class CachedTokenizeCaptions:
+    def __init__(
+        self, dataset_path: str | Path, vocab: str, merges: str, pad_length: int
+    ):
+        """
+        Same as `TokenizeCaptions` but reads the tokens from the cache saved with
+        `ssd extract tokens`. The cache is memory-mapped by each dataloader worker.
+        Captions missing from the cache are tokenized on the fly.
+
+        Args:
+            dataset_path (`str | Path`): path to the simple-shapes-dataset
+            vocab (`str`): path to the tokenizer vocab file
+            merges (`str`): path to the tokenizer merges file
+            pad_length (`int`): length of the token sequences
+        """
+        self.cache_path = tokens_cache_path(dataset_path, vocab, merges, pad_length)
+        if not self.cache_path.exists():
+            raise FileNotFoundError(
+                f"Token cache {self.cache_path} does not exist. "
+                "Create it with `ssd extract tokens`."
+            )
+        self._vocab = vocab
+        self._merges = merges
+        self._pad_length = pad_length
+        self._tokens: np.ndarray | None = None
+        self._hashes: np.ndarray | None = None
+        self._tokenizer: ByteLevelBPETokenizer | None = None
+
+    def __getstate__(self) -> dict[str, Any]:
+        # do not send the memory-maps to the workers, they open their own.
+        state = self.__dict__.copy()
+        state["_tokens"] = None
+        state["_hashes"] = None
+        state["_tokenizer"] = None
+        return state
+
+    def _tokenize(self, caption: str) -> np.ndarray:
+        if self._tokenizer is None:
+            LOGGER.warning(
+                f"Captions are missing from {self.cache_path}, "
+                "they will be tokenized on the fly."
+            )
+            self._tokenizer = make_tokenizer(
+                self._vocab, self._merges, self._pad_length
+            )
+        return np.array(self._tokenizer.encode(caption).ids, dtype=np.int64)
+
+    def __call__(self, x: Text) -> dict[str, torch.Tensor]:
+        if self._tokens is None or self._hashes is None:
+            # copy-on-write so that the returned tensors can be views of the map
+            self._tokens = np.load(self.cache_path, mmap_mode="c")
+            self._hashes = np.load(hashes_path(self.cache_path), mmap_mode="r")
+
+        key = caption_hashes([x.caption])[0]
+        row = int(np.searchsorted(self._hashes, key))
+        if row < self._hashes.shape[0] and self._hashes[row] == key:
+            tokens = self._tokens[row]
+        else:
+            tokens = self._tokenize(x.caption)
+
+        text: dict[str, torch.Tensor] = {"bert": x.bert}
+        # only caches saved with a smaller dtype by older versions are copied
+        text["tokens"] = torch.from_numpy(tokens.astype(np.int64, copy=False))
+        return text
+
+
+def get_text_transform(
+    config: TextModule, dataset_path: str | Path
+) -> Callable[[Text], dict[str, torch.Tensor]]:
+    """
+    Transform of the text domain for the tokenization set in the config.
+    """
+    match config.tokenization:
+        case "sample":
+            return TokenizeCaptions(
+                config.vocab_path, config.merges_path, config.seq_length
+            )
+        case "cache":
+            return CachedTokenizeCaptions(
+                dataset_path, config.vocab_path, config.merges_path, config.seq_length
+            )
+        case "batch":
+            return BatchTokenizeCaptions(
+                config.vocab_path, config.merges_path, config.seq_length
+            )
@@ -0,0 +1,299 @@
+"""
+Synthetic Simple Shapes datasets, with the same files as the real dataset, to
+benchmark the training pipeline at any scale without the 1M samples dataset.
+
+The values are random: the labels are in the range of the real attributes and the
+captions are built from them with a simple template, but the BERT vectors and the
+pre-saved latents are standard normal. Images are not generated, so only the "attr",
+"t" and the latent domains ("v_latents", "attr_latents", "t_latents") can be loaded.
+"""
+
+from collections.abc import Iterable, Mapping
+from pathlib import Path
+from typing import Any
+
+import cv2
+import numpy as np
+
+SHAPES = ["diamond", "egg", "triangle"]
+SIZES = ["tiny", "small", "medium", "large"]
+# one name per 30 degrees of hue (OpenCV hue is in [0, 180))
+COLORS = [
+    "red",
+    "orange",
+    "yellow",
+    "lime",
+    "green",
+    "teal",
+    "cyan",
+    "azure",
+    "blue",
+    "violet",
+    "magenta",
+    "pink",
+]
+VERTICAL_LOCATIONS = ["top", "middle", "bottom"]
+HORIZONTAL_LOCATIONS = ["left", "center", "right"]
+DIRECTIONS = [
+    "east",
+    "northeast",
+    "north",
+    "northwest",
+    "west",
+    "southwest",
+    "south",
+    "southeast",
+]
+
+IMAGE_SIZE = 32
+MIN_SHAPE_SIZE = 7
+MAX_SHAPE_SIZE = 14
+BERT_DIM = 768
+UNPAIRED_DIM = 32
+
+
+def caption_template(
+    size: str, color: str, shape: str, vertical: str, horizontal: str, direction: str
+) -> str:
+    return (
+        f"A {size} {color} {shape}, at the {vertical} {horizontal}, "
+        f"pointing to the {direction}."
+    )
+
+
+def _longest(words: Iterable[str]) -> str:
+    return max(words, key=len)
+
+
+# width of the fixed-size unicode dtype of the captions
+CAPTION_LENGTH = len(
+    caption_template(
+        _longest(SIZES),
+        _longest(COLORS),
+        _longest(SHAPES),
+        _longest(VERTICAL_LOCATIONS),
+        _longest(HORIZONTAL_LOCATIONS),
+        _longest(DIRECTIONS),
+    )
+)
+
+# all captions are generated with the same grammar choices
+CAPTION_CHOICES: dict[str, Any] = {
+    "structure": 0,
+    "groups": [0],
+    "writers": {},
+    "variants": {},
+}
+
+
+def synthetic_labels(size: int, rng: np.random.Generator) -> np.ndarray:
+    """
+    Random labels with the layout of the `{split}_labels.npy` files.
+
+    Args:
+        size (`int`): number of samples
+        rng (`np.random.Generator`): random generator
+
+    Returns:
+        `np.ndarray`: float32 array of shape (size, 12) with the category, x, y,
+        size, rotation, RGB color, HLS color and unpaired value of each sample.
+    """
+    categories = rng.integers(0, len(SHAPES), size)
+    sizes = rng.integers(MIN_SHAPE_SIZE, MAX_SHAPE_SIZE + 1, size)
+    margins = sizes // 2 + 1
+    locations = rng.integers(
+        margins[:, None], IMAGE_SIZE - margins[:, None], (size, 2), endpoint=True
+    )
+    rotations = rng.uniform(0, 2 * np.pi, size)
+    colors_rgb = rng.integers(0, 256, (size, 3), dtype=np.uint8)
+    colors_hls = cv2.cvtColor(colors_rgb[None], cv2.COLOR_RGB2HLS)[0]
+    unpaired = rng.uniform(0, 1, size)
+
+    labels = np.empty((size, 12), dtype=np.float32)
+    labels[:, 0] = categories
+    labels[:, 1:3] = locations
+    labels[:, 3] = sizes
+    labels[:, 4] = rotations
+    labels[:, 5:8] = colors_rgb
+    labels[:, 8:11] = colors_hls
+    labels[:, 11] = unpaired
+    return labels
+
+
+def synthetic_captions(labels: np.ndarray) -> np.ndarray:
+    """
+    Captions describing the labels (see `synthetic_labels`).
+
+    Returns:
+        `np.ndarray`: fixed-size unicode array of shape (labels.shape[0],)
+    """
+    size_bins = np.linspace(MIN_SHAPE_SIZE, MAX_SHAPE_SIZE + 1, len(SIZES) + 1)[1:-1]
+    location_bins = np.array([IMAGE_SIZE / 3, 2 * IMAGE_SIZE / 3])
+    sizes = np.digitize(labels[:, 3], size_bins)
+    # the hue is rounded up to 180 for the reds close to 360 degrees
+    colors = (labels[:, 8] // (180 / len(COLORS))).astype(int) % len(COLORS)
+    horizontal = np.digitize(labels[:, 1], location_bins)
+    # y is 0 at the bottom of the image
+    vertical = len(VERTICAL_LOCATIONS) - 1 - np.digitize(labels[:, 2], location_bins)
+    sector = 2 * np.pi / len(DIRECTIONS)
+    directions = ((labels[:, 4] + sector / 2) // sector).astype(int) % len(DIRECTIONS)
+
+    captions = [
+        caption_template(
+            SIZES[size],
+            COLORS[color],
+            SHAPES[int(category)],
+            VERTICAL_LOCATIONS[v],
+            HORIZONTAL_LOCATIONS[h],
+            DIRECTIONS[direction],
+        )
+        for category, size, color, v, h, direction in zip(
+            labels[:, 0], sizes, colors, vertical, horizontal, directions, strict=True
+        )
+    ]
+    return np.array(captions, dtype=f"<U{CAPTION_LENGTH}")
+
+
+def synthetic_split(
+    size: int,
+    rng: np.random.Generator,
+    latent_dims: Mapping[str, int] | None = None,
+) -> dict[str, np.ndarray]:
+    """
+    Generates the arrays of a split in memory.
+
+    Args:
+        size (`int`): number of samples
+        rng (`np.random.Generator`): random generator
+        latent_dims (`Mapping[str, int] | None`): dimension of the pre-saved latents
+            to generate, for each latent file name (e.g. "vae_v_shimmer.npy").
+
+    Returns:
+        `dict[str, np.ndarray]`: "labels", "latent" (the BERT vectors), "captions",
+        "unpaired", "odd_one_out_labels" and one entry per latent file name.
+    """
+    labels = synthetic_labels(size, rng)
+    arrays = {
+        "labels": labels,
+        "latent": rng.standard_normal((size, BERT_DIM), dtype=np.float32),
+        "captions": synthetic_captions(labels),
+        "unpaired": rng.standard_normal((size, UNPAIRED_DIM)),
+        "odd_one_out_labels": rng.integers(0, size, (size, 4)),
+    }
+    for name, dim in (latent_dims or {}).items():
+        arrays[name] = rng.standard_normal((size, dim), dtype=np.float32)
+    return arrays
+
+
+def alignment_split_name(
+    domain_proportions: Mapping[frozenset[str], float], seed: int
+) -> str:
+    """
+    Name of the domain split files, as generated by `shapesd alignment add`.
+    """
+    groups = sorted(
+        (",".join(sorted(domains)), proportion)
+        for domains, proportion in domain_proportions.items()
+    )
+    name = "_".join(f"{domains}:{proportion}" for domains, proportion in groups)
+    return f"{name}_seed:{seed}"
+
+
+def domain_split(
+    size: int,
+    domain_proportions: Mapping[frozenset[str], float],
+    rng: np.random.Generator,
+) -> dict[frozenset[str], np.ndarray]:
+    """
+    Indices of the samples available to each domain group.
+    """
+    return {
+        domains: np.sort(rng.permutation(size)[: int(size * proportion)])
+        for domains, proportion in domain_proportions.items()
+    }
+
+
+def save_synthetic_dataset(
+    path: str | Path,
+    split_sizes: Mapping[str, int],
+    domain_proportions: Mapping[frozenset[str], float],
+    seed: int = 0,
+    latent_dims: Mapping[str, int] | None = None,
+    chunk_size: int = 65536,
+) -> Path:
+    """
+    Writes a synthetic dataset with the layout of the Simple Shapes dataset:
+    `{split}_labels.npy`, `{split}_latent.npy` (BERT vectors), `{split}_captions.npy`,
+    `{split}_caption_choices.npy`, `{split}_unpaired.npy`,
+    `{split}_odd_one_out_labels.npy`, `latent_mean.npy`, `latent_std.npy`,
+    the pre-saved latents in `saved_latents/{split}` and the domain splits in
+    `domain_splits` and `domain_splits_v2`.
+
+    The arrays are written by chunks in memory-mapped files, so the dataset can be
+    larger than the memory. The content only depends on the seed and the chunk size.
+
+    Args:
+        path (`str | Path`): folder of the dataset (created if needed)
+        split_sizes (`Mapping[str, int]`): number of samples of each split
+        domain_proportions (`Mapping[frozenset[str], float]`): domain proportions
+            of the alignment split to generate (`domain_proportions` in the config)
+        seed (`int`): random seed, also used as the seed of the alignment split
+        latent_dims (`Mapping[str, int] | None`): dimension of the pre-saved latents
+            to generate, for each latent file name (`presaved_path` in the config).
+        chunk_size (`int`): number of samples generated at once
+
+    Returns:
+        `Path`: path to the dataset
+    """
+    path = Path(path)
+    latent_dims = latent_dims or {}
+    for folder in ["domain_splits", "domain_splits_v2"]:
+        (path / folder).mkdir(parents=True, exist_ok=True)
+
+    np.save(path / "latent_mean.npy", np.zeros(BERT_DIM, dtype=np.float32))
+    np.save(path / "latent_std.npy", np.ones(BERT_DIM, dtype=np.float32))
+
+    split_name = alignment_split_name(domain_proportions, seed)
+    for split_index, (split, size) in enumerate(split_sizes.items()):
+        (path / "saved_latents" / split).mkdir(parents=True, exist_ok=True)
+        files: dict[str, np.memmap] = {}
+        for start in range(0, size, chunk_size):
+            rng = np.random.default_rng([seed, split_index, start // chunk_size])
+            chunk = synthetic_split(min(chunk_size, size - start), rng, latent_dims)
+            for name, values in chunk.items():
+                if name not in files:
+                    file_path = (
+                        path / "saved_latents" / split / name
+                        if name in latent_dims
+                        else path / f"{split}_{name}.npy"
+                    )
+                    files[name] = np.lib.format.open_memmap(
+                        file_path,
+                        mode="w+",
+                        dtype=values.dtype,
+                        shape=(size, *values.shape[1:]),
+                    )
+                files[name][start : start + values.shape[0]] = values
+        for file in files.values():
+            file.flush()
+        del files
+
+        choices = np.empty(size, dtype=object)
+        choices[:] = [CAPTION_CHOICES] * size
+        np.save(path / f"{split}_caption_choices.npy", choices, allow_pickle=True)
+
+        rng = np.random.default_rng([seed, split_index])
+        split_indices = np.array(domain_split(size, domain_proportions, rng))
+        np.save(
+            path / "domain_splits" / f"{split}_{split_name}_domain_split.npy",
+            split_indices,
+            allow_pickle=True,
+        )
+        np.save(
+            path
+            / "domain_splits_v2"
+            / f"{split}_{split_name}_ms:{size}_domain_split.npy",
+            split_indices,
+            allow_pickle=True,
+        )
+    return path
@@ -1,33 +1,30 @@
 import io
+import queue
+import threading
 from abc import ABC, abstractmethod
-from collections.abc import Mapping, Sequence
-from typing import Any, Generic, Literal, TypeVar, cast
+from collections.abc import Callable, Mapping, Sequence
+from typing import TYPE_CHECKING, Any, Generic, Literal, TypeVar, cast
 
 import lightning.pytorch as pl
-import matplotlib
-import matplotlib.pyplot as plt
 import numpy as np
 import torch
 from lightning.pytorch.loggers import Logger, TensorBoardLogger
 from lightning.pytorch.loggers.wandb import WandbLogger
-from matplotlib import gridspec
-from matplotlib.figure import Figure
 from PIL import Image
 from shimmer.modules.global_workspace import GlobalWorkspaceBase, GWPredictionsBase
-from simple_shapes_dataset import (
-    UnnormalizeAttributes,
-    tensor_to_attribute,
-)
-from simple_shapes_dataset.cli import generate_image
-from tokenizers.implementations import ByteLevelBPETokenizer
-from torchvision.transforms.functional import to_tensor
-from torchvision.utils import make_grid
 
 from shimmer_ssd import LOGGER
-from shimmer_ssd.modules.domains.text import GRUTextDomainModule, Text2Attr
+from shimmer_ssd.modules.domains.attribute import AttributeLatentDomainModule
+from shimmer_ssd.modules.domains.text import (
+    GRUTextDomainModule,
+    Text2Attr,
+    TextLatentDomainModule,
+)
 from shimmer_ssd.modules.domains.visual import VisualLatentDomainModule
 
-matplotlib.use("Agg")
+if TYPE_CHECKING:
+    from matplotlib.figure import Figure
+    from tokenizers.implementations import ByteLevelBPETokenizer
 
 _T = TypeVar("_T")
 
@@ -41,6 +38,8 @@ def log_image(
     if isinstance(logger, WandbLogger):
         logger.log_image(key, [image])
     elif isinstance(logger, TensorBoardLogger):
+        from torchvision.transforms.functional import to_tensor
+
         torch_image = to_tensor(image) if isinstance(image, Image.Image) else image
         logger.experiment.add_image(key, torch_image, tensorboard_step)
     else:
@@ -70,6 +69,70 @@ def log_text(
         return
 
 
+def detach_to_cpu(samples: Any) -> Any:
+    """
+    Detached CPU copy of the tensors in (nested) mappings and sequences.
+    """
+    if isinstance(samples, torch.Tensor):
+        return samples.detach().cpu()
+    if isinstance(samples, Mapping):
+        return {key: detach_to_cpu(value) for key, value in samples.items()}
+    if isinstance(samples, list | tuple):
+        return [detach_to_cpu(value) for value in samples]
+    return samples
+
+
+class AsyncMediaLogger:
+    def __init__(self, max_queue_size: int = 8) -> None:
+        """
+        Background thread rendering and uploading the logged medias, so that the
+        logging callbacks only run the forward passes in the training loop.
+
+        The tasks are run in submission order. The queue is bounded: `submit`
+        blocks while `max_queue_size` tasks are waiting.
+
+        Args:
+            max_queue_size (`int`): maximum number of pending tasks
+        """
+        self._queue: queue.Queue[Callable[[], None] | None] = queue.Queue(
+            max_queue_size
+        )
+        self._thread: threading.Thread | None = None
+
+    def _run(self) -> None:
+        while True:
+            task = self._queue.get()
+            try:
+                if task is None:
+                    return
+                task()
+            except Exception:
+                LOGGER.exception("[Sample Logger] Failed to log medias.")
+            finally:
+                self._queue.task_done()
+
+    def submit(self, task: Callable[[], None]) -> None:
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(
+                target=self._run, name="media-logger", daemon=True
+            )
+            self._thread.start()
+        self._queue.put(task)
+
+    def flush(self) -> None:
+        """Waits for all the submitted tasks to be done."""
+        if self._thread is not None:
+            self._queue.join()
+
+    def close(self) -> None:
+        """Flushes and stops the thread. It restarts on the next `submit`."""
+        if self._thread is None:
+            return
+        self._queue.put(None)
+        self._thread.join()
+        self._thread = None
+
+
 class LogSamplesCallback(Generic[_T], ABC, pl.Callback):
     def __init__(
         self,
@@ -172,13 +235,77 @@ class LogSamplesCallback(Generic[_T], ABC, pl.Callback):
     def log_samples(self, logger: Logger, samples: _T, mode: str) -> None: ...
 
 
-def get_pil_image(figure: Figure) -> Image.Image:
+def load_tokenizer(vocab: str | None, merges: str | None) -> "ByteLevelBPETokenizer":
+    from tokenizers.implementations import ByteLevelBPETokenizer
+
+    return ByteLevelBPETokenizer(vocab, merges)
+
+
+def get_pil_image(figure: "Figure") -> Image.Image:
     buf = io.BytesIO()
     figure.savefig(buf)
     buf.seek(0)
     return Image.open(buf)
 
 
+# Outlines of the shapes in the unit square, as drawn by
+# `simple_shapes_dataset.cli.generate_image` (0: diamond, 1: egg, 2: triangle).
+SHAPE_COORDINATES: dict[int, np.ndarray] = {
+    0: np.array([[0.5, 0.0], [1.0, 0.3], [0.5, 1.0], [0.0, 0.3]]),
+    1: np.array(
+        [
+            [0.5, 0.0],
+            [0.8, 0.0],
+            [0.9, 0.1],
+            [0.9, 0.3],
+            [0.8, 0.5],
+            [0.7, 0.6],
+            [0.6, 0.7],
+            [0.5, 1.0],
+            [0.4, 0.7],
+            [0.3, 0.6],
+            [0.2, 0.5],
+            [0.1, 0.3],
+            [0.1, 0.1],
+            [0.2, 0.0],
+        ]
+    ),
+    2: np.array([[0.5, 1.0], [0.2, 0.0], [0.8, 0.0]]),
+}
+
+# sub-pixel precision (in bits) of the polygon vertices given to OpenCV
+_SHIFT = 4
+# the shapes are filled on a grid upscaled by this factor, then area-downsampled,
+# which gives the pixel coverage anti-aliasing of matplotlib
+_SUPERSAMPLING = 8
+
+
+def shape_vertices(
+    category: int, locations: np.ndarray, sizes: np.ndarray, rotations: np.ndarray
+) -> np.ndarray:
+    """
+    Vertices of a batch of shapes of the same category.
+
+    Args:
+        category (`int`): category of the shapes
+        locations (`np.ndarray`): centers of the shapes of shape (N, 2)
+        sizes (`np.ndarray`): sizes of the shapes of shape (N,)
+        rotations (`np.ndarray`): rotations in radians of shape (N,)
+
+    Returns:
+        `np.ndarray`: vertices of shape (N, n_vertices, 2) in the coordinates of
+        the image (y axis pointing up).
+    """
+    cos, sin = np.cos(rotations), np.sin(rotations)
+    # (N, 2, 2) rotation matrices
+    rotation = np.stack(
+        [np.stack([cos, -sin], axis=-1), np.stack([sin, cos], axis=-1)], axis=-2
+    )
+    centered = SHAPE_COORDINATES[category] - 0.5
+    rotated = np.einsum("nij,kj->nki", rotation, centered)
+    return locations[:, None, :] + sizes[:, None, None] * rotated
+
+
 def get_attribute_figure_grid(
     categories: np.ndarray,
     locations: np.ndarray,
@@ -189,43 +316,60 @@ def get_attribute_figure_grid(
     ncols: int = 8,
     padding: float = 2,
 ) -> Image.Image:
-    reminder = 1 if categories.shape[0] % ncols else 0
-    nrows = categories.shape[0] // ncols + reminder
-
-    width = ncols * (image_size + padding) + padding
-    height = nrows * (image_size + padding) + padding
-    dpi = 1
+    """
+    Draws the shapes on a grid of black cells separated by white padding.
+    The shapes are rasterized with OpenCV directly in a grid array upscaled by
+    `_SUPERSAMPLING`, which is then area-downsampled to anti-alias the edges.
+
+    Args:
+        categories (`np.ndarray`): categories of shape (N,)
+        locations (`np.ndarray`): centers of the shapes of shape (N, 2), in pixels
+            with the y axis pointing up
+        sizes (`np.ndarray`): sizes of the shapes in pixels of shape (N,)
+        rotations (`np.ndarray`): rotations in radians of shape (N,)
+        colors (`np.ndarray`): RGB colors in [0, 255] of shape (N, 3)
+        image_size (`int`): size of the cells
+        ncols (`int`): number of columns of the grid
+        padding (`float`): padding between the cells, in pixels
+
+    Returns:
+        `Image.Image`: the grid
+    """
+    import cv2
+
+    num_samples = categories.shape[0]
+    nrows = -(-num_samples // ncols)
+    pad = round(padding)
+    step = image_size + pad
+    scale = _SUPERSAMPLING
+    height, width = nrows * step + pad, ncols * step + pad
+    grid = np.full((height * scale, width * scale, 3), 255, dtype=np.uint8)
+
+    rows, cols = np.divmod(np.arange(num_samples), ncols)
+    tops = (pad + rows * step) * scale
+    lefts = (pad + cols * step) * scale
+    cell_size = image_size * scale
+
+    # vertices in pixel coordinates of the upscaled cells (y axis pointing down,
+    # pixel centers on integer coordinates), with _SHIFT bits of precision.
+    vertices: list[np.ndarray] = [np.empty(0)] * num_samples
+    for category in np.unique(categories).tolist():
+        (indices,) = np.nonzero(categories == category)
+        points = shape_vertices(
+            int(category), locations[indices], sizes[indices], rotations[indices]
+        )
+        points[..., 1] = image_size - points[..., 1]
+        points = np.round((points * scale - 0.5) * (1 << _SHIFT)).astype(np.int32)
+        for k, index in enumerate(indices.tolist()):
+            vertices[index] = points[k]
 
-    figure = plt.figure(figsize=(width / dpi, height / dpi), dpi=dpi, facecolor="white")
-    gs = gridspec.GridSpec(
-        nrows,
-        ncols,
-        wspace=padding / image_size,
-        hspace=padding / image_size,
-        left=padding / width,
-        right=1 - padding / width,
-        bottom=padding / height,
-        top=1 - padding / height,
-    )
-    for i in range(nrows):
-        for j in range(ncols):
-            k = i * ncols + j
-            if k >= categories.shape[0]:
-                break
-            ax = plt.subplot(gs[i, j])
-            generate_image(
-                ax,
-                categories[k],
-                locations[k],
-                sizes[k],
-                rotations[k],
-                colors[k],
-                image_size,
-            )
-            ax.set_facecolor("black")
-    image = get_pil_image(figure)
-    plt.close(figure)
-    return image
+    shape_colors = np.clip(np.round(colors), 0, 255).astype(np.uint8).tolist()
+    for k in range(num_samples):
+        cell = grid[tops[k] : tops[k] + cell_size, lefts[k] : lefts[k] + cell_size]
+        cell[:] = 0
+        cv2.fillPoly(cell, [vertices[k]], shape_colors[k], shift=_SHIFT)
+    grid = cv2.resize(grid, (width, height), interpolation=cv2.INTER_AREA)
+    return Image.fromarray(grid)
 
 
 def attribute_image_grid(
@@ -233,6 +377,8 @@ def attribute_image_grid(
     image_size: int,
     ncols: int,
 ) -> Image.Image:
+    from simple_shapes_dataset import UnnormalizeAttributes, tensor_to_attribute
+
     unnormalizer = UnnormalizeAttributes(image_size=image_size)
     attributes = unnormalizer(tensor_to_attribute(samples))
 
@@ -310,7 +456,7 @@ class LogTextCallback(LogSamplesCallback[Mapping[str, torch.Tensor]]):
         super().__init__(reference_samples, log_key, mode, every_n_epochs)
         self.image_size = image_size
         self.ncols = ncols
-        self.tokenizer = ByteLevelBPETokenizer(vocab, merges)
+        self.tokenizer = load_tokenizer(vocab, merges)
 
     def to(
         self, samples: Mapping[str, torch.Tensor], device: torch.device
@@ -380,6 +526,8 @@ class LogVisualCallback(LogSamplesCallback[torch.Tensor]):
         return samples.to(device)
 
     def log_samples(self, logger: Logger, samples: torch.Tensor, mode: str) -> None:
+        from torchvision.utils import make_grid
+
         images = make_grid(samples, nrow=self.ncols, pad_value=1)
         log_image(logger, f"{self.log_key}_{mode}", images)
 
@@ -405,7 +553,7 @@ class LogText2AttrCallback(
         super().__init__(reference_samples, log_key, mode, every_n_epochs)
         self.image_size = image_size
         self.ncols = ncols
-        self.tokenizer = ByteLevelBPETokenizer(vocab, merges)
+        self.tokenizer = load_tokenizer(vocab, merges)
         self.reference_samples = reference_samples
 
     def to(
@@ -515,6 +663,33 @@ def batch_to_device(
     return out
 
 
+def split_samples(samples: Any, sizes: Sequence[int]) -> list[Any]:
+    """
+    Splits the decoded samples of a concatenated batch along the first dimension.
+
+    Args:
+        samples (`Any`): a tensor or (nested) mappings and sequences of tensors
+        sizes (`Sequence[int]`): sizes of the splits
+
+    Returns:
+        `list[Any]`: the samples of each split, with the same structure
+    """
+    if isinstance(samples, torch.Tensor):
+        return list(samples.split(list(sizes)))
+    if isinstance(samples, Mapping):
+        splits: list[dict[Any, Any]] = [{} for _ in sizes]
+        for key, value in samples.items():
+            for split, value_split in zip(
+                splits, split_samples(value, sizes), strict=True
+            ):
+                split[key] = value_split
+        return splits
+    if isinstance(samples, list | tuple):
+        parts = [split_samples(x, sizes) for x in samples]
+        return [[part[k] for part in parts] for k in range(len(sizes))]
+    return [samples for _ in sizes]
+
+
 class LogGWImagesCallback(pl.Callback):
     def __init__(
         self,
@@ -527,10 +702,19 @@ class LogGWImagesCallback(pl.Callback):
         filter: Sequence[str] | None = None,
         vocab: str | None = None,
         merges: str | None = None,
-        exclude_colors = False
+        exclude_colors = False,
+        media_logger: AsyncMediaLogger | None = None,
     ) -> None:
+        """
+        Args:
+            media_logger (`AsyncMediaLogger | None`): if given, the samples are
+                decoded in the callback and moved to CPU, and the rendering and
+                upload are done in the media logger thread. It can be shared
+                between callbacks. Otherwise, everything is done in the callback.
+        """
         super().__init__()
         self.exclude_colors = exclude_colors
+        self.media_logger = media_logger
         self.mode = mode
         self.reference_samples = reference_samples
         self.every_n_epochs = every_n_epochs
@@ -540,7 +724,7 @@ class LogGWImagesCallback(pl.Callback):
         self.filter = filter
         self.tokenizer = None
         if vocab is not None and merges is not None:
-            self.tokenizer = ByteLevelBPETokenizer(vocab, merges)
+            self.tokenizer = load_tokenizer(vocab, merges)
         self._global_step = 0
 
     def get_step(self):
@@ -573,11 +757,12 @@ class LogGWImagesCallback(pl.Callback):
         
         for domain_names, domains in self.reference_samples.items():
             for domain_name, domain_tensor in domains.items():
+                with torch.no_grad():
+                    samples = self.decode_samples(pl_module, domain_tensor, domain_name)
                 for logger in trainer.loggers:
                     self.log_samples(
                         logger,
-                        pl_module,
-                        domain_tensor,
+                        samples,
                         domain_name,
                         f"ref_{'-'.join(domain_names)}_{domain_name}",
                     )
@@ -613,53 +798,40 @@ class LogGWImagesCallback(pl.Callback):
             
             predictions = cast(GWPredictionsBase, pl_module(latent_groups_copy))
 
-            
-
-            for logger in loggers:
-                for domains, preds in predictions["broadcasts"].items():
-                    domain_from = ",".join(domains)
-                    for domain, pred in preds.items():
-                        log_name = f"pred_trans_{domain_from}_to_{domain}"
-                        if self.filter is not None and log_name not in self.filter:
-                            continue
-                        samples = pl_module.decode_domain(pred, domain)
-                        if domain == "attr" and self.exclude_colors:
-                            device = pl_module.device
-                            samples[1] = torch.cat(
-                                [samples[1], 
-                                 torch.tensor([1, 0, 0], device=device).expand(32, 3)], 
-                                dim=-1
-                            )
-                            # print(f"Shape of samples[1]: {samples[1].shape}")
-                        self.log_samples(
-                            logger,
-                            pl_module,
-                            samples,
-                            domain,
-                            log_name,
-                        )
-                for domains, preds in predictions["cycles"].items():
+            # filtered predictions to log, grouped by target domain
+            to_decode: dict[str, list[tuple[str, torch.Tensor]]] = {}
+            for kind, name in [("broadcasts", "trans"), ("cycles", "cycle")]:
+                for domains, preds in predictions[kind].items():
                     domain_from = ",".join(domains)
                     for domain, pred in preds.items():
-                        log_name = f"pred_cycle_{domain_from}_to_{domain}"
+                        log_name = f"pred_{name}_{domain_from}_to_{domain}"
                         if self.filter is not None and log_name not in self.filter:
                             continue
-                        samples = pl_module.decode_domain(pred, domain)
-                        if domain == "attr" and self.exclude_colors:
-                            device = pl_module.device
-                            samples[1] = torch.cat(
-                                [samples[1], 
-                                 torch.tensor([1, 0, 0], device=device).expand(32, 3)], 
-                                dim=-1
-                            )
-                            # print(f"Shape of samples[1]: {samples[1].shape}")
-                        self.log_samples(
-                            logger,
-                            pl_module,
-                            samples,
-                            domain,
-                            log_name,
-                        )
+                        to_decode.setdefault(domain, []).append((log_name, pred))
+
+            decoded: dict[str, tuple[str, Any]] = {}
+            for domain, preds in to_decode.items():
+                samples = pl_module.decode_domain(
+                    torch.cat([pred for _, pred in preds]), domain
+                )
+                if domain == "attr" and self.exclude_colors:
+                    samples[1] = torch.cat(
+                        [
+                            samples[1],
+                            torch.tensor([1, 0, 0], device=pl_module.device).expand(
+                                samples[1].size(0), 3
+                            ),
+                        ],
+                        dim=-1,
+                    )
+                samples = self.decode_samples(pl_module, samples, domain)
+                splits = split_samples(samples, [pred.size(0) for _, pred in preds])
+                for (log_name, _), split in zip(preds, splits, strict=True):
+                    decoded[log_name] = (domain, split)
+
+        for logger in loggers:
+            for log_name, (domain, samples) in decoded.items():
+                self.log_samples(logger, samples, domain, log_name)
 
     def on_train_epoch_end(
         self,
@@ -723,19 +895,44 @@ class LogGWImagesCallback(pl.Callback):
         if not isinstance(pl_module, GlobalWorkspaceBase):
             return
 
-        return self.on_callback(trainer.loggers, pl_module)
+        self.on_callback(trainer.loggers, pl_module)
+        if self.media_logger is not None:
+            self.media_logger.flush()
 
-    def log_samples(
-        self,
-        logger: Logger,
-        pl_module: GlobalWorkspaceBase,
-        samples: Any,
-        domain: str,
-        mode: str,
+    def teardown(
+        self, trainer: pl.Trainer, pl_module: pl.LightningModule, stage: str
     ) -> None:
+        if self.media_logger is not None:
+            self.media_logger.close()
+
+    def submit(self, task: Callable[..., None], samples: Any, *args: Any) -> None:
+        """
+        Runs `task(samples, *args)` in the media logger thread if there is one,
+        with a detached CPU copy of the samples.
+        """
+        if self.media_logger is None:
+            task(samples, *args)
+        else:
+            samples = detach_to_cpu(samples)
+            self.media_logger.submit(lambda: task(samples, *args))
+
+    def decode_samples(
+        self, pl_module: GlobalWorkspaceBase, samples: Any, domain: str
+    ) -> Any:
+        """
+        Decodes the samples of the latent domains ("v_latents", "attr_latents" and
+        "t_latents") with their domain module. The samples of the other domains are
+        returned as is.
+
+        Args:
+            pl_module (`GlobalWorkspaceBase`): the global workspace
+            samples (`Any`): the samples of the domain
+            domain (`str`): the domain name
+
+        Returns:
+            `Any`: the samples to give to `log_samples`
+        """
         match domain:
-            case "v":
-                self.log_visual_samples(logger, samples, mode)
             case "v_latents":
                 assert "v_latents" in pl_module.domain_mods
 
@@ -743,13 +940,51 @@ class LogGWImagesCallback(pl.Callback):
                     VisualLatentDomainModule,
                     pl_module.domain_mods["v_latents"],
                 )
-                self.log_visual_samples(logger, module.decode_images(samples), mode)
-            case "attr":
+                return module.decode_images(samples)
+            case "attr_latents":
+                assert "attr_latents" in pl_module.domain_mods
+
+                attr_module = cast(
+                    AttributeLatentDomainModule,
+                    pl_module.domain_mods["attr_latents"],
+                )
+                return attr_module.decode_attributes(samples)
+            case "t_latents":
+                assert "t_latents" in pl_module.domain_mods
+
+                text_module = cast(
+                    TextLatentDomainModule,
+                    pl_module.domain_mods["t_latents"],
+                )
+                return text_module.decode_text(samples)
+        return samples
+
+    def log_samples(
+        self,
+        logger: Logger,
+        samples: Any,
+        domain: str,
+        mode: str,
+    ) -> None:
+        """
+        Args:
+            logger (`Logger`): the logger
+            samples (`Any`): the samples of the domain, decoded with
+                `decode_samples`
+            domain (`str`): the domain name
+            mode (`str`): the name of the logged samples
+        """
+        match domain:
+            case "v" | "v_latents":
+                self.log_visual_samples(logger, samples, mode)
+            case "attr" | "attr_latents":
                 self.log_attribute_samples(logger, samples, mode)
             case "t":
                 self.log_text_samples(logger, samples, mode)
                 if "attr" in samples:
                     self.log_attribute_samples(logger, samples["attr"], mode + "_attr")
+            case "t_latents":
+                self.log_text_samples(logger, samples, mode)
 
     def log_visual_samples(
         self,
@@ -757,31 +992,51 @@ class LogGWImagesCallback(pl.Callback):
         samples: Any,
         mode: str,
     ) -> None:
+        self.submit(self._log_visual_samples, samples, logger, mode, self.get_step())
+
+    def _log_visual_samples(
+        self, samples: Any, logger: Logger, mode: str, step: int
+    ) -> None:
+        from torchvision.utils import make_grid
+
         images = make_grid(samples, nrow=self.ncols, pad_value=1)
-        log_image(logger, f"{self.log_key}/{mode}", images, self.get_step())
+        log_image(logger, f"{self.log_key}/{mode}", images, step)
 
     def log_attribute_samples(
         self,
         logger: Logger,
         samples: Any,
         mode: str,
+    ) -> None:
+        self.submit(
+            self._log_attribute_samples, samples, logger, mode, self.get_step()
+        )
+
+    def _log_attribute_samples(
+        self, samples: Any, logger: Logger, mode: str, step: int
     ) -> None:
         image = attribute_image_grid(
             samples,
             image_size=self.image_size,
             ncols=self.ncols,
         )
-        log_image(logger, f"{self.log_key}/{mode}", image, self.get_step())
+        log_image(logger, f"{self.log_key}/{mode}", image, step)
 
     def log_text_samples(
         self,
         logger: Logger,
         samples: Any,
         mode: str,
+    ) -> None:
+        assert self.tokenizer is not None
+        self.submit(self._log_text_samples, samples, logger, mode, self.get_step())
+
+    def _log_text_samples(
+        self, samples: Any, logger: Logger, mode: str, step: int
     ) -> None:
         assert self.tokenizer is not None
         text = self.tokenizer.decode_batch(
             samples["tokens"].detach().cpu().tolist(), skip_special_tokens=True
         )
         text = [[t.replace("<pad>", "")] for t in text]
-        log_text(logger, f"{self.log_key}/{mode}", ["text"], text, self.get_step())
\ No newline at end of file
+        log_text(logger, f"{self.log_key}/{mode}", ["text"], text, step)
\ No newline at end of file
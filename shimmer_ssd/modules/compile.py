@@ -0,0 +1,45 @@
+from collections.abc import Iterable
+from typing import Any
+
+import torch
+from torch import nn
+
+from shimmer_ssd.config import Compile
+
+
+def compile_options(config: Compile) -> dict[str, Any]:
+    return {
+        "mode": config.mode,
+        "dynamic": config.dynamic,
+        "backend": config.backend,
+        "fullgraph": config.fullgraph,
+    }
+
+
+def compile_step(module: nn.Module, config: Compile) -> None:
+    """
+    Compiles the `step_losses` method of a domain module, which computes the
+    losses of its `generic_step`. The compiled method replaces it on this instance
+    only, so the state dict and the checkpoints are unchanged.
+
+    Args:
+        module (`nn.Module`): a domain module with a `step_losses` method
+        config (`Compile`): the compile config
+    """
+    module.step_losses = torch.compile(  # type: ignore
+        module.step_losses, **compile_options(config)
+    )
+
+
+def compile_modules(modules: Iterable[nn.Module], config: Compile) -> None:
+    """
+    Compiles the `forward` of each module in place (see `nn.Module.compile`), so
+    the state dict and the checkpoints are unchanged.
+
+    Args:
+        modules (`Iterable[nn.Module]`): the modules to compile, e.g. the GW
+            encoders and decoders
+        config (`Compile`): the compile config
+    """
+    for module in modules:
+        module.compile(**compile_options(config))
@@ -2,13 +2,17 @@
 From https://github.com/fartashf/vsepp
 """
 
-from typing import Literal
+from collections.abc import Callable
+from functools import partial
+from typing import Any, Literal, cast
 
 import torch
+from lightning.pytorch import Callback, LightningModule, Trainer
 from shimmer import ContrastiveLoss as CLIPContrastiveLoss
 from shimmer import LossOutput
 from torch import nn
-from torch.nn.functional import normalize
+from torch.autograd.function import once_differentiable
+from torch.nn.functional import cross_entropy, normalize
 
 
 def cosine_sim(im: torch.Tensor, s: torch.Tensor) -> torch.Tensor:
@@ -16,13 +20,122 @@ def cosine_sim(im: torch.Tensor, s: torch.Tensor) -> torch.Tensor:
     return im.mm(s.t())
 
 
-def order_sim(im: torch.Tensor, s: torch.Tensor) -> torch.Tensor:
-    """Order embeddings similarity measure $max(0, s-im)$"""
-    YmX = s.unsqueeze(1).expand(s.size(0), im.size(0), s.size(1)) - im.unsqueeze(
-        0
-    ).expand(s.size(0), im.size(0), s.size(1))
-    score = -YmX.clamp(min=0).pow(2).sum(2).sqrt().t()
-    return score
+def cosine_paired_sim(im: torch.Tensor, s: torch.Tensor) -> torch.Tensor:
+    """Cosine similarity of the pairs (im[i], s[i])"""
+    return (im * s).sum(1)
+
+
+def order_paired_sim(im: torch.Tensor, s: torch.Tensor) -> torch.Tensor:
+    """Order embeddings similarity of the pairs (im[i], s[i])"""
+    squared_norms = (s - im).clamp(min=0).pow(2).sum(1)
+    # the gradient is 0 where the norm is 0
+    return -torch.where(squared_norms > 0, squared_norms.clamp(min=1e-24).sqrt(), 0)
+
+
+class OrderSim(torch.autograd.Function):
+    """
+    Order embeddings similarity computed by tiles of `tile_size` rows of `im`.
+    Only the (tile_size, N_s, D) differences of the current tile are allocated,
+    in the forward and backward passes, instead of the whole (N_im, N_s, D) tensor.
+    """
+
+    @staticmethod
+    def forward(
+        ctx: Any, im: torch.Tensor, s: torch.Tensor, tile_size: int
+    ) -> torch.Tensor:
+        scores = im.new_empty(im.size(0), s.size(0))
+        for start in range(0, im.size(0), tile_size):
+            tile = im[start : start + tile_size]
+            diff = (s.unsqueeze(0) - tile.unsqueeze(1)).clamp_(min=0)
+            scores[start : start + tile_size] = -diff.pow_(2).sum(2).sqrt_()
+        ctx.save_for_backward(im, s, scores)
+        ctx.tile_size = tile_size
+        return scores
+
+    @staticmethod
+    @once_differentiable
+    def backward(
+        ctx: Any, grad_scores: torch.Tensor
+    ) -> tuple[torch.Tensor | None, torch.Tensor | None, None]:
+        im, s, scores = ctx.saved_tensors
+        tile_size: int = ctx.tile_size
+        grad_im = torch.empty_like(im) if ctx.needs_input_grad[0] else None
+        grad_s = torch.zeros_like(s) if ctx.needs_input_grad[1] else None
+        for start in range(0, im.size(0), tile_size):
+            tile = im[start : start + tile_size]
+            diff = (s.unsqueeze(0) - tile.unsqueeze(1)).clamp_(min=0)
+            # d score / d s = -diff / norm, and the opposite for im.
+            # The gradient is 0 where the norm is 0.
+            norms = -scores[start : start + tile_size]
+            weights = torch.where(
+                norms > 0,
+                grad_scores[start : start + tile_size] / norms.clamp(min=1e-12),
+                0,
+            )
+            if grad_im is not None:
+                grad_im[start : start + tile_size] = torch.einsum(
+                    "tn,tnd->td", weights, diff
+                )
+            if grad_s is not None:
+                grad_s -= torch.einsum("tn,tnd->nd", weights, diff)
+        return grad_im, grad_s, None
+
+
+def order_sim(im: torch.Tensor, s: torch.Tensor, tile_size: int = 256) -> torch.Tensor:
+    """
+    Order embeddings similarity measure $max(0, s-im)$
+
+    Args:
+        im (`torch.Tensor`): embeddings of shape (N_im, D)
+        s (`torch.Tensor`): embeddings of shape (N_s, D)
+        tile_size (`int`): number of rows of `im` processed at once. The peak
+            memory is `tile_size * N_s * D` instead of `N_im * N_s * D`.
+
+    Returns:
+        `torch.Tensor`: scores of shape (N_im, N_s)
+    """
+    return OrderSim.apply(im, s, tile_size)
+
+
+class MaxViolationLoss(torch.autograd.Function):
+    """
+    VSE++ hinge loss on the hardest negatives:
+    $sum_i [m + max_{j != i} S_ij - S_ii]_+ + sum_j [m + max_{i != j} S_ij - S_jj]_+$
+
+    As the hinge is monotonic, it is applied after the row and column max of the
+    scores. Only the argmax indices are kept for the backward pass, which writes
+    the gradient of the scores in a single N x N tensor.
+    """
+
+    @staticmethod
+    def forward(
+        ctx: Any, scores: torch.Tensor, diag_mask: torch.Tensor, margin: float
+    ) -> torch.Tensor:
+        diagonal = scores.diagonal()
+        negatives = scores.masked_fill(diag_mask, float("-inf"))
+        # hardest negative of each row (caption retrieval) and column (image
+        # retrieval)
+        row_max, row_indices = negatives.max(1)
+        col_max, col_indices = negatives.max(0)
+        del negatives
+        cost_s = margin + row_max - diagonal
+        cost_im = margin + col_max - diagonal
+        ctx.save_for_backward(row_indices, col_indices, cost_s > 0, cost_im > 0)
+        return cost_s.clamp(min=0).sum() + cost_im.clamp(min=0).sum()
+
+    @staticmethod
+    @once_differentiable
+    def backward(ctx: Any, grad_loss: torch.Tensor) -> tuple[torch.Tensor, None, None]:
+        row_indices, col_indices, active_s, active_im = ctx.saved_tensors
+        grad_s = active_s * grad_loss
+        grad_im = active_im * grad_loss
+        size = row_indices.size(0)
+        indices = torch.arange(size, device=row_indices.device)
+        grad_scores = grad_loss.new_zeros(size, size)
+        grad_scores.index_put_((indices, row_indices), grad_s, accumulate=True)
+        grad_scores.index_put_((col_indices, indices), grad_im, accumulate=True)
+        grad_scores.diagonal().sub_(grad_s + grad_im)
+        return grad_scores, None, None
 
 
 class ContrastiveLoss(nn.Module):
@@ -35,43 +148,273 @@ class ContrastiveLoss(nn.Module):
         margin: float,
         measure: Literal["cosine", "order"],
         max_violation: bool,
+        order_tile_size: int = 256,
+        micro_batch_size: int | None = None,
     ):
+        """
+        Args:
+            margin: rank loss margin
+            measure: similarity measure used (cosine|order)
+            max_violation: use max instead of sum in the rank loss
+            order_tile_size: tile size of the order similarity (see `order_sim`)
+            micro_batch_size: if given, the score matrix is never materialized.
+                See `micro_batched_hinge_loss`. Requires `max_violation`.
+        """
         super().__init__()
         self.margin = margin
+        self.sim: Callable[[torch.Tensor, torch.Tensor], torch.Tensor]
+        self.paired_sim: Callable[[torch.Tensor, torch.Tensor], torch.Tensor]
         if measure == "order":
-            self.sim = order_sim
+            self.sim = partial(order_sim, tile_size=order_tile_size)
+            self.paired_sim = order_paired_sim
         else:
             self.sim = cosine_sim
+            self.paired_sim = cosine_paired_sim
 
+        if micro_batch_size is not None and not max_violation:
+            raise ValueError("micro_batch_size can only be used with max_violation.")
         self.max_violation = max_violation
+        self.micro_batch_size = micro_batch_size
+        self._diag_masks: dict[tuple[int, torch.device], torch.Tensor] = {}
 
-    def forward(self, im: torch.Tensor, s: torch.Tensor) -> torch.Tensor:
-        im = normalize(im)
-        s = normalize(s)
-        # compute image-sentence score matrix
-        scores = self.sim(im, s)
-        diagonal = scores.diag().view(im.size(0), 1)
-        d1 = diagonal.expand_as(scores)
-        d2 = diagonal.t().expand_as(scores)
+    def diag_mask(self, size: int, device: torch.device) -> torch.Tensor:
+        """Boolean identity matrix, cached per size and device."""
+        key = (size, device)
+        if key not in self._diag_masks:
+            self._diag_masks[key] = torch.eye(size, dtype=torch.bool, device=device)
+        return self._diag_masks[key]
 
+    def hinge_loss(
+        self,
+        scores: torch.Tensor,
+        queue_scores_s: torch.Tensor | None = None,
+        queue_scores_im: torch.Tensor | None = None,
+    ) -> torch.Tensor:
+        """
+        Args:
+            scores (`torch.Tensor`): image-sentence score matrix, positive pairs
+                on the diagonal
+            queue_scores_s (`torch.Tensor | None`): additional negatives for each
+                image, scores of shape (N, Q) with queued sentences
+            queue_scores_im (`torch.Tensor | None`): additional negatives for each
+                sentence, scores of shape (Q, N) with queued images
+
+        Returns:
+            `torch.Tensor`: the rank loss
+        """
+        mask = self.diag_mask(scores.size(0), scores.device)
+        diagonal = scores.diagonal()
+        # keep the maximum violating negative for each query
+        if self.max_violation and queue_scores_s is None and queue_scores_im is None:
+            return MaxViolationLoss.apply(scores, mask, self.margin)
+        if self.max_violation:
+            negatives = scores.masked_fill(mask, float("-inf"))
+            row_max = negatives.max(1).values
+            col_max = negatives.max(0).values
+            if queue_scores_s is not None:
+                row_max = torch.maximum(row_max, queue_scores_s.max(1).values)
+            if queue_scores_im is not None:
+                col_max = torch.maximum(col_max, queue_scores_im.max(0).values)
+            return (self.margin + row_max - diagonal).clamp(min=0).sum() + (
+                self.margin + col_max - diagonal
+            ).clamp(min=0).sum()
+
+        loss = torch.zeros((), device=scores.device, dtype=scores.dtype)
+        if queue_scores_s is not None:
+            loss += (
+                (self.margin + queue_scores_s - diagonal.unsqueeze(1))
+                .clamp(min=0)
+                .sum()
+            )
+        if queue_scores_im is not None:
+            loss += (
+                (self.margin + queue_scores_im - diagonal.unsqueeze(0))
+                .clamp(min=0)
+                .sum()
+            )
         # compare every diagonal score to scores in its column
         # caption retrieval
-        cost_s = (self.margin + scores - d1).clamp(min=0)
+        cost_s = (self.margin + scores - diagonal.unsqueeze(1)).clamp(min=0)
         # compare every diagonal score to scores in its row
         # image retrieval
-        cost_im = (self.margin + scores - d2).clamp(min=0)
+        cost_im = (self.margin + scores - diagonal.unsqueeze(0)).clamp(min=0)
 
         # clear diagonals
-        mask = torch.eye(scores.size(0), device=im.device) > 0.5
         cost_s = cost_s.masked_fill_(mask, 0)
         cost_im = cost_im.masked_fill_(mask, 0)
+        return loss + cost_s.sum() + cost_im.sum()
 
-        # keep the maximum violating negative for each query
-        if self.max_violation:
-            cost_s = cost_s.max(1)[0]
-            cost_im = cost_im.max(0)[0]
+    @torch.no_grad()
+    def hardest_negatives(
+        self, im: torch.Tensor, s: torch.Tensor, size: int
+    ) -> tuple[torch.Tensor, torch.Tensor, torch.Tensor, torch.Tensor]:
+        """
+        Finds the hardest negatives of the positive pairs (im[i], s[i]), i < size,
+        by computing the scores by micro-batches of `micro_batch_size` rows.
+        The rows of `im` and `s` after `size` are only used as negatives.
+
+        Returns:
+            `tuple[torch.Tensor, torch.Tensor, torch.Tensor, torch.Tensor]`: for
+            each pair, the index in `s` of the hardest negative of im[i], the index
+            in `im` of the hardest negative of s[i], and whether they exist.
+        """
+        assert self.micro_batch_size is not None
+        micro_batch_size = self.micro_batch_size
+        device = im.device
+
+        # negative sentences of each image
+        row_max = torch.empty(size, device=device, dtype=im.dtype)
+        row_indices = torch.empty(size, device=device, dtype=torch.long)
+        for start in range(0, size, micro_batch_size):
+            scores = self.sim(im[start : min(start + micro_batch_size, size)], s)
+            rows = torch.arange(scores.size(0), device=device)
+            scores[rows, rows + start] = float("-inf")
+            torch.max(
+                scores,
+                1,
+                out=(
+                    row_max[start : start + scores.size(0)],
+                    row_indices[start : start + scores.size(0)],
+                ),
+            )
+
+        # negative images of each sentence
+        col_max = torch.full((size,), float("-inf"), device=device, dtype=im.dtype)
+        col_indices = torch.zeros(size, device=device, dtype=torch.long)
+        for start in range(0, im.size(0), micro_batch_size):
+            scores = self.sim(im[start : start + micro_batch_size], s[:size])
+            rows = torch.arange(
+                max(0, min(scores.size(0), size - start)), device=device
+            )
+            scores[rows, rows + start] = float("-inf")
+            chunk_max, chunk_indices = scores.max(0)
+            is_harder = chunk_max > col_max
+            col_max = torch.where(is_harder, chunk_max, col_max)
+            col_indices = torch.where(is_harder, chunk_indices + start, col_indices)
 
-        return cost_s.sum() + cost_im.sum()
+        return (
+            row_indices,
+            col_indices,
+            row_max > float("-inf"),
+            col_max > float("-inf"),
+        )
+
+    def micro_batched_hinge_loss(
+        self,
+        im: torch.Tensor,
+        s: torch.Tensor,
+        queue_im: torch.Tensor | None = None,
+        queue_s: torch.Tensor | None = None,
+    ) -> torch.Tensor:
+        """
+        Max violation loss computed without the score matrix: the hardest
+        negatives are found without gradient by micro-batches (see
+        `hardest_negatives`), then only the scores of the positive pairs and of
+        the hardest negatives are recomputed with gradient. The loss and
+        gradients are the same as `hinge_loss` with O(micro_batch_size x N)
+        memory.
+
+        Args:
+            im (`torch.Tensor`): normalized images of shape (N, D)
+            s (`torch.Tensor`): normalized sentences of shape (N, D)
+            queue_im (`torch.Tensor | None`): additional negative images
+            queue_s (`torch.Tensor | None`): additional negative sentences
+
+        Returns:
+            `torch.Tensor`: the rank loss
+        """
+        size = im.size(0)
+        all_im = im if queue_im is None else torch.cat([im, queue_im])
+        all_s = s if queue_s is None else torch.cat([s, queue_s])
+        row_indices, col_indices, has_row, has_col = self.hardest_negatives(
+            all_im, all_s, size
+        )
+
+        diagonal = self.paired_sim(im, s)
+        cost_s = self.margin + self.paired_sim(im, all_s[row_indices]) - diagonal
+        cost_im = self.margin + self.paired_sim(all_im[col_indices], s) - diagonal
+        return (cost_s.clamp(min=0) * has_row).sum() + (
+            cost_im.clamp(min=0) * has_col
+        ).sum()
+
+    def forward(self, im: torch.Tensor, s: torch.Tensor) -> torch.Tensor:
+        im = normalize(im)
+        s = normalize(s)
+        if self.micro_batch_size is not None:
+            return self.micro_batched_hinge_loss(im, s)
+        # compute image-sentence score matrix
+        scores = self.sim(im, s)
+        return self.hinge_loss(scores)
+
+
+class NegativesQueue(nn.Module):
+    def __init__(self, size: int):
+        """
+        FIFO queue of detached (x, y) representations of past batches, used as
+        additional negatives (as in MoCo, https://arxiv.org/abs/1911.05722).
+        The buffers are allocated on the first `push` and are not saved in the
+        checkpoints.
+
+        Args:
+            size (`int`): maximum number of queued pairs
+        """
+        super().__init__()
+        self.size = size
+        self.x: torch.Tensor
+        self.y: torch.Tensor
+        self.register_buffer("x", None, persistent=False)
+        self.register_buffer("y", None, persistent=False)
+        self.pointer = 0
+        self.num_filled = 0
+
+    def negatives(self) -> tuple[torch.Tensor, torch.Tensor] | None:
+        if self.num_filled == 0:
+            return None
+        return self.x[: self.num_filled], self.y[: self.num_filled]
+
+    @torch.no_grad()
+    def push(self, x: torch.Tensor, y: torch.Tensor) -> None:
+        if self.x is None:
+            self.x = x.new_empty(self.size, x.size(1))
+            self.y = y.new_empty(self.size, y.size(1))
+        # only the last `size` representations fit in the queue
+        x, y = x[-self.size :], y[-self.size :]
+        indices = (torch.arange(x.size(0), device=x.device) + self.pointer) % self.size
+        self.x[indices] = x.detach().to(self.x.dtype)
+        self.y[indices] = y.detach().to(self.y.dtype)
+        self.pointer = (self.pointer + x.size(0)) % self.size
+        self.num_filled = min(self.num_filled + x.size(0), self.size)
+
+
+def clip_loss(scores: torch.Tensor, logit_scale: torch.Tensor) -> torch.Tensor:
+    """
+    CLIP contrastive loss (same as shimmer's `ContrastiveLoss`) from the cosine
+    similarity matrix of the normalized representations.
+    """
+    labels = torch.arange(scores.size(0), device=scores.device)
+    logits = logit_scale.exp() * scores
+    return 0.5 * (cross_entropy(logits, labels) + cross_entropy(logits.t(), labels))
+
+
+@torch.no_grad()
+def micro_batched_clip_loss(
+    x: torch.Tensor, y: torch.Tensor, logit_scale: torch.Tensor, micro_batch_size: int
+) -> torch.Tensor:
+    """
+    Same as `clip_loss` on the normalized `x` and `y`, with the logits computed by
+    micro-batches of rows. Without gradient.
+    """
+    scale = logit_scale.exp()
+    positives = scale * cosine_paired_sim(x, y)
+    row_logsumexp = torch.empty_like(positives)
+    col_logsumexp = torch.full_like(positives, float("-inf"))
+    for start in range(0, x.size(0), micro_batch_size):
+        logits = scale * (x[start : start + micro_batch_size] @ y.t())
+        row_logsumexp[start : start + logits.size(0)] = logits.logsumexp(1)
+        col_logsumexp = torch.logaddexp(col_logsumexp, logits.logsumexp(0))
+    return 0.5 * (
+        (row_logsumexp - positives).mean() + (col_logsumexp - positives).mean()
+    )
 
 
 class VSEPPContrastiveLoss(nn.Module):
@@ -81,19 +424,124 @@ class VSEPPContrastiveLoss(nn.Module):
         measure: Literal["cosine", "order"],
         max_violation: bool,
         logit_scale: torch.Tensor,
+        order_tile_size: int = 256,
+        clip_metric_every_n_steps: int | None = 1,
+        queue_size: int = 0,
+        num_queues: int = 1,
+        micro_batch_size: int | None = None,
     ):
         """
+        The representations are normalized once. With the cosine measure, the
+        score matrix is shared between the VSE++ loss and the CLIP metric.
+
         Args:
             margin: rank loss margin
             measure: similarity measure used (cosine|order)
             max_violation: use max instead of sum in the rank loss
+            order_tile_size: tile size of the order similarity (see `order_sim`)
+            clip_metric_every_n_steps: the CLIP loss is only a logged metric, it
+                is computed without gradient every n training steps (see
+                `start_step`) and at every call in eval mode. None to never
+                compute it.
+            queue_size: if positive, the representations of the past training
+                batches are queued and used as additional negatives.
+            num_queues: number of queues, one per domain pair. The loss is called
+                for each domain pair in the same order at each step, so the
+                queues are used in turn, starting from the first one at each step
+                (see `start_step`).
+            micro_batch_size: if given, the score matrices are computed by
+                micro-batches of rows and never materialized (see
+                `ContrastiveLoss.micro_batched_hinge_loss`).
         """
         super().__init__()
-        self.vsepp_contrastive_loss = ContrastiveLoss(margin, measure, max_violation)
+        self.vsepp_contrastive_loss = ContrastiveLoss(
+            margin, measure, max_violation, order_tile_size, micro_batch_size
+        )
+        # only holds the logit scale
         self.clip_contrastive_loss = CLIPContrastiveLoss(logit_scale)
+        self.measure = measure
+        self.micro_batch_size = micro_batch_size
+        self.clip_metric_every_n_steps = clip_metric_every_n_steps
+        self._step = 0
+        self.queues = nn.ModuleList(
+            [NegativesQueue(queue_size) for _ in range(num_queues if queue_size else 0)]
+        )
+        self._queue_index = 0
+
+    def start_step(self, step: int) -> None:
+        """
+        Called at the start of each training step (see
+        `ContrastiveLossStepCallback`) so that the first domain pair of the step
+        uses the first queue, and all the pairs compute the CLIP metric at the
+        same steps.
+
+        Args:
+            step (`int`): the training step
+        """
+        self._queue_index = 0
+        self._step = step
+
+    def next_queue(self) -> NegativesQueue | None:
+        """Queue of the current domain pair, only used in training."""
+        if not self.training or not len(self.queues):
+            return None
+        queue = cast(NegativesQueue, self.queues[self._queue_index])
+        self._queue_index = (self._queue_index + 1) % len(self.queues)
+        return queue
+
+    def should_compute_clip(self) -> bool:
+        if self.clip_metric_every_n_steps is None:
+            return False
+        if not self.training:
+            return True
+        return self._step % self.clip_metric_every_n_steps == 0
 
     def forward(self, x: torch.Tensor, y: torch.Tensor) -> LossOutput:
-        return LossOutput(
-            self.vsepp_contrastive_loss(x, y),
-            {"clip": self.clip_contrastive_loss(x, y).loss},
-        )
+        x = normalize(x)
+        y = normalize(y)
+        loss_fn = self.vsepp_contrastive_loss
+        queue = self.next_queue()
+        negatives = queue.negatives() if queue is not None else None
+        scores: torch.Tensor | None = None
+        if self.micro_batch_size is not None:
+            loss = loss_fn.micro_batched_hinge_loss(x, y, *(negatives or ()))
+        elif negatives is not None:
+            queue_x, queue_y = negatives
+            scores = loss_fn.sim(x, y)
+            loss = loss_fn.hinge_loss(
+                scores, loss_fn.sim(x, queue_y), loss_fn.sim(queue_x, y)
+            )
+        else:
+            scores = loss_fn.sim(x, y)
+            loss = loss_fn.hinge_loss(scores)
+        if queue is not None:
+            queue.push(x, y)
+
+        metrics: dict[str, torch.Tensor] = {}
+        if not self.should_compute_clip():
+            return LossOutput(loss, metrics)
+        logit_scale = self.clip_contrastive_loss.logit_scale
+        if self.micro_batch_size is not None:
+            metrics["clip"] = micro_batched_clip_loss(
+                x, y, logit_scale, self.micro_batch_size
+            )
+        else:
+            with torch.no_grad():
+                if scores is None or self.measure != "cosine":
+                    scores = x @ y.t()
+                metrics["clip"] = clip_loss(scores, logit_scale)
+        return LossOutput(loss, metrics)
+
+
+class ContrastiveLossStepCallback(Callback):
+    """
+    Calls `VSEPPContrastiveLoss.start_step` at the start of each training batch
+    for the VSEPP contrastive losses of the module.
+    """
+
+    def on_train_batch_start(
+        self, trainer: Trainer, pl_module: LightningModule, batch: Any, batch_idx: int
+    ) -> None:
+        for module in pl_module.modules():
+            if isinstance(module, VSEPPContrastiveLoss):
+                module.start_step(trainer.global_step)
@@ -0,0 +1,303 @@
+"""
+Decoding strategies to generate token sequences from the text domain latent
+representations.
+
+All strategies run on the whole batch at once and carry the decoder hidden state
+between steps, so each step only feeds the last emitted token to the decoder.
+"""
+
+from abc import ABC, abstractmethod
+from typing import Protocol
+
+import torch
+from torch import nn
+
+
+class TextDecoder(Protocol):
+    """
+    What a decoding strategy needs from the text domain module
+    (see `shimmer_ssd.modules.domains.text.GRUTextDomainModule`).
+    """
+
+    seq_length: int
+    vocab_size: int
+    embeddings: nn.Embedding
+
+    @property
+    def padding_token(self) -> int: ...
+
+    def decode_step(
+        self, inputs: torch.Tensor, hidden: torch.Tensor | None = None
+    ) -> tuple[torch.Tensor, torch.Tensor]: ...
+
+
+class DecodingStrategy(ABC):
+    @abstractmethod
+    def __call__(self, model: TextDecoder, z: torch.Tensor) -> dict[str, torch.Tensor]:
+        """
+        Generates token sequences from the latent representations.
+
+        Args:
+            model (`TextDecoder`): the text model to decode with
+            z (`torch.Tensor`): latent representations of shape (batch, latent_dim)
+
+        Returns:
+            `dict[str, torch.Tensor]`: at least "tokens" of shape
+            (batch, seq_length).
+        """
+        ...
+
+
+class StepwiseDecoding(DecodingStrategy):
+    def __init__(self, stop_on_padding: bool = False) -> None:
+        """
+        Decodes one token per step for each sequence, the token being chosen by
+        `select`.
+
+        Args:
+            stop_on_padding (`bool`): stop decoding once every sequence of the batch
+                has emitted the padding token. The remaining positions are filled with
+                the padding token (and a token distribution peaked on it).
+        """
+        self.stop_on_padding = stop_on_padding
+
+    @abstractmethod
+    def select(self, logits: torch.Tensor) -> torch.Tensor:
+        """
+        Chooses the next tokens.
+
+        Args:
+            logits (`torch.Tensor`): next token logits of shape (batch, vocab_size)
+
+        Returns:
+            `torch.Tensor`: the next tokens of shape (batch,)
+        """
+        ...
+
+    def __call__(self, model: TextDecoder, z: torch.Tensor) -> dict[str, torch.Tensor]:
+        batch_size = z.size(0)
+        token_dist = z.new_empty(batch_size, model.seq_length, model.vocab_size)
+        tokens = torch.full(
+            (batch_size, model.seq_length),
+            model.padding_token,
+            dtype=torch.long,
+            device=z.device,
+        )
+        finished = torch.zeros(batch_size, dtype=torch.bool, device=z.device)
+
+        inputs = z.unsqueeze(1)
+        hidden: torch.Tensor | None = None
+        for k in range(model.seq_length):
+            step_dist, hidden = model.decode_step(inputs, hidden)
+            step_tokens = self.select(step_dist)
+            token_dist[:, k] = step_dist
+            tokens[:, k] = step_tokens
+
+            if self.stop_on_padding:
+                finished |= step_tokens == model.padding_token
+                if k < model.seq_length - 1 and bool(finished.all()):
+                    token_dist[:, k + 1 :] = torch.finfo(token_dist.dtype).min
+                    token_dist[:, k + 1 :, model.padding_token] = 0
+                    break
+            inputs = model.embeddings(step_tokens).unsqueeze(1)
+        return {"token_dist": token_dist, "tokens": tokens}
+
+
+class GreedyDecoding(StepwiseDecoding):
+    """Selects the most likely token at each step."""
+
+    def select(self, logits: torch.Tensor) -> torch.Tensor:
+        return torch.argmax(logits, -1)
+
+
+def filter_logits(
+    logits: torch.Tensor, top_k: int | None = None, top_p: float | None = None
+) -> torch.Tensor:
+    """
+    Sets to -inf the logits of the tokens that cannot be sampled.
+
+    Args:
+        logits (`torch.Tensor`): logits of shape (batch, vocab_size)
+        top_k (`int | None`): only keep the `top_k` most likely tokens
+        top_p (`float | None`): only keep the smallest set of most likely tokens
+            whose cumulative probability reaches `top_p` (nucleus sampling)
+
+    Returns:
+        `torch.Tensor`: the filtered logits
+    """
+    if top_k is not None and top_k < logits.size(-1):
+        kth_logit = torch.topk(logits, top_k, dim=-1).values[:, -1:]
+        logits = logits.masked_fill(logits < kth_logit, float("-inf"))
+    if top_p is not None and top_p < 1:
+        sorted_logits, sorted_indices = torch.sort(logits, dim=-1, descending=True)
+        sorted_probs = sorted_logits.softmax(dim=-1)
+        # remove tokens for which the previous ones already reach top_p.
+        # The most likely token is always kept.
+        mass_before = sorted_probs.cumsum(dim=-1) - sorted_probs
+        sorted_logits = sorted_logits.masked_fill(mass_before >= top_p, float("-inf"))
+        logits = torch.full_like(logits, float("-inf")).scatter(
+            -1, sorted_indices, sorted_logits
+        )
+    return logits
+
+
+class SamplingDecoding(StepwiseDecoding):
+    def __init__(
+        self,
+        temperature: float = 1.0,
+        top_k: int | None = None,
+        top_p: float | None = None,
+        stop_on_padding: bool = False,
+        generator: torch.Generator | None = None,
+    ) -> None:
+        """
+        Samples the next token from the (filtered) predicted distribution.
+
+        Args:
+            temperature (`float`): softmax temperature
+            top_k (`int | None`): only sample from the `top_k` most likely tokens
+            top_p (`float | None`): only sample from the smallest set of tokens
+                whose cumulative probability reaches `top_p`
+            stop_on_padding (`bool`): see `StepwiseDecoding`
+            generator (`torch.Generator | None`): random generator used for
+                sampling, for reproducible generations
+        """
+        super().__init__(stop_on_padding)
+        if temperature <= 0:
+            raise ValueError("temperature should be positive.")
+        if top_k is not None and top_k < 1:
+            raise ValueError("top_k should be at least 1.")
+        if top_p is not None and not 0 < top_p <= 1:
+            raise ValueError("top_p should be in (0, 1].")
+
+        self.temperature = temperature
+        self.top_k = top_k
+        self.top_p = top_p
+        self.generator = generator
+
+    def select(self, logits: torch.Tensor) -> torch.Tensor:
+        logits = filter_logits(logits / self.temperature, self.top_k, self.top_p)
+        return torch.multinomial(
+            logits.softmax(dim=-1), 1, generator=self.generator
+        ).squeeze(1)
+
+
+class BeamSearchDecoding(DecodingStrategy):
+    def __init__(self, num_beams: int = 4, length_penalty: float = 1.0) -> None:
+        """
+        Beam search over the `batch x num_beams` hypotheses, decoded as one batch.
+
+        A hypothesis is finished once it emits the padding token. The final
+        hypotheses are ranked with `log_prob / length ** length_penalty` where
+        `length` is the number of tokens before padding.
+
+        Args:
+            num_beams (`int`): number of hypotheses kept for each sample
+            length_penalty (`float`): exponent of the length normalization. Values
+                above 0 favor longer sequences, 0 ranks on the raw log probability.
+
+        The output contains the "tokens" of the best hypothesis of shape
+        (batch, seq_length), the log probabilities of the next token along this
+        hypothesis as "token_dist" of shape (batch, seq_length, vocab_size), like the
+        other strategies, and its normalized "scores" of shape (batch,).
+        """
+        if num_beams < 1:
+            raise ValueError("num_beams should be at least 1.")
+        self.num_beams = num_beams
+        self.length_penalty = length_penalty
+
+    def __call__(self, model: TextDecoder, z: torch.Tensor) -> dict[str, torch.Tensor]:
+        if self.num_beams > model.vocab_size:
+            raise ValueError("num_beams cannot be larger than the vocabulary size.")
+
+        batch_size = z.size(0)
+        num_beams = self.num_beams
+        vocab_size = model.vocab_size
+        padding_token = model.padding_token
+        batch_offsets = (
+            torch.arange(batch_size, device=z.device).unsqueeze(1) * num_beams
+        )
+
+        logits, hidden = model.decode_step(z.unsqueeze(1))
+        log_probs = logits.log_softmax(dim=-1)
+        scores, last_tokens = log_probs.topk(num_beams, dim=-1)
+        # next token log probabilities of each hypothesis and index of the
+        # hypothesis it extends, to build the token distributions of the best one
+        step_log_probs = [log_probs.unsqueeze(1).expand(-1, num_beams, -1)]
+        step_beam_indices: list[torch.Tensor] = []
+        sequences = torch.full(
+            (batch_size, num_beams, model.seq_length),
+            padding_token,
+            dtype=torch.long,
+            device=z.device,
+        )
+        sequences[:, :, 0] = last_tokens
+        finished = last_tokens == padding_token
+        lengths = (~finished).long()
+        # (num_layers, batch * num_beams, hidden_dim)
+        hidden = hidden.repeat_interleave(num_beams, dim=1)
+
+        # finished hypotheses can only be extended with padding, at no cost
+        padding_log_probs = torch.full(
+            (vocab_size,), float("-inf"), dtype=scores.dtype, device=z.device
+        )
+        padding_log_probs[padding_token] = 0
+
+        for k in range(1, model.seq_length):
+            if bool(finished.all()):
+                break
+            inputs = model.embeddings(last_tokens.view(-1)).unsqueeze(1)
+            logits, hidden = model.decode_step(inputs, hidden)
+            log_probs = logits.log_softmax(dim=-1).view(
+                batch_size, num_beams, vocab_size
+            )
+            log_probs = torch.where(
+                finished.unsqueeze(-1), padding_log_probs, log_probs
+            )
+            candidates = scores.unsqueeze(-1) + log_probs
+            scores, flat_indices = candidates.view(batch_size, -1).topk(
+                num_beams, dim=-1
+            )
+            beam_indices = flat_indices // vocab_size
+            step_log_probs.append(log_probs)
+            step_beam_indices.append(beam_indices)
+            last_tokens = flat_indices % vocab_size
+
+            sequences = sequences.gather(
+                1, beam_indices.unsqueeze(-1).expand_as(sequences)
+            )
+            sequences[:, :, k] = last_tokens
+            lengths = (
+                lengths.gather(1, beam_indices) + (last_tokens != padding_token).long()
+            )
+            finished = finished.gather(1, beam_indices) | (last_tokens == padding_token)
+            hidden = hidden[:, (batch_offsets + beam_indices).view(-1)]
+
+        normalized_scores = scores / lengths.clamp(min=1).to(scores.dtype).pow(
+            self.length_penalty
+        )
+        best_scores, best_beams = normalized_scores.max(dim=-1)
+        batch_indices = torch.arange(batch_size, device=z.device)
+
+        # positions after the end of the search are padding
+        min_log_prob = torch.finfo(scores.dtype).min
+        token_dist = torch.full(
+            (batch_size, model.seq_length, vocab_size),
+            min_log_prob,
+            dtype=scores.dtype,
+            device=z.device,
+        )
+        token_dist[:, len(step_log_probs) :, padding_token] = 0
+        # follow the best hypotheses back to the first step: the distribution of
+        # step k was computed by the hypothesis that step k extended
+        beams = best_beams
+        for k in range(len(step_beam_indices), 0, -1):
+            beams = step_beam_indices[k - 1][batch_indices, beams]
+            token_dist[:, k] = step_log_probs[k][batch_indices, beams]
+        token_dist[:, 0] = step_log_probs[0][:, 0]
+        token_dist.clamp_(min=min_log_prob)
+        return {
+            "token_dist": token_dist,
+            "tokens": sequences[batch_indices, best_beams],
+            "scores": best_scores,
+        }
@@ -16,6 +16,8 @@ from shimmer.modules.vae import (
 from torch import nn
 from torch.optim.lr_scheduler import OneCycleLR
 
+from shimmer_ssd.modules.domains.base import StepLossesDomainModule
+
 
 class Encoder(VAEEncoder):
     def __init__(
@@ -78,7 +80,7 @@ class Decoder(VAEDecoder):
         return [self.decoder_categories(out), self.decoder_attributes(out)]
 
 
-class AttributeDomainModule(DomainModule):
+class AttributeDomainModule(StepLossesDomainModule[Sequence[torch.Tensor]]):
     in_dim = 11
 
     def __init__(
@@ -152,11 +154,7 @@ class AttributeDomainModule(DomainModule):
     def forward(self, x: Sequence[torch.Tensor]) -> list[torch.Tensor]:  # type: ignore
         return self.decode(self.encode(x))
 
-    def generic_step(
-        self,
-        x: Sequence[torch.Tensor],
-        mode: str = "train",
-    ) -> torch.Tensor:
+    def step_losses(self, x: Sequence[torch.Tensor]) -> dict[str, torch.Tensor]:
         x_categories, x_attributes = x[0], x[1]
 
         (mean, logvar), reconstruction = self.vae(x)
@@ -179,18 +177,13 @@ class AttributeDomainModule(DomainModule):
         kl_loss = kl_divergence_loss(mean, logvar)
         total_loss = reconstruction_loss + self.vae.beta * kl_loss
 
-        self.log(
-            f"{mode}/reconstruction_loss_categories",
-            reconstruction_loss_categories,
-        )
-        self.log(
-            f"{mode}/reconstruction_loss_attributes",
-            reconstruction_loss_attributes,
-        )
-        self.log(f"{mode}/reconstruction_loss", reconstruction_loss)
-        self.log(f"{mode}/kl_loss", kl_loss)
-        self.log(f"{mode}/loss", total_loss)
-        return total_loss
+        return {
+            "reconstruction_loss_categories": reconstruction_loss_categories,
+            "reconstruction_loss_attributes": reconstruction_loss_attributes,
+            "reconstruction_loss": reconstruction_loss,
+            "kl_loss": kl_loss,
+            "loss": total_loss,
+        }
 
     def validation_step(  # type: ignore
         self, batch: Mapping[str, Sequence[torch.Tensor]], _
@@ -225,6 +218,30 @@ class AttributeDomainModule(DomainModule):
         }
 
 
+class AttributeLatentDomainModule(DomainModule):
+    def __init__(self, attr_module: AttributeDomainModule):
+        """
+        Uses the latent representations pre-saved with `ssd extract attr` instead of
+        encoding the attributes.
+        """
+        super().__init__(attr_module.latent_dim)
+        self.attr_module = attr_module
+
+    def encode(self, x: torch.Tensor) -> torch.Tensor:
+        return x
+
+    def decode(self, z: torch.Tensor) -> torch.Tensor:
+        return z
+
+    def compute_loss(
+        self, pred: torch.Tensor, target: torch.Tensor, raw_target: Any
+    ) -> LossOutput:
+        return LossOutput(F.mse_loss(pred, target, reduction="mean"))
+
+    def decode_attributes(self, z: torch.Tensor) -> list[torch.Tensor]:
+        return self.attr_module.decode(z)
+
+
 class AttributeWithUnpairedDomainModule(DomainModule):
     in_dim = 11
 
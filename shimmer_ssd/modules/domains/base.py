@@ -0,0 +1,47 @@
+from abc import ABC, abstractmethod
+from typing import Generic, TypeVar
+
+import torch
+from shimmer.modules.domain import DomainModule
+
+_T = TypeVar("_T")
+
+
+class StepLossesDomainModule(Generic[_T], ABC, DomainModule):
+    """
+    Domain module trained on its own (`ssd train v/attr/t`). The losses of its
+    training and validation steps are computed by `step_losses` and logged by
+    `generic_step`.
+    """
+
+    @abstractmethod
+    def step_losses(self, x: _T) -> dict[str, torch.Tensor]:
+        """
+        Losses of a training or validation step, with the total loss in "loss".
+        It only does tensor operations, and `generic_step` logs the losses, so it
+        can be compiled without graph breaks (see
+        `shimmer_ssd.modules.compile.compile_step`).
+
+        Args:
+            x (`_T`): the batch of the domain
+
+        Returns:
+            `dict[str, torch.Tensor]`: the losses and metrics to log, by name
+        """
+        ...
+
+    def generic_step(self, x: _T, mode: str = "train") -> torch.Tensor:
+        """
+        Logs the losses of `step_losses` as "{mode}/{name}".
+
+        Args:
+            x (`_T`): the batch of the domain
+            mode (`str`): "train" or "val"
+
+        Returns:
+            `torch.Tensor`: the total loss
+        """
+        losses = self.step_losses(x)
+        for name, loss in losses.items():
+            self.log(f"{mode}/{name}", loss)
+        return losses["loss"]
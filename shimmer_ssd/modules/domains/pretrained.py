@@ -1,79 +1,140 @@
+import inspect
+import time
 from collections.abc import Mapping, Sequence
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
+from typing import Any, cast
 
 from shimmer import DomainModule, GWDecoder, GWEncoder
 from shimmer.modules.gw_module import GWDecoder_legacy
-
 from torch.nn import Linear, Module
 
-from shimmer_ssd import PROJECT_DIR
+from shimmer_ssd import LOGGER, PROJECT_DIR
 from shimmer_ssd.ckpt_migrations import (
+    load_checkpoint,
     migrate_model,
+    module_from_checkpoint,
 )
-from shimmer_ssd.config import DomainModuleVariant, LoadedDomainConfig
+from shimmer_ssd.config import DomainModules, DomainModuleVariant, LoadedDomainConfig
 from shimmer_ssd.errors import ConfigurationError
 from shimmer_ssd.modules.domains.attribute import (
     AttributeDomainModule,
+    AttributeLatentDomainModule,
     AttributeLegacyDomainModule,
     AttributeWithUnpairedDomainModule,
 )
-from shimmer_ssd.modules.domains.text import GRUTextDomainModule, Text2Attr
+from shimmer_ssd.modules.domains.text import (
+    GRUTextDomainModule,
+    Text2Attr,
+    TextLatentDomainModule,
+)
 from shimmer_ssd.modules.domains.visual import (
     VisualDomainModule,
     VisualLatentDomainModule,
     VisualLatentDomainWithUnpairedModule,
 )
 
+MIGRATION_FOLDERS: dict[DomainModuleVariant, str] = {
+    DomainModuleVariant.v: "visual_mod",
+    DomainModuleVariant.v_latents: "visual_mod",
+    DomainModuleVariant.v_latents_unpaired: "visual_mod",
+    DomainModuleVariant.attr: "attr_mod",
+    DomainModuleVariant.attr_latents: "attr_mod",
+    DomainModuleVariant.attr_unpaired: "attr_mod",
+}
+
+
+def checkpoint_paths(domain: LoadedDomainConfig) -> list[Path]:
+    """The checkpoints read by `load_pretrained_module` for the domain."""
+    match domain.domain_type:
+        case DomainModuleVariant.attr_legacy | DomainModuleVariant.attr_legacy_no_color:
+            return []
+        case DomainModuleVariant.t_attr if "text_model_path" in domain.args:
+            return [Path(domain.args["text_model_path"]), Path(domain.checkpoint_path)]
+        case _:
+            return [Path(domain.checkpoint_path)]
+
+
+def load_checkpoints(domain: LoadedDomainConfig) -> dict[Path, dict[str, Any]]:
+    """
+    Migrates the checkpoints of the domain if needed and loads them with
+    `load_checkpoint` (memory-mapped).
+
+    Args:
+        domain (`LoadedDomainConfig`): the domain
+
+    Returns:
+        `dict[Path, dict[str, Any]]`: the checkpoints, to give to
+            `load_pretrained_module`
+    """
+    if domain.domain_type in MIGRATION_FOLDERS:
+        migrate_model(
+            domain.checkpoint_path,
+            PROJECT_DIR
+            / "shimmer_ssd"
+            / "migrations"
+            / MIGRATION_FOLDERS[domain.domain_type],
+        )
+    return {path: load_checkpoint(path) for path in checkpoint_paths(domain)}
+
+
+def load_pretrained_module(
+    domain: LoadedDomainConfig,
+    checkpoints: Mapping[Path, Mapping[str, Any]] | None = None,
+) -> DomainModule:
+    """
+    Loads the domain module from its checkpoint.
+
+    Args:
+        domain (`LoadedDomainConfig`): the domain to load
+        checkpoints (`Mapping[Path, Mapping[str, Any]] | None`): the checkpoints
+            already loaded with `load_checkpoints`. If None, they are migrated and
+            loaded here.
+
+    Returns:
+        `DomainModule`: the loaded domain module
+    """
+    if checkpoints is None:
+        checkpoints = load_checkpoints(domain)
+
+    def checkpoint(path: str | Path) -> Mapping[str, Any]:
+        return checkpoints[Path(path)]
 
-def load_pretrained_module(domain: LoadedDomainConfig) -> DomainModule:
-    domain_checkpoint = Path(domain.checkpoint_path)
     module: DomainModule
     match domain.domain_type:
         case DomainModuleVariant.v:
-            migrate_model(
-                domain_checkpoint,
-                PROJECT_DIR / "shimmer_ssd" / "migrations" / "visual_mod",
-            )
-            module = VisualDomainModule.load_from_checkpoint(
-                domain_checkpoint, **domain.args
+            module = module_from_checkpoint(
+                VisualDomainModule, checkpoint(domain.checkpoint_path), **domain.args
             )
 
         case DomainModuleVariant.v_latents:
-            migrate_model(
-                domain_checkpoint,
-                PROJECT_DIR / "shimmer_ssd" / "migrations" / "visual_mod",
-            )
-            v_module = VisualDomainModule.load_from_checkpoint(
-                domain_checkpoint, **domain.args
+            v_module = module_from_checkpoint(
+                VisualDomainModule, checkpoint(domain.checkpoint_path), **domain.args
             )
             module = VisualLatentDomainModule(v_module)
 
         case DomainModuleVariant.v_latents_unpaired:
-            migrate_model(
-                domain_checkpoint,
-                PROJECT_DIR / "shimmer_ssd" / "migrations" / "visual_mod",
-            )
-            v_module = VisualDomainModule.load_from_checkpoint(
-                domain_checkpoint, **domain.args
+            v_module = module_from_checkpoint(
+                VisualDomainModule, checkpoint(domain.checkpoint_path), **domain.args
             )
             module = VisualLatentDomainWithUnpairedModule(v_module)
 
         case DomainModuleVariant.attr:
-            migrate_model(
-                domain_checkpoint,
-                PROJECT_DIR / "shimmer_ssd" / "migrations" / "attr_mod",
+            module = module_from_checkpoint(
+                AttributeDomainModule, checkpoint(domain.checkpoint_path), **domain.args
             )
-            module = AttributeDomainModule.load_from_checkpoint(
-                domain_checkpoint, **domain.args
+
+        case DomainModuleVariant.attr_latents:
+            attr_module = module_from_checkpoint(
+                AttributeDomainModule, checkpoint(domain.checkpoint_path), **domain.args
             )
+            module = AttributeLatentDomainModule(attr_module)
 
         case DomainModuleVariant.attr_unpaired:
-            migrate_model(
-                domain_checkpoint,
-                PROJECT_DIR / "shimmer_ssd" / "migrations" / "attr_mod",
-            )
-            module = AttributeWithUnpairedDomainModule.load_from_checkpoint(
-                domain_checkpoint, **domain.args
+            module = module_from_checkpoint(
+                AttributeWithUnpairedDomainModule,
+                checkpoint(domain.checkpoint_path),
+                **domain.args,
             )
 
         case DomainModuleVariant.attr_legacy:
@@ -85,23 +146,37 @@ def load_pretrained_module(domain: LoadedDomainConfig) -> DomainModule:
             module.load_hyperparameters(**domain.args) #alpha, temperature)
 
         case DomainModuleVariant.t:
-            module = GRUTextDomainModule.load_from_checkpoint(
-                domain_checkpoint, **domain.args, strict=False
+            module = module_from_checkpoint(
+                GRUTextDomainModule,
+                checkpoint(domain.checkpoint_path),
+                strict=False,
+                **domain.args,
             )
             # Freezes the projector
             # module.embeddings.requires_grad_(False)
             # module.projector.requires_grad_(False)
 
+        case DomainModuleVariant.t_latents:
+            text_module = module_from_checkpoint(
+                GRUTextDomainModule,
+                checkpoint(domain.checkpoint_path),
+                strict=False,
+                **domain.args,
+            )
+            module = TextLatentDomainModule(text_module)
+
         case DomainModuleVariant.t_attr:
             assert (
                 "text_model_path" in domain.args
             ), 'add "text_model_path" to the domain\'s args.'
-            text_model = GRUTextDomainModule.load_from_checkpoint(
-                domain.args["text_model_path"],
+            text_model = module_from_checkpoint(
+                GRUTextDomainModule,
+                checkpoint(domain.args["text_model_path"]),
                 **domain.args.get("t_args", {}),
             )
-            module = Text2Attr.load_from_checkpoint(
-                domain_checkpoint,
+            module = module_from_checkpoint(
+                Text2Attr,
+                checkpoint(domain.checkpoint_path),
                 text_model=text_model,
                 **domain.args.get("model_args", {}),
             )
@@ -111,6 +186,91 @@ def load_pretrained_module(domain: LoadedDomainConfig) -> DomainModule:
     return module
 
 
+def _init_module(
+    cls: type[DomainModule], defaults: Mapping[str, Any], args: Mapping[str, Any]
+) -> DomainModule:
+    # like with `module_from_checkpoint`, the args that the module does not accept
+    # are ignored
+    params = inspect.signature(cls).parameters
+    kwargs = {key: val for key, val in {**defaults, **args}.items() if key in params}
+    return cls(**kwargs)
+
+
+def init_domain_module(
+    domain: LoadedDomainConfig, config: DomainModules
+) -> DomainModule:
+    """
+    Same as `load_pretrained_module` but the module is randomly initialized from the
+    `domain_modules` config (and the domain args) instead of loaded from its
+    checkpoint. Used to benchmark the training without pretrained checkpoints.
+
+    Args:
+        domain (`LoadedDomainConfig`): the domain to create. Its checkpoint is not
+            used.
+        config (`DomainModules`): the domain modules config
+
+    Returns:
+        `DomainModule`: the randomly initialized domain module
+    """
+    visual_args = {
+        "num_channels": config.visual.num_channels,
+        "latent_dim": config.visual.latent_dim,
+        "ae_dim": config.visual.ae_dim,
+        "beta": config.visual.beta,
+    }
+    attr_args = {
+        "latent_dim": config.attribute.latent_dim,
+        "hidden_dim": config.attribute.hidden_dim,
+        "beta": config.attribute.beta,
+        "coef_categories": config.attribute.coef_categories,
+        "coef_attributes": config.attribute.coef_attributes,
+    }
+    text_args = {
+        "latent_dim": config.text.latent_dim,
+        "hidden_dim": config.text.hidden_dim,
+        "vocab_size": config.text.vocab_size,
+        "seq_length": config.text.seq_length,
+    }
+
+    module: DomainModule
+    match domain.domain_type:
+        case DomainModuleVariant.v:
+            module = _init_module(VisualDomainModule, visual_args, domain.args)
+        case DomainModuleVariant.v_latents:
+            v_module = _init_module(VisualDomainModule, visual_args, domain.args)
+            module = VisualLatentDomainModule(cast(VisualDomainModule, v_module))
+        case DomainModuleVariant.v_latents_unpaired:
+            v_module = _init_module(VisualDomainModule, visual_args, domain.args)
+            module = VisualLatentDomainWithUnpairedModule(
+                cast(VisualDomainModule, v_module)
+            )
+        case DomainModuleVariant.attr:
+            module = _init_module(AttributeDomainModule, attr_args, domain.args)
+        case DomainModuleVariant.attr_latents:
+            attr_module = _init_module(AttributeDomainModule, attr_args, domain.args)
+            module = AttributeLatentDomainModule(
+                cast(AttributeDomainModule, attr_module)
+            )
+        case DomainModuleVariant.attr_unpaired:
+            module = _init_module(
+                AttributeWithUnpairedDomainModule, attr_args, domain.args
+            )
+        case DomainModuleVariant.t:
+            module = _init_module(GRUTextDomainModule, text_args, domain.args)
+        case DomainModuleVariant.t_latents:
+            text_module = _init_module(GRUTextDomainModule, text_args, domain.args)
+            module = TextLatentDomainModule(cast(GRUTextDomainModule, text_module))
+        case DomainModuleVariant.attr_legacy | DomainModuleVariant.attr_legacy_no_color:
+            # these modules have no weights
+            module = load_pretrained_module(domain)
+        case _:
+            raise ConfigurationError(
+                f"Domain type {domain.domain_type.name} can only be loaded from its "
+                "pretrained checkpoint."
+            )
+    return module
+
+
 def get_from_dict_or_val(
     val: int | Mapping[DomainModuleVariant, int], key: DomainModuleVariant, log: str
 ) -> int:
@@ -133,8 +293,10 @@ def load_pretrained_domain(
     decoders_n_layers: int | Mapping[DomainModuleVariant, int],
     is_linear: bool = False,
     bias: bool = False,
+    module: DomainModule | None = None,
 ) -> tuple[DomainModule, Module, Module]:
-    module = load_pretrained_module(domain)
+    if module is None:
+        module = load_pretrained_module(domain)
     encoder_hidden_dim = get_from_dict_or_val(
         encoders_hidden_dim, domain.domain_type, "global_workspace.encoders.hidden_dim"
     )
@@ -184,6 +346,14 @@ def load_pretrained_domain(
     return module, gw_encoder, gw_decoder
 
 
+def timed_load_checkpoints(
+    domain: LoadedDomainConfig,
+) -> tuple[dict[Path, dict[str, Any]], float]:
+    start = time.perf_counter()
+    checkpoints = load_checkpoints(domain)
+    return checkpoints, time.perf_counter() - start
+
+
 def load_pretrained_domains(
     domains: Sequence[LoadedDomainConfig],
     workspace_dim: int,
@@ -194,12 +364,30 @@ def load_pretrained_domains(
     is_linear: bool = False,
     bias: bool = False,
 ) -> tuple[dict[str, DomainModule], dict[str, Module], dict[str, Module]]:
+    kinds = [domain.domain_type.kind.value.kind for domain in domains]
+    if len(set(kinds)) != len(kinds):
+        raise ConfigurationError("Cannot load multiple domains of the same kind.")
+
+    # Only the migrations and the loading of the checkpoints run concurrently. As
+    # the checkpoints are memory-mapped, their tensors are read when the modules
+    # are created below, one domain after the other, as their initialization and
+    # the GW encoders and decoders draw from the global RNG.
+    with ThreadPoolExecutor(max_workers=max(1, len(domains))) as executor:
+        domain_checkpoints = list(executor.map(timed_load_checkpoints, domains))
+
     modules: dict[str, DomainModule] = {}
     gw_encoders: dict[str, Module] = {}
     gw_decoders: dict[str, Module] = {}
-    for domain in domains:
-        if domain.domain_type.kind.value.kind in modules:
-            raise ConfigurationError("Cannot load multiple domains of the same kind.")
+    for kind, domain, (checkpoints, load_time) in zip(
+        kinds, domains, domain_checkpoints, strict=True
+    ):
+        start = time.perf_counter()
+        module = load_pretrained_module(domain, checkpoints)
+        LOGGER.debug(
+            f"Loaded domain {domain.domain_type.name} from {domain.checkpoint_path} "
+            f"in {load_time + time.perf_counter() - start:.2f}s "
+            f"(loading the checkpoints: {load_time:.2f}s)."
+        )
         model, encoder, decoder = load_pretrained_domain(
             domain,
             workspace_dim,
@@ -209,8 +397,9 @@ def load_pretrained_domains(
             decoders_n_layers,
             is_linear,
             bias,
+            module=module,
         )
-        modules[domain.domain_type.kind.value.kind] = model
-        gw_encoders[domain.domain_type.kind.value.kind] = encoder
-        gw_decoders[domain.domain_type.kind.value.kind] = decoder
-    return modules, gw_encoders, gw_decoders
\ No newline at end of file
+        modules[kind] = model
+        gw_encoders[kind] = encoder
+        gw_decoders[kind] = decoder
+    return modules, gw_encoders, gw_decoders
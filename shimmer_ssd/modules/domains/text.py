@@ -19,6 +19,9 @@ from torch import nn
 from torch.optim.adamw import AdamW
 from torch.optim.lr_scheduler import OneCycleLR
 
+from shimmer_ssd.modules.decoding import DecodingStrategy, GreedyDecoding
+from shimmer_ssd.modules.domains.base import StepLossesDomainModule
+
 
 class Encoder(VAEEncoder):
     def __init__(
@@ -77,7 +80,7 @@ class Decoder(VAEDecoder):
         return [self.decoder(z)]
 
 
-class TextDomainModule(DomainModule):
+class TextDomainModule(StepLossesDomainModule[Mapping[str, torch.Tensor]]):
     in_dim = 768
 
     def __init__(
@@ -172,11 +175,7 @@ class TextDomainModule(DomainModule):
     def forward(self, x: Mapping[str, torch.Tensor]) -> dict[str, torch.Tensor]:
         return self.decode(self.encode(x))
 
-    def generic_step(
-        self,
-        x: Mapping[str, torch.Tensor],
-        mode: str = "train",
-    ) -> torch.Tensor:
+    def step_losses(self, x: Mapping[str, torch.Tensor]) -> dict[str, torch.Tensor]:
         (mean, logvar), reconstruction = self.vae((x["bert"],))
 
         reconstruction_loss = gaussian_nll(
@@ -197,17 +196,17 @@ class TextDomainModule(DomainModule):
         total_loss = (
             reconstruction_loss + self.vae.beta * kl_loss + loss_attr_cat + loss_attr
         )
+        for grammar_loss in grammar_losses.values():
+            total_loss = total_loss + grammar_loss
 
-        for grammar_loss_name, grammar_loss in grammar_losses.items():
-            total_loss += grammar_loss
-            self.log(f"{mode}/{grammar_loss_name}", grammar_loss)
-
-        self.log(f"{mode}/reconstruction_loss", reconstruction_loss)
-        self.log(f"{mode}/kl_loss", kl_loss)
-        self.log(f"{mode}/attr_category", loss_attr_cat)
-        self.log(f"{mode}/attr_attr", loss_attr)
-        self.log(f"{mode}/loss", total_loss)
-        return total_loss
+        return {
+            **grammar_losses,
+            "reconstruction_loss": reconstruction_loss,
+            "kl_loss": kl_loss,
+            "attr_category": loss_attr_cat,
+            "attr_attr": loss_attr,
+            "loss": total_loss,
+        }
 
     def validation_step(  # type: ignore
         self, batch: Mapping[str, Mapping[str, torch.Tensor]], _
@@ -261,7 +260,7 @@ class GRUEncoder(nn.Module):
         return out
 
 
-class GRUTextDomainModule(DomainModule):
+class GRUTextDomainModule(StepLossesDomainModule[Mapping[str, torch.Tensor]]):
     in_dim = 768
 
     def __init__(
@@ -304,6 +303,8 @@ class GRUTextDomainModule(DomainModule):
         )
         self.text_head = nn.Linear(self.hidden_dim, self.vocab_size)
 
+        self.decoding_strategy: DecodingStrategy = GreedyDecoding()
+
         self.optim_lr = optim_lr
         self.optim_weight_decay = optim_weight_decay
 
@@ -331,18 +332,66 @@ class GRUTextDomainModule(DomainModule):
     def encode(self, x: Mapping[str, torch.Tensor]) -> torch.Tensor:
         return self.projector(x["bert"])
 
+    @property
+    def padding_token(self) -> int:
+        return self._padding_token
+
     def decode(self, z: torch.Tensor) -> dict[str, torch.Tensor]:
-        context = z.unsqueeze(1)
-        pad_tokens = self.embeddings(
-            torch.zeros(
-                z.size(0), self.seq_length - 1, dtype=torch.long, device=z.device
-            )
-        )
-        seq = torch.cat([context, pad_tokens], dim=1)
-        for k in range(0, self.seq_length - 1):
-            out = self.decode_one(seq)
-            seq[:, k + 1] = self.embeddings(out["tokens"][:, k])
-        return self.decode_one(seq)
+        return self.generate(z)
+
+    def generate(
+        self, z: torch.Tensor, strategy: DecodingStrategy | None = None
+    ) -> dict[str, torch.Tensor]:
+        """
+        Generates token sequences from latent representations.
+
+        Args:
+            z (`torch.Tensor`): latent representations of shape (batch, latent_dim)
+            strategy (`DecodingStrategy | None`): decoding strategy to use. Defaults
+                to `self.decoding_strategy` (greedy decoding unless changed).
+
+        Returns:
+            `dict[str, torch.Tensor]`: the output of the strategy, with at least the
+            "tokens" of shape (batch, seq_length).
+        """
+        return (strategy or self.decoding_strategy)(self, z)
+
+    def greedy_decode(
+        self, z: torch.Tensor, stop_on_padding: bool = False
+    ) -> dict[str, torch.Tensor]:
+        """
+        Incremental greedy decoding (see `GreedyDecoding`).
+
+        Args:
+            z (`torch.Tensor`): latent representations of shape (batch, latent_dim)
+            stop_on_padding (`bool`): stop decoding once every sequence of the batch
+                has emitted the padding token. The remaining positions are filled with
+                the padding token (and a token distribution peaked on it).
+
+        Returns:
+            `dict[str, torch.Tensor]`: "token_dist" of shape
+            (batch, seq_length, vocab_size) and "tokens" of shape (batch, seq_length).
+        """
+        return self.generate(z, GreedyDecoding(stop_on_padding))
+
+    def decode_step(
+        self, inputs: torch.Tensor, hidden: torch.Tensor | None = None
+    ) -> tuple[torch.Tensor, torch.Tensor]:
+        """
+        Runs one decoding step.
+
+        Args:
+            inputs (`torch.Tensor`): embedding of the last token (or the latent
+                context for the first step) of shape (batch, 1, latent_dim)
+            hidden (`torch.Tensor | None`): GRU hidden state of the previous step, of
+                shape (num_layers, batch, hidden_dim). None for the first step.
+
+        Returns:
+            `tuple[torch.Tensor, torch.Tensor]`: the logits of the next token of shape
+            (batch, vocab_size) and the new hidden state.
+        """
+        out, hidden = self.decoder(inputs, hidden)
+        return self.text_head(out[:, -1]), hidden
 
     def decode_one(self, z: torch.Tensor) -> dict[str, torch.Tensor]:
         out, _ = self.decoder(z)
@@ -364,20 +413,16 @@ class GRUTextDomainModule(DomainModule):
         loss = F.cross_entropy(out["token_dist"].transpose(1, 2), target["tokens"])
         padding_mask = target["tokens"] != self._padding_token
 
-        padded_out = out["tokens"][padding_mask]
-        padded_target = target["tokens"][padding_mask]
-
-        acc = (padded_out == padded_target).sum() / padded_out.size(0)
+        # masked sums instead of indexing with the mask, which has a data-dependent
+        # shape (a graph break when compiled and a device sync on GPU)
+        correct = (out["tokens"] == target["tokens"]) & padding_mask
+        acc = correct.sum() / padding_mask.sum()
         return loss, acc
 
-    def generic_step(
-        self, x: Mapping[str, torch.Tensor], mode: str = "train"
-    ) -> torch.Tensor:
+    def step_losses(self, x: Mapping[str, torch.Tensor]) -> dict[str, torch.Tensor]:
         z = self.encode(x)
         loss, acc = self.text_token_loss(z, x)
-        self.log(f"{mode}/loss", loss)
-        self.log(f"{mode}/acc", acc)
-        return loss
+        return {"loss": loss, "acc": acc}
 
     def validation_step(  # type: ignore
         self, batch: Mapping[str, Mapping[str, torch.Tensor]], _
@@ -405,7 +450,31 @@ class GRUTextDomainModule(DomainModule):
         return {"optimizer": optimizer}
 
 
-class Text2Attr(DomainModule):
+class TextLatentDomainModule(DomainModule):
+    def __init__(self, text_module: GRUTextDomainModule):
+        """
+        Uses the latent representations pre-saved with `ssd extract t` instead of
+        projecting the BERT vectors.
+        """
+        super().__init__(text_module.latent_dim)
+        self.text_module = text_module
+
+    def encode(self, x: torch.Tensor) -> torch.Tensor:
+        return x
+
+    def decode(self, z: torch.Tensor) -> torch.Tensor:
+        return z
+
+    def compute_loss(
+        self, pred: torch.Tensor, target: torch.Tensor, raw_target: Any
+    ) -> LossOutput:
+        return LossOutput(F.mse_loss(pred, target, reduction="mean"))
+
+    def decode_text(self, z: torch.Tensor) -> dict[str, torch.Tensor]:
+        return self.text_module.decode(z)
+
+
+class Text2Attr(StepLossesDomainModule[Mapping[str, Any]]):
     def __init__(
         self,
         latent_dim: int,
@@ -476,11 +545,7 @@ class Text2Attr(DomainModule):
     def forward(self, x: Mapping[str, Any]) -> dict[str, list[torch.Tensor]]:
         return self.decode(self.encode(x))
 
-    def generic_step(
-        self,
-        x: Mapping[str, Any],
-        mode: str = "train",
-    ) -> torch.Tensor:
+    def step_losses(self, x: Mapping[str, Any]) -> dict[str, torch.Tensor]:
         text: Mapping[str, torch.Tensor] = x["t"]
         attr: Sequence[torch.Tensor] = x["attr"]
         text_l = self.text_model.encode(text)
@@ -493,12 +558,12 @@ class Text2Attr(DomainModule):
         pred_cats = pred_cat.argmax(dim=1)
         acc = (cats == pred_cats).sum() / cats.size(0)
 
-        self.log(f"{mode}/loss_cat", loss_cat)
-        self.log(f"{mode}/loss_attr", loss_attr)
-        self.log(f"{mode}/acc_cat", acc)
-        self.log(f"{mode}/loss", total_loss)
-
-        return total_loss
+        return {
+            "loss_cat": loss_cat,
+            "loss_attr": loss_attr,
+            "acc_cat": acc,
+            "loss": total_loss,
+        }
 
     def validation_step(  # type: ignore
         self, batch: Mapping[str, Mapping[str, torch.Tensor]], _
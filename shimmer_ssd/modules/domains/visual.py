@@ -9,10 +9,11 @@ from torch.nn.functional import mse_loss
 from torch.optim.lr_scheduler import OneCycleLR
 
 from shimmer_ssd import LOGGER
+from shimmer_ssd.modules.domains.base import StepLossesDomainModule
 from shimmer_ssd.modules.vae import RAEDecoder, RAEEncoder
 
 
-class VisualDomainModule(DomainModule):
+class VisualDomainModule(StepLossesDomainModule[torch.Tensor]):
     def __init__(
         self,
         num_channels: int,
@@ -66,11 +67,7 @@ class VisualDomainModule(DomainModule):
     def forward(self, x: torch.Tensor) -> torch.Tensor:  # type: ignore
         return self.decode(self.encode(x))
 
-    def generic_step(
-        self,
-        x: torch.Tensor,
-        mode: str = "train",
-    ) -> torch.Tensor:
+    def step_losses(self, x: torch.Tensor) -> dict[str, torch.Tensor]:
         (mean, logvar), reconstruction = self.vae(x)
 
         reconstruction_loss = gaussian_nll(reconstruction, torch.tensor(0), x).sum()
@@ -78,10 +75,11 @@ class VisualDomainModule(DomainModule):
         kl_loss = kl_divergence_loss(mean, logvar)
         total_loss = reconstruction_loss + self.vae.beta * kl_loss
 
-        self.log(f"{mode}/reconstruction_loss", reconstruction_loss)
-        self.log(f"{mode}/kl_loss", kl_loss)
-        self.log(f"{mode}/loss", total_loss)
-        return total_loss
+        return {
+            "reconstruction_loss": reconstruction_loss,
+            "kl_loss": kl_loss,
+            "loss": total_loss,
+        }
 
     def validation_step(  # type: ignore
         self,
@@ -5,7 +5,6 @@ import matplotlib.pyplot as plt
 import numpy as np
 import torch
 from matplotlib.figure import Figure
-from matplotlib.gridspec import GridSpec
 from PIL.Image import Image
 from shimmer.modules.vae import VAE, VAEDecoder, VAEEncoder
 from torch import nn
@@ -156,6 +155,18 @@ class RAEDecoder(VAEDecoder):
         return self.out_layer(self.layers(z[:, :, None, None]))
 
 
+def _cat_samples(chunks: Sequence[Any]) -> Any:
+    if isinstance(chunks[0], torch.Tensor):
+        return torch.cat(chunks)
+    return [_cat_samples(parts) for parts in zip(*chunks, strict=True)]
+
+
+def _slice_samples(samples: Any, start: int, end: int) -> Any:
+    if isinstance(samples, torch.Tensor):
+        return samples[start:end]
+    return [_slice_samples(x, start, end) for x in samples]
+
+
 def dim_exploration_figure(
     vae: VAE,
     z_size: int,
@@ -167,68 +178,98 @@ def dim_exploration_figure(
     image_size: int = 32,
     plot_dims: Sequence[int] | None = None,
     fig_dim: int = 5,
+    batch_size: int = 1024,
 ) -> Figure:
-    possible_dims = plot_dims or np.arange(z_size)
-
-    fig_size = (len(possible_dims) - 1) * fig_dim
+    """
+    Figure exploring the VAE latent space: for each pair of dimensions (i, j),
+    a `num_samples x num_samples` grid of the decoded latent vectors where dims i
+    and j vary between `range_start` and `range_end` and the other dims are 0.
 
-    fig = plt.figure(constrained_layout=True, figsize=(fig_size, fig_size), dpi=1)
+    The pairs are decoded and drawn in a single canvas by chunks of about
+    `batch_size` latent vectors (at least one pair), so only the decoded samples
+    of one chunk are held at once.
 
-    gs = GridSpec(len(possible_dims), len(possible_dims), figure=fig)
-    done_dims: list[set[int]] = []
+    Args:
+        vae (`VAE`): the VAE to explore
+        z_size (`int`): size of the latent space
+        device (`torch.device`): device of the VAE
+        ax_from_tensors (`Callable[[Any, int, int], Image]`): renders the decoded
+            samples of a pair as an image, given the image size and number of
+            columns
+        num_samples (`int`): number of values of each dim
+        range_start (`int`): first value of the dims
+        range_end (`int`): last value of the dims
+        image_size (`int`): size of the decoded images
+        plot_dims (`Sequence[int] | None`): dims to explore. Defaults to all.
+            Repeated dims are only plotted once.
+        fig_dim (`int`): size in inches of the grid of each pair
+        batch_size (`int`): number of latent vectors decoded at once
 
-    for i, dim_i in enumerate(possible_dims):
-        for j, dim_j in enumerate(possible_dims):
-            if dim_i == dim_j or {dim_i, dim_j} in done_dims:
-                continue
+    Returns:
+        `Figure`: the figure. The grid of dims (i, j) is in column i and row j,
+        its rows vary dim i and its columns vary dim j.
+    """
+    possible_dims = list(
+        dict.fromkeys(plot_dims if plot_dims is not None else range(z_size))
+    )
+    num_dims = len(possible_dims)
+    # pairs (i, j) with i < j, drawn in column i, row j - 1
+    cols, rows = np.triu_indices(num_dims, k=1)
+    dims = torch.tensor(possible_dims, device=device)
 
-            done_dims.append({dim_i, dim_j})
+    steps = torch.linspace(range_start, range_end, num_samples, device=device)
+    pair_size = num_samples * num_samples
+    pairs_per_chunk = max(1, batch_size // pair_size)
 
-            ax = fig.add_subplot(gs[j, i])
+    canvas: np.ndarray | None = None
+    for chunk_start in range(0, cols.shape[0], pairs_per_chunk):
+        chunk_cols = cols[chunk_start : chunk_start + pairs_per_chunk]
+        chunk_rows = rows[chunk_start : chunk_start + pairs_per_chunk]
+        dims_i = nn.functional.one_hot(dims[chunk_cols], z_size).to(steps.dtype)
+        dims_j = nn.functional.one_hot(dims[chunk_rows], z_size).to(steps.dtype)
+        # (pairs, num_samples, num_samples, z_size)
+        z = (
+            steps[None, :, None, None] * dims_i[:, None, None, :]
+            + steps[None, None, :, None] * dims_j[:, None, None, :]
+        ).reshape(-1, z_size)
 
-            z = (
-                torch.zeros(z_size)
-                .unsqueeze(0)
-                .unsqueeze(0)
-                .expand(num_samples, num_samples, -1)
-                .to(device)
+        with torch.no_grad():
+            decoded = _cat_samples(
+                [
+                    vae.decoder(z[start : start + batch_size])
+                    for start in range(0, z.size(0), batch_size)
+                ]
             )
 
-            for p in range(num_samples):
-                step = range_start + (range_end - range_start) * float(p) / float(
-                    num_samples - 1
-                )
-                z[p, :, dim_i] = step
-            for q in range(num_samples):
-                step = range_start + (range_end - range_start) * float(q) / float(
-                    num_samples - 1
-                )
-                z[:, q, dim_j] = step
-
-            decoded_x = vae.decoder(z.reshape(-1, z_size))
-
-            img_grid = ax_from_tensors(decoded_x, image_size, num_samples)
-
-            ax.imshow(img_grid)
-            ax.set_xlabel(f"dim {dim_j}")
-            ax.set_ylabel(f"dim {dim_i}")
-            ax.set_xticks(image_size * np.arange(num_samples) + image_size // 2)
-            ax.set_xticklabels(
-                list(
-                    map(
-                        lambda x: f"{x:.1f}",
-                        np.linspace(range_start, range_end, num_samples),
-                    )
-                )
+        for k, (col, row) in enumerate(
+            zip(chunk_cols.tolist(), chunk_rows.tolist(), strict=True)
+        ):
+            pair_samples = _slice_samples(decoded, k * pair_size, (k + 1) * pair_size)
+            grid = np.asarray(
+                ax_from_tensors(pair_samples, image_size, num_samples).convert("RGB")
             )
-            ax.set_yticks(image_size * np.arange(num_samples) + image_size // 2)
-            ax.set_yticklabels(
-                list(
-                    map(
-                        lambda x: f"{x:.1f}",
-                        np.linspace(range_start, range_end, num_samples),
-                    )
+            height, width = grid.shape[:2]
+            if canvas is None:
+                canvas = np.full(
+                    ((num_dims - 1) * height, (num_dims - 1) * width, 3),
+                    255,
+                    dtype=np.uint8,
                 )
-            )
+            canvas[
+                (row - 1) * height : row * height, col * width : (col + 1) * width
+            ] = grid
+    assert canvas is not None, "plot_dims should contain at least 2 dims."
 
+    fig_size = (num_dims - 1) * fig_dim
+    fig = plt.figure(
+        constrained_layout=True,
+        figsize=(fig_size, fig_size),
+        dpi=canvas.shape[1] / fig_size,
+    )
+    ax = fig.add_subplot()
+    ax.imshow(canvas)
+    ax.set_xticks(width * np.arange(num_dims - 1) + width // 2)
+    ax.set_xticklabels([f"dim {dim}" for dim in possible_dims[:-1]])
+    ax.set_yticks(height * np.arange(num_dims - 1) + height // 2)
+    ax.set_yticklabels([f"dim {dim}" for dim in possible_dims[1:]])
     return fig
@@ -0,0 +1,430 @@
+import json
+import os
+import resource
+import threading
+import time
+from collections import defaultdict, deque
+from collections.abc import Callable, Iterable, Iterator, Mapping, Sequence
+from contextlib import ExitStack, contextmanager
+from functools import wraps
+from pathlib import Path
+from typing import Any
+
+import numpy as np
+import torch
+from lightning.pytorch import Callback, LightningModule, Trainer
+from lightning.pytorch.utilities.data import extract_batch_size
+
+from shimmer_ssd.config import Profiling
+
+
+class Timings:
+    def __init__(
+        self,
+        window: int | None = None,
+        clock: Callable[[], float] = time.perf_counter,
+    ):
+        """
+        Durations (in seconds) recorded by name. Nothing is recorded while
+        `enabled` is False (e.g. during the warmup steps).
+
+        While `trace` is True, each duration is also recorded as a Chrome trace
+        event (see `write_trace`).
+
+        Args:
+            window (`int | None`): number of durations kept for each name. All of
+                them are kept if None.
+            clock (`Callable[[], float]`): returns the current time in seconds
+        """
+        self.enabled = True
+        self.trace = False
+        self.clock = clock
+        self.durations: defaultdict[str, deque[float]] = defaultdict(
+            lambda: deque(maxlen=window)
+        )
+        self.events: list[dict[str, Any]] = []
+
+    def add(self, name: str, duration: float, start: float | None = None) -> None:
+        if not self.enabled:
+            return
+        self.durations[name].append(duration)
+        if self.trace and start is not None:
+            self.events.append(
+                {
+                    "name": name,
+                    "ph": "X",
+                    "ts": 1e6 * start,
+                    "dur": 1e6 * duration,
+                    "pid": os.getpid(),
+                    "tid": threading.get_native_id(),
+                }
+            )
+
+    @contextmanager
+    def timed(self, name: str) -> Iterator[None]:
+        start = self.clock()
+        try:
+            yield
+        finally:
+            self.add(name, self.clock() - start, start)
+
+    def total(self, name: str) -> float:
+        return sum(self.durations.get(name, []))
+
+    def count(self, name: str) -> int:
+        return len(self.durations.get(name, []))
+
+    def percentile(self, name: str, q: float) -> float:
+        """
+        The `q`-th percentile of the recorded durations of `name` (in seconds).
+        """
+        return float(np.percentile(self.durations[name], q))
+
+    def write_trace(self, path: str | Path) -> None:
+        """
+        Writes the trace events in the Chrome trace format, to open in
+        `chrome://tracing` or https://ui.perfetto.dev.
+        """
+        with open(path, "w") as f:
+            json.dump({"traceEvents": self.events, "displayTimeUnit": "ms"}, f)
+
+
+def loss_method_names(obj: Any) -> list[str]:
+    """
+    Names of the methods of `obj` ending with "_loss", like the methods of shimmer's
+    loss modules computing each loss component.
+    """
+    return [
+        name
+        for name in dir(type(obj))
+        if name.endswith("_loss") and callable(getattr(type(obj), name))
+    ]
+
+
+@contextmanager
+def timed_methods(
+    obj: Any, names: Iterable[str], timings: Timings, label: str | None = None
+) -> Iterator[None]:
+    """
+    Records the duration of each call of the given methods of `obj` in `timings`,
+    under the method name, or under `label` if given. The methods are only
+    replaced on this instance, until the end of the context.
+
+    Durations are wall times measured from the host: on GPU, they only include the
+    kernels that had to finish during the call.
+    """
+
+    def wrap(name: str, method: Callable[..., Any]) -> Callable[..., Any]:
+        @wraps(method)
+        def timed_method(*args: Any, **kwargs: Any) -> Any:
+            with timings.timed(label or name):
+                return method(*args, **kwargs)
+
+        return timed_method
+
+    names = list(names)
+    for name in names:
+        setattr(obj, name, wrap(name, getattr(obj, name)))
+    try:
+        yield
+    finally:
+        for name in names:
+            delattr(obj, name)
+
+
+class StepTimingCallback(Callback):
+    def __init__(self, timings: Timings, warmup_steps: int = 0):
+        """
+        Records in `timings` the duration of each training step ("step", from
+        `on_train_batch_start` to `on_train_batch_end`) and the time spent waiting
+        for the next batch ("dataloader", from the end of the previous step, which
+        includes the transfer to the device).
+
+        `timings` is disabled during the first `warmup_steps` steps.
+
+        Args:
+            timings (`Timings`): where the durations are recorded
+            warmup_steps (`int`): number of steps that are not recorded
+        """
+        self.timings = timings
+        self.warmup_steps = warmup_steps
+        self._step_start: float | None = None
+        self._step_end: float | None = None
+
+    def on_train_batch_start(
+        self, trainer: Trainer, pl_module: LightningModule, batch: Any, batch_idx: int
+    ) -> None:
+        self.timings.enabled = trainer.global_step >= self.warmup_steps
+        self._step_start = time.perf_counter()
+        if self._step_end is not None:
+            self.timings.add("dataloader", self._step_start - self._step_end)
+
+    def on_train_batch_end(
+        self,
+        trainer: Trainer,
+        pl_module: LightningModule,
+        outputs: Any,
+        batch: Any,
+        batch_idx: int,
+    ) -> None:
+        self._step_end = time.perf_counter()
+        if self._step_start is not None:
+            self.timings.add("step", self._step_end - self._step_start)
+
+
+class ProfilingCallback(Callback):
+    def __init__(
+        self,
+        config: Profiling,
+        media_callbacks: Sequence[Callback] = (),
+    ):
+        """
+        Records the wall time of each stage of the training steps:
+        * "dataloader": waiting for the next batch, from the end of the previous step
+            to the transfer of the batch,
+        * "transfer": `transfer_batch_to_device`,
+        * "forward": `training_step`, which includes each loss term, recorded under
+            the name of the `*_loss` methods of the module and of its `loss_mod`
+            (for the Global Workspaces),
+        * "backward",
+        * "optimizer": the optimizer step, until the end of the step,
+        * "step": the whole step, without the dataloader and the transfer,
+        * "media_logging": `on_callback` of `media_callbacks`, which happens out
+            of the steps.
+
+        The percentiles of each stage over the last `config.window` recordings are
+        logged every `config.log_every_n_steps` steps as
+        "profiling/{stage}_p{percentile}_ms", and the first `config.trace_steps`
+        steps are written in `config.trace_path` (by default
+        `profiling_trace.json` in the `default_root_dir` of the trainer) as a Chrome
+        trace at the end of the fit.
+
+        Args:
+            config (`Profiling`): the profiling config
+            media_callbacks (`Sequence[Callback]`): the media logging callbacks
+        """
+        self.config = config
+        self.media_callbacks = media_callbacks
+        self.timings = Timings(config.window)
+        self._patches = ExitStack()
+        self._batch_end: float | None = None
+        self._transfer_start: float | None = None
+        self._step_start: float | None = None
+        self._backward_start: float | None = None
+        self._optimizer_start: float | None = None
+
+    def _clock(self, device: torch.device) -> Callable[[], float]:
+        if not (self.config.cuda_synchronize and device.type == "cuda"):
+            return time.perf_counter
+
+        def clock() -> float:
+            torch.cuda.synchronize(device)
+            return time.perf_counter()
+
+        return clock
+
+    def _add_since(self, name: str, start: float | None) -> float:
+        end = self.timings.clock()
+        if start is not None:
+            self.timings.add(name, end - start, start)
+        return end
+
+    def setup(self, trainer: Trainer, pl_module: LightningModule, stage: str) -> None:
+        if stage != "fit":
+            return
+        self.timings.clock = self._clock(pl_module.device)
+
+        transfer_batch_to_device = pl_module.transfer_batch_to_device
+
+        @wraps(transfer_batch_to_device)
+        def timed_transfer(*args: Any, **kwargs: Any) -> Any:
+            if not trainer.training:
+                return transfer_batch_to_device(*args, **kwargs)
+            self._transfer_start = self.timings.clock()
+            with self.timings.timed("transfer"):
+                return transfer_batch_to_device(*args, **kwargs)
+
+        pl_module.transfer_batch_to_device = timed_transfer  # type: ignore
+        self._patches.callback(delattr, pl_module, "transfer_batch_to_device")
+        self._patches.enter_context(
+            timed_methods(pl_module, ["training_step"], self.timings, "forward")
+        )
+        loss_modules = [pl_module]
+        if isinstance(getattr(pl_module, "loss_mod", None), torch.nn.Module):
+            loss_modules.append(pl_module.loss_mod)  # type: ignore
+        for module in loss_modules:
+            self._patches.enter_context(
+                timed_methods(module, loss_method_names(module), self.timings)
+            )
+        for callback in self.media_callbacks:
+            self._patches.enter_context(
+                timed_methods(callback, ["on_callback"], self.timings, "media_logging")
+            )
+
+    def teardown(
+        self, trainer: Trainer, pl_module: LightningModule, stage: str
+    ) -> None:
+        if stage != "fit":
+            return
+        self._patches.close()
+        if self.config.trace_steps and trainer.is_global_zero:
+            trace_path = self.config.trace_path
+            if trace_path is None:
+                trace_path = Path(trainer.default_root_dir) / "profiling_trace.json"
+            trace_path.parent.mkdir(parents=True, exist_ok=True)
+            self.timings.write_trace(trace_path)
+
+    def on_train_batch_start(
+        self, trainer: Trainer, pl_module: LightningModule, batch: Any, batch_idx: int
+    ) -> None:
+        self.timings.trace = trainer.global_step < self.config.trace_steps
+        self._step_start = self.timings.clock()
+        if self._batch_end is not None:
+            fetched = self._transfer_start or self._step_start
+            self.timings.add("dataloader", fetched - self._batch_end, self._batch_end)
+        self._transfer_start = None
+
+    def on_before_backward(
+        self, trainer: Trainer, pl_module: LightningModule, loss: torch.Tensor
+    ) -> None:
+        self._backward_start = self.timings.clock()
+
+    def on_after_backward(self, trainer: Trainer, pl_module: LightningModule) -> None:
+        self._add_since("backward", self._backward_start)
+        self._backward_start = None
+
+    def on_before_optimizer_step(
+        self,
+        trainer: Trainer,
+        pl_module: LightningModule,
+        optimizer: torch.optim.Optimizer,
+    ) -> None:
+        self._optimizer_start = self.timings.clock()
+
+    def on_train_batch_end(
+        self,
+        trainer: Trainer,
+        pl_module: LightningModule,
+        outputs: Any,
+        batch: Any,
+        batch_idx: int,
+    ) -> None:
+        self._add_since("optimizer", self._optimizer_start)
+        self._batch_end = self._add_since("step", self._step_start)
+        self._optimizer_start = None
+        self._step_start = None
+
+        if trainer.global_step % self.config.log_every_n_steps:
+            return
+        pl_module.log_dict(
+            {
+                f"profiling/{name}_p{q:g}_ms": 1000 * self.timings.percentile(name, q)
+                for name, durations in self.timings.durations.items()
+                if len(durations)
+                for q in self.config.percentiles
+            },
+            on_step=True,
+            on_epoch=False,
+        )
+
+    def on_train_epoch_end(self, trainer: Trainer, pl_module: LightningModule) -> None:
+        # the media logging and the validation between two steps are not
+        # counted as waiting for the dataloader
+        self._batch_end = None
+
+    def on_validation_start(self, trainer: Trainer, pl_module: LightningModule) -> None:
+        self._batch_end = None
+
+
+def batch_num_samples(batch: Any) -> int:
+    """
+    Number of samples of a batch. The batches of the domain groups (with frozenset
+    keys, as given by `SimpleShapesDataModule`) are added together.
+    """
+    if isinstance(batch, Mapping) and all(isinstance(k, frozenset) for k in batch):
+        return sum(extract_batch_size(group) for group in batch.values())
+    return extract_batch_size(batch)
+
+
+def peak_memory_mb(device: torch.device) -> float:
+    """
+    Peak memory in MB: the memory allocated by torch on CUDA devices, since the
+    last call, and otherwise the peak resident set size of the process.
+    """
+    if device.type == "cuda":
+        peak = torch.cuda.max_memory_allocated(device)
+        torch.cuda.reset_peak_memory_stats(device)
+        return peak / 2**20
+    # ru_maxrss is in KB on linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+class ThroughputCallback(Callback):
+    def __init__(self, log_every_n_steps: int):
+        """
+        Logs every `log_every_n_steps` steps, averaged over these steps:
+        * "throughput/samples_per_s",
+        * "throughput/dataloader_wait_ms": time waiting for each batch, from the end
+            of the previous step (this includes the transfer to the device),
+        * "throughput/utilization": fraction of the time spent in the steps rather
+            than waiting for the batches, a proxy of the device utilization,
+        * "throughput/peak_memory_mb": see `peak_memory_mb`.
+
+        Args:
+            log_every_n_steps (`int`): number of steps between two logs
+        """
+        self.log_every_n_steps = log_every_n_steps
+        self._batch_end: float | None = None
+        self._step_start = 0.0
+        self._reset()
+
+    def _reset(self) -> None:
+        self._num_steps = 0
+        self._num_samples = 0
+        self._step_time = 0.0
+        self._wait_time = 0.0
+
+    def on_train_batch_start(
+        self, trainer: Trainer, pl_module: LightningModule, batch: Any, batch_idx: int
+    ) -> None:
+        self._step_start = time.perf_counter()
+        if self._batch_end is not None:
+            self._wait_time += self._step_start - self._batch_end
+
+    def on_train_batch_end(
+        self,
+        trainer: Trainer,
+        pl_module: LightningModule,
+        outputs: Any,
+        batch: Any,
+        batch_idx: int,
+    ) -> None:
+        self._batch_end = time.perf_counter()
+        self._step_time += self._batch_end - self._step_start
+        self._num_steps += 1
+        self._num_samples += batch_num_samples(batch)
+
+        if trainer.global_step % self.log_every_n_steps:
+            return
+        total_time = self._step_time + self._wait_time
+        pl_module.log_dict(
+            {
+                "throughput/samples_per_s": self._num_samples / total_time,
+                "throughput/dataloader_wait_ms": 1000
+                * self._wait_time
+                / self._num_steps,
+                "throughput/utilization": self._step_time / total_time,
+                "throughput/peak_memory_mb": peak_memory_mb(pl_module.device),
+            },
+            on_step=True,
+            on_epoch=False,
+        )
+        self._reset()
+
+    def on_train_epoch_end(self, trainer: Trainer, pl_module: LightningModule) -> None:
+        # the media logging and the validation between two steps are not
+        # counted as waiting for the dataloader
+        self._batch_end = None
+
+    def on_validation_start(self, trainer: Trainer, pl_module: LightningModule) -> None:
+        self._batch_end = None
@@ -0,0 +1,56 @@
+import os
+
+import torch
+from lightning.pytorch import Trainer
+
+from shimmer_ssd.ckpt_migrations import (
+    fingerprint_path,
+    is_migrated,
+    load_checkpoint,
+    migrate_model,
+    module_from_checkpoint,
+)
+from shimmer_ssd.modules.domains.attribute import AttributeDomainModule
+
+
+def test_migration_fingerprint(tmp_path):
+    migration_path = tmp_path / "migrations"
+    migration_path.mkdir()
+    ckpt_path = tmp_path / "model.ckpt"
+    torch.save({"state_dict": {"weight": torch.randn(3, 3)}}, ckpt_path)
+
+    assert not is_migrated(ckpt_path, migration_path)
+    migrate_model(ckpt_path, migration_path)
+    assert fingerprint_path(ckpt_path).exists()
+    assert is_migrated(ckpt_path, migration_path)
+
+    # already migrated checkpoints are not saved again
+    mtime = ckpt_path.stat().st_mtime_ns
+    migrate_model(ckpt_path, migration_path)
+    assert ckpt_path.stat().st_mtime_ns == mtime
+
+    # same content with another modification time
+    os.utime(ckpt_path, ns=(mtime + 10**9, mtime + 10**9))
+    assert is_migrated(ckpt_path, migration_path)
+
+    torch.save({"state_dict": {"weight": torch.randn(3, 3)}}, ckpt_path)
+    assert not is_migrated(ckpt_path, migration_path)
+
+
+def test_module_from_checkpoint(tmp_path):
+    module = AttributeDomainModule(latent_dim=8, hidden_dim=16)
+    trainer = Trainer(logger=False, enable_checkpointing=False)
+    trainer.strategy.connect(module)
+    trainer.save_checkpoint(tmp_path / "attr.ckpt")
+
+    expected = AttributeDomainModule.load_from_checkpoint(
+        tmp_path / "attr.ckpt", map_location="cpu"
+    )
+    loaded = module_from_checkpoint(
+        AttributeDomainModule, load_checkpoint(tmp_path / "attr.ckpt"), beta=0.5
+    )
+    assert loaded.hparams["beta"] == 0.5
+    expected_state = expected.state_dict()
+    assert expected_state.keys() == loaded.state_dict().keys()
+    for key, val in loaded.state_dict().items():
+        assert torch.equal(val, expected_state[key])
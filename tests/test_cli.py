@@ -0,0 +1,59 @@
+import subprocess
+import sys
+
+from click.testing import CliRunner
+from utils import PROJECT_DIR
+
+from shimmer_ssd.cli.cli import cli
+
+HEAVY_MODULES = [
+    "lightning",
+    "matplotlib",
+    "shimmer",
+    "simple_shapes_dataset",
+    "tokenizers",
+    "torch",
+    "torchvision",
+    "wandb",
+]
+
+
+def help_imported_modules() -> set[str]:
+    """
+    Runs `ssd --help` in a new interpreter and returns the top-level packages
+    imported.
+    """
+    result = subprocess.run(
+        [
+            sys.executable,
+            "-c",
+            "import sys\n"
+            "from shimmer_ssd.cli.cli import cli\n"
+            "cli(['--help'], standalone_mode=False)\n"
+            "print(' '.join(sys.modules))",
+        ],
+        cwd=PROJECT_DIR,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    modules = result.stdout.splitlines()[-1].split()
+    return {name.split(".")[0] for name in modules}
+
+
+def test_help_does_not_import_heavy_modules():
+    imported = help_imported_modules()
+    assert "shimmer_ssd" in imported
+    for name in HEAVY_MODULES:
+        assert name not in imported, f"{name} was imported"
+
+
+def test_lazy_subcommands_help():
+    runner = CliRunner()
+    result = runner.invoke(cli, ["train", "--help"])
+    assert result.exit_code == 0
+    for name in ["v", "attr", "t", "gw"]:
+        assert f"  {name} " in result.output
+    result = runner.invoke(cli, ["extract", "--help"])
+    assert result.exit_code == 0
+    assert "tokens" in result.output
@@ -0,0 +1,45 @@
+import pytest
+import torch
+
+from shimmer_ssd.config import Compile
+from shimmer_ssd.modules.compile import compile_modules, compile_step
+from shimmer_ssd.modules.domains.attribute import AttributeDomainModule
+from shimmer_ssd.modules.domains.base import StepLossesDomainModule
+
+# traces the graphs without generating code, fullgraph fails on graph breaks
+CONFIG = Compile(enabled=True, backend="eager", fullgraph=True)
+
+
+def test_compile_step():
+    module = AttributeDomainModule(latent_dim=4, hidden_dim=16)
+    categories = torch.nn.functional.one_hot(torch.randint(3, (8,)), 3).float()
+    x = [categories, torch.rand(8, 8) * 2 - 1]
+
+    torch.manual_seed(0)
+    expected = module.step_losses(x)
+    compile_step(module, CONFIG)
+    torch.manual_seed(0)
+    losses = module.step_losses(x)
+
+    assert losses.keys() == expected.keys()
+    for name, loss in losses.items():
+        assert torch.allclose(loss, expected[name]), name
+    assert "step_losses" not in module.state_dict()
+
+
+def test_compile_modules():
+    module = torch.nn.Sequential(torch.nn.Linear(4, 4), torch.nn.ReLU())
+    x = torch.randn(3, 4)
+    expected = module(x)
+    compile_modules([module], CONFIG)
+
+    assert torch.allclose(module(x), expected)
+    assert list(module.state_dict()) == ["0.weight", "0.bias"]
+
+
+def test_step_losses_is_abstract():
+    class NoStepLosses(StepLossesDomainModule[torch.Tensor]):
+        pass
+
+    with pytest.raises(TypeError, match="step_losses"):
+        NoStepLosses(8)
@@ -0,0 +1,253 @@
+import pytest
+import torch
+from lightning.pytorch import LightningModule, Trainer
+from shimmer import ContrastiveLoss as CLIPContrastiveLoss
+from torch.nn.functional import normalize
+from utils import PROJECT_DIR
+
+from shimmer_ssd.cli.train_gw import get_contrastive_fn
+from shimmer_ssd.config import Config
+from shimmer_ssd.modules.contrastive_loss import (
+    ContrastiveLoss,
+    ContrastiveLossStepCallback,
+    NegativesQueue,
+    VSEPPContrastiveLoss,
+    order_sim,
+)
+
+
+def expanded_order_sim(im: torch.Tensor, s: torch.Tensor) -> torch.Tensor:
+    """Previous implementation, allocating the (N_s, N_im, D) differences."""
+    YmX = s.unsqueeze(1).expand(s.size(0), im.size(0), s.size(1)) - im.unsqueeze(
+        0
+    ).expand(s.size(0), im.size(0), s.size(1))
+    return -YmX.clamp(min=0).pow(2).sum(2).sqrt().t()
+
+
+def test_order_sim():
+    torch.manual_seed(0)
+    im = torch.randn(37, 8, dtype=torch.double, requires_grad=True)
+    s = torch.randn(29, 8, dtype=torch.double, requires_grad=True)
+    grad_scores = torch.randn(37, 29, dtype=torch.double)
+
+    expected = expanded_order_sim(im, s)
+    expected_grads = torch.autograd.grad(expected, [im, s], grad_scores)
+    scores = order_sim(im, s, tile_size=5)
+    grads = torch.autograd.grad(scores, [im, s], grad_scores)
+
+    assert torch.allclose(scores, expected)
+    for grad, expected_grad in zip(grads, expected_grads, strict=True):
+        assert torch.allclose(grad, expected_grad)
+
+
+def test_order_sim_zero_norm():
+    # s <= im everywhere: the scores are 0 and so are the gradients
+    im = torch.ones(4, 3, requires_grad=True)
+    s = torch.zeros(4, 3, requires_grad=True)
+    scores = order_sim(im, s, tile_size=3)
+    scores.sum().backward()
+
+    assert (scores == 0).all()
+    assert im.grad is not None and (im.grad == 0).all()
+    assert s.grad is not None and (s.grad == 0).all()
+
+
+def unfused_hinge_loss(
+    scores: torch.Tensor, margin: float, max_violation: bool
+) -> torch.Tensor:
+    """Previous implementation, with the two N x N cost matrices."""
+    diagonal = scores.diag().view(scores.size(0), 1)
+    cost_s = (margin + scores - diagonal.expand_as(scores)).clamp(min=0)
+    cost_im = (margin + scores - diagonal.t().expand_as(scores)).clamp(min=0)
+    mask = torch.eye(scores.size(0)) > 0.5
+    cost_s = cost_s.masked_fill_(mask, 0)
+    cost_im = cost_im.masked_fill_(mask, 0)
+    if max_violation:
+        cost_s = cost_s.max(1)[0]
+        cost_im = cost_im.max(0)[0]
+    return cost_s.sum() + cost_im.sum()
+
+
+@pytest.mark.parametrize("max_violation", [True, False])
+@pytest.mark.parametrize("margin", [0.2, 5.0])
+def test_hinge_loss(max_violation: bool, margin: float):
+    torch.manual_seed(0)
+    scores = torch.randn(50, 50, dtype=torch.double, requires_grad=True)
+    loss_fn = ContrastiveLoss(margin, "cosine", max_violation)
+
+    expected = unfused_hinge_loss(scores, margin, max_violation)
+    (expected_grad,) = torch.autograd.grad(expected, [scores])
+    loss = loss_fn.hinge_loss(scores)
+    (grad,) = torch.autograd.grad(loss, [scores])
+
+    assert torch.allclose(loss, expected)
+    assert torch.allclose(grad, expected_grad)
+    assert len(loss_fn._diag_masks) == 1
+
+
+@pytest.mark.parametrize("measure", ["cosine", "order"])
+def test_vsepp_contrastive_loss(measure):
+    torch.manual_seed(0)
+    x, y = torch.randn(16, 8), torch.randn(16, 8)
+    logit_scale = torch.tensor([1 / 0.07]).log()
+    loss_fn = VSEPPContrastiveLoss(
+        0.2, measure, True, logit_scale, clip_metric_every_n_steps=2
+    )
+
+    expected = ContrastiveLoss(0.2, measure, True)(x, y)
+    expected_clip = CLIPContrastiveLoss(logit_scale)(x, y).loss
+    # called for two domain pairs at each step
+    outputs = []
+    for step in range(3):
+        loss_fn.start_step(step)
+        outputs.extend([loss_fn(x, y), loss_fn(x, y)])
+
+    for output in outputs:
+        assert torch.allclose(output.loss, expected)
+    assert [("clip" in output.metrics) for output in outputs] == [
+        True,
+        True,
+        False,
+        False,
+        True,
+        True,
+    ]
+    assert torch.allclose(outputs[0].metrics["clip"], expected_clip)
+
+    loss_fn.eval()
+    assert "clip" in loss_fn(x, y).metrics
+
+
+@pytest.mark.parametrize("max_violation", [True, False])
+def test_hinge_loss_with_queue(max_violation: bool):
+    torch.manual_seed(0)
+    scores = torch.randn(10, 10, dtype=torch.double)
+    queue_s = torch.randn(10, 6, dtype=torch.double)
+    queue_im = torch.randn(6, 10, dtype=torch.double)
+    loss_fn = ContrastiveLoss(0.2, "cosine", max_violation)
+
+    # the queued negatives are extra columns (resp. rows) with no positive pair
+    diagonal = scores.diagonal()
+    cost_s = (0.2 + torch.cat([scores, queue_s], 1) - diagonal[:, None]).clamp(min=0)
+    cost_im = (0.2 + torch.cat([scores, queue_im], 0) - diagonal[None]).clamp(min=0)
+    cost_s[:, :10].fill_diagonal_(0)
+    cost_im[:10].fill_diagonal_(0)
+    if max_violation:
+        expected = cost_s.max(1)[0].sum() + cost_im.max(0)[0].sum()
+    else:
+        expected = cost_s.sum() + cost_im.sum()
+
+    assert torch.allclose(loss_fn.hinge_loss(scores, queue_s, queue_im), expected)
+
+
+def test_negatives_queue():
+    queue = NegativesQueue(5)
+    assert queue.negatives() is None
+    queue.push(torch.zeros(3, 2), torch.zeros(3, 2))
+    queue.push(torch.arange(4.0)[:, None].expand(4, 2), torch.ones(4, 2))
+    negatives = queue.negatives()
+    assert negatives is not None
+    queue_x, queue_y = negatives
+    assert queue_x.shape == (5, 2)
+    # the two oldest representations were replaced
+    assert queue_x[:, 0].tolist() == [2.0, 3.0, 0.0, 0.0, 1.0]
+    assert queue_y.sum() == 8
+    assert "x" not in queue.state_dict()
+
+
+def test_vsepp_contrastive_loss_queues():
+    torch.manual_seed(0)
+    loss_fn = VSEPPContrastiveLoss(
+        0.2,
+        "cosine",
+        True,
+        torch.tensor([1 / 0.07]).log(),
+        queue_size=8,
+        num_queues=2,
+    )
+    x, y = torch.randn(4, 8), torch.randn(4, 8)
+    first = loss_fn(x, y).loss
+    loss_fn(x, y)
+    # the first queue now has negatives
+    assert loss_fn(x, y).loss >= first
+    queues = [queue.num_filled for queue in loss_fn.queues]  # type: ignore
+    assert queues == [8, 4]
+
+    loss_fn.eval()
+    assert torch.allclose(loss_fn(x, y).loss, first)
+    assert [queue.num_filled for queue in loss_fn.queues] == queues  # type: ignore
+
+
+def test_vsepp_contrastive_loss_queues_per_step():
+    config = Config(
+        dataset={"path": PROJECT_DIR / "sample_dataset"},
+        domain_proportions=[
+            {"domains": ["v", "t"], "proportion": 1.0},
+            {"domains": ["v", "t", "attr"], "proportion": 1.0},
+        ],
+        global_workspace={"vsepp_contrastive_loss": True, "vsepp_queue_size": 8},
+    )
+    loss_fn = get_contrastive_fn(config)
+    assert isinstance(loss_fn, VSEPPContrastiveLoss)
+    # the contrastive loss is only called for the groups of two domains
+    assert len(loss_fn.queues) == 1
+
+    torch.manual_seed(0)
+    loss_fn = VSEPPContrastiveLoss(
+        0.2,
+        "cosine",
+        True,
+        torch.tensor([1 / 0.07]).log(),
+        queue_size=8,
+        num_queues=2,
+    )
+    pl_module = LightningModule()
+    pl_module.loss_fn = loss_fn
+    callback = ContrastiveLossStepCallback()
+    x, y = torch.randn(4, 8), torch.randn(4, 8)
+    # the first pair of each step uses the first queue, even if a step calls the
+    # loss for fewer pairs
+    trainer = Trainer(logger=False)
+    for _ in range(2):
+        callback.on_train_batch_start(trainer, pl_module, None, 0)
+        loss_fn(x, y)
+    assert [queue.num_filled for queue in loss_fn.queues] == [8, 0]  # type: ignore
+
+
+@pytest.mark.parametrize("measure", ["cosine", "order"])
+def test_micro_batched_hinge_loss(measure):
+    torch.manual_seed(0)
+    x = torch.randn(23, 8, dtype=torch.double, requires_grad=True)
+    y = torch.randn(23, 8, dtype=torch.double, requires_grad=True)
+    queue_x = torch.randn(5, 8, dtype=torch.double)
+    queue_y = torch.randn(7, 8, dtype=torch.double)
+    loss_fn = ContrastiveLoss(0.2, measure, True)
+    micro_loss_fn = ContrastiveLoss(0.2, measure, True, micro_batch_size=4)
+
+    expected = loss_fn(x, y)
+    expected_grads = torch.autograd.grad(expected, [x, y])
+    loss = micro_loss_fn(x, y)
+    grads = torch.autograd.grad(loss, [x, y])
+    assert torch.allclose(loss, expected)
+    for grad, expected_grad in zip(grads, expected_grads, strict=True):
+        assert torch.allclose(grad, expected_grad)
+
+    x_n, y_n = normalize(x), normalize(y)
+    expected = loss_fn.hinge_loss(
+        loss_fn.sim(x_n, y_n), loss_fn.sim(x_n, queue_y), loss_fn.sim(queue_x, y_n)
+    )
+    loss = micro_loss_fn.micro_batched_hinge_loss(x_n, y_n, queue_x, queue_y)
+    assert torch.allclose(loss, expected)
+
+
+def test_micro_batched_clip_metric():
+    torch.manual_seed(0)
+    x, y = torch.randn(19, 8), torch.randn(19, 8)
+    logit_scale = torch.tensor([1 / 0.07]).log()
+    expected = VSEPPContrastiveLoss(0.2, "cosine", True, logit_scale)(x, y)
+    output = VSEPPContrastiveLoss(0.2, "cosine", True, logit_scale, micro_batch_size=5)(
+        x, y
+    )
+
+    assert torch.allclose(output.loss, expected.loss)
+    assert torch.allclose(output.metrics["clip"], expected.metrics["clip"])
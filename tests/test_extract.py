@@ -0,0 +1,73 @@
+import numpy as np
+import pytest
+import torch
+from torch.utils.data import DataLoader, TensorDataset
+
+from shimmer_ssd.cli.extract import is_extracted, progress_path, stream_latents
+
+
+def test_stream_latents_resume(tmp_path):
+    data = torch.randn(50, 4)
+    dataloader = DataLoader(TensorDataset(data), batch_size=8)
+    path = tmp_path / "latents.npy"
+
+    n_calls = 0
+
+    def interrupted_encode(batch: list[torch.Tensor]) -> torch.Tensor:
+        nonlocal n_calls
+        n_calls += 1
+        if n_calls > 3:
+            raise KeyboardInterrupt
+        return batch[0] * 2
+
+    with pytest.raises(KeyboardInterrupt):
+        stream_latents(path, dataloader, interrupted_encode)
+    assert progress_path(path).exists()
+    assert not is_extracted(path)
+
+    encoded: list[torch.Tensor] = []
+
+    def encode(batch: list[torch.Tensor]) -> torch.Tensor:
+        encoded.append(batch[0])
+        return batch[0] * 2
+
+    stream_latents(path, dataloader, encode)
+    assert is_extracted(path)
+    # only the remaining samples are encoded
+    assert sum(batch.size(0) for batch in encoded) == 50 - 3 * 8
+
+    assert np.allclose(np.load(path), data.numpy() * 2)
+
+
+def test_stream_latents_interrupted_creation(tmp_path, monkeypatch):
+    data = torch.randn(20, 4)
+    dataloader = DataLoader(TensorDataset(data), batch_size=8)
+    path = tmp_path / "latents.npy"
+    np.save(path, np.zeros((20, 4), dtype=np.float32))
+
+    def interrupted_open_memmap(*args, **kwargs):
+        raise KeyboardInterrupt
+
+    with monkeypatch.context() as patch:
+        patch.setattr(np.lib.format, "open_memmap", interrupted_open_memmap)
+        with pytest.raises(KeyboardInterrupt):
+            stream_latents(path, dataloader, lambda batch: batch[0] * 2, force=True)
+    assert not is_extracted(path)
+
+    stream_latents(path, dataloader, lambda batch: batch[0] * 2)
+    assert is_extracted(path)
+    assert np.allclose(np.load(path), data.numpy() * 2)
+
+
+def test_stream_latents_shards(tmp_path):
+    data = torch.randn(50, 4)
+    dataloader = DataLoader(TensorDataset(data), batch_size=8)
+    path = tmp_path / "latents.npy"
+
+    for shard in range(3):
+        assert not path.exists()
+        stream_latents(path, dataloader, lambda batch: batch[0] * 2, shard=(shard, 3))
+
+    assert is_extracted(path)
+    assert sorted(tmp_path.iterdir()) == [path]
+    assert np.allclose(np.load(path), data.numpy() * 2)
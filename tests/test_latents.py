@@ -0,0 +1,67 @@
+import numpy as np
+import pytest
+import torch
+
+from shimmer_ssd.dataset.latents import (
+    LatentDomainType,
+    LatentStorage,
+    PresavedLatentsDomain,
+    convert_latents,
+    get_domain_classes,
+    is_converted,
+)
+
+
+def test_presaved_latents_domain(tmp_path):
+    latents = np.random.randn(10, 12).astype(np.float32)
+    (tmp_path / "saved_latents/val").mkdir(parents=True)
+    np.save(tmp_path / "saved_latents/val/attr.npy", latents)
+
+    dataset = PresavedLatentsDomain(
+        tmp_path, "val", additional_args={"presaved_path": "attr.npy"}
+    )
+    assert len(dataset) == 10
+    assert torch.equal(dataset[3], torch.from_numpy(latents[3]))
+
+
+def test_get_domain_classes(tmp_path):
+    domain_classes = get_domain_classes([LatentDomainType.t_latents.value])
+    assert domain_classes == {LatentDomainType.t_latents.value: PresavedLatentsDomain}
+
+    (tmp_path / "saved_latents/train").mkdir(parents=True)
+    path = tmp_path / "saved_latents/train/v.npy"
+    np.save(path, np.random.randn(10, 12).astype(np.float32))
+    domain_args = {"v_latents": {"presaved_path": "v.npy"}}
+    # float32 v_latents are loaded by simple_shapes_dataset
+    assert not is_converted(path)
+    domain_classes = get_domain_classes(["v_latents"], tmp_path, domain_args)
+    assert domain_classes.get("v_latents") is not PresavedLatentsDomain
+
+    convert_latents(path, "float16")
+    assert is_converted(path)
+    domain_classes = get_domain_classes(["v_latents"], tmp_path, domain_args)
+    assert domain_classes == {"v_latents": PresavedLatentsDomain}
+
+
+@pytest.mark.parametrize(
+    ("storage", "tolerance"),
+    [("float16", 1e-2), ("bfloat16", 5e-2), ("int8", 5e-2)],
+)
+def test_convert_latents(tmp_path, storage: LatentStorage, tolerance: float):
+    latents = np.random.randn(100, 12).astype(np.float32)
+    latents[:, 0] = 1  # constant dimension
+    (tmp_path / "saved_latents/train").mkdir(parents=True)
+    path = tmp_path / "saved_latents/train/v.npy"
+    np.save(path, latents)
+
+    metadata = convert_latents(path, storage, chunk_size=32)
+    assert metadata["relative_error"] < tolerance
+
+    dataset = PresavedLatentsDomain(
+        tmp_path, "train", additional_args={"presaved_path": "v.npy"}
+    )
+    dequantized = torch.stack([dataset[k] for k in range(len(dataset))])
+    assert dequantized.dtype == torch.float32
+    assert torch.allclose(
+        dequantized, torch.from_numpy(latents), atol=metadata["max_abs_error"] + 1e-6
+    )
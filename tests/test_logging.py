@@ -1,10 +1,22 @@
+import itertools
+
+import numpy as np
+import torch
 from lightning.pytorch.loggers.wandb import WandbLogger
 from shimmer import DomainModule, GWDecoder, GWEncoder
 from shimmer.modules.global_workspace import GlobalWorkspace2Domains
 from simple_shapes_dataset import SimpleShapesDataModule, get_default_domains
 from utils import PROJECT_DIR
 
-from shimmer_ssd.logging import LogGWImagesCallback, attribute_image_grid
+from shimmer_ssd.logging import (
+    AsyncMediaLogger,
+    LogGWImagesCallback,
+    attribute_image_grid,
+    get_attribute_figure_grid,
+    get_pil_image,
+    shape_vertices,
+    split_samples,
+)
 from shimmer_ssd.modules.domains.attribute import AttributeDomainModule
 from shimmer_ssd.modules.domains.visual import VisualDomainModule
 
@@ -28,6 +40,243 @@ def test_attribute_figure_grid():
     assert images.width == 2 * image_size + 3 * padding
 
 
+def test_attribute_grid_rendering():
+    image_size = 32
+    colors = np.array([[255, 0, 0], [0, 255, 0], [0, 0, 255]])
+    image = get_attribute_figure_grid(
+        categories=np.array([0, 1, 2]),
+        locations=np.full((3, 2), image_size / 2),
+        sizes=np.full(3, 14.0),
+        rotations=np.array([0.0, 1.0, 2.0]),
+        colors=colors,
+        image_size=image_size,
+        ncols=2,
+    )
+    grid = np.asarray(image)
+    assert grid.shape == (2 * image_size + 6, 2 * image_size + 6, 3)
+    # white padding and black background
+    assert (grid[:2] == 255).all()
+    assert (grid[2, 2] == 0).all()
+    # the last cell of the grid has no sample
+    assert (grid[36 : 36 + image_size, 36 : 36 + image_size] == 255).all()
+    for k, color in enumerate(colors):
+        top, left = 2 + 34 * (k // 2), 2 + 34 * (k % 2)
+        center = grid[top + image_size // 2, left + image_size // 2]
+        assert (center == color).all()
+
+
+def matplotlib_attribute_grid(
+    categories: np.ndarray,
+    locations: np.ndarray,
+    sizes: np.ndarray,
+    rotations: np.ndarray,
+    colors: np.ndarray,
+    image_size: int,
+    ncols: int = 8,
+    padding: float = 2,
+):
+    """
+    The matplotlib rendering of the attribute grids, replaced by the OpenCV one.
+    The shapes are drawn like `simple_shapes_dataset.cli.generate_image`.
+    """
+    import matplotlib
+
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+    from matplotlib import gridspec, patches
+
+    reminder = 1 if categories.shape[0] % ncols else 0
+    nrows = categories.shape[0] // ncols + reminder
+
+    width = ncols * (image_size + padding) + padding
+    height = nrows * (image_size + padding) + padding
+    dpi = 1
+
+    figure = plt.figure(figsize=(width / dpi, height / dpi), dpi=dpi, facecolor="white")
+    gs = gridspec.GridSpec(
+        nrows,
+        ncols,
+        wspace=padding / image_size,
+        hspace=padding / image_size,
+        left=padding / width,
+        right=1 - padding / width,
+        bottom=padding / height,
+        top=1 - padding / height,
+    )
+    for k in range(categories.shape[0]):
+        ax = plt.subplot(gs[k // ncols, k % ncols])
+        vertices = shape_vertices(
+            int(categories[k]),
+            locations[k : k + 1],
+            sizes[k : k + 1],
+            rotations[k : k + 1],
+        )[0]
+        ax.add_patch(patches.Polygon(vertices, facecolor=colors[k] / 255))
+        ax.set_xticks([])
+        ax.set_yticks([])
+        ax.grid(False)
+        ax.set_xlim(0, image_size)
+        ax.set_ylim(0, image_size)
+        ax.set_facecolor("black")
+    image = get_pil_image(figure)
+    plt.close(figure)
+    return image.convert("RGB")
+
+
+def test_attribute_grid_matches_matplotlib():
+    image_size = 32
+    ncols = 8
+    attributes = list(
+        itertools.product(
+            [0, 1, 2],
+            [0.0, 0.7, 2.0, 4.0],
+            [[255, 0, 0], [0, 255, 0], [0, 0, 255], [200, 150, 40]],
+        )
+    )
+    num_samples = len(attributes)
+    categories = np.array([category for category, _, _ in attributes])
+    rotations = np.array([rotation for _, rotation, _ in attributes])
+    colors = np.array([color for _, _, color in attributes])
+    # off-center shapes of varying sizes to cover sub-pixel positions
+    locations = image_size / 2 + np.linspace(-3.3, 3.7, num_samples * 2).reshape(
+        num_samples, 2
+    )
+    sizes = np.linspace(10.0, 18.0, num_samples)
+
+    args = (categories, locations, sizes, rotations, colors, image_size, ncols)
+    expected = np.asarray(matplotlib_attribute_grid(*args)).astype(np.float64)
+    grid = np.asarray(get_attribute_figure_grid(*args)).astype(np.float64)
+    assert grid.shape == expected.shape
+
+    for k, (category, rotation, color) in enumerate(attributes):
+        top, left = 2 + 34 * (k // ncols), 2 + 34 * (k % ncols)
+        cells = [
+            image[top : top + image_size, left : left + image_size]
+            for image in (expected, grid)
+        ]
+        diff = np.abs(cells[0] - cells[1])
+        assert diff.mean() < 1, (category, rotation, color)
+        # only the anti-aliased edges differ
+        assert diff.max() <= 48, (category, rotation, color)
+        expected_mask, mask = (cell.sum(-1) > sum(color) / 2 for cell in cells)
+        iou = (expected_mask & mask).sum() / (expected_mask | mask).sum()
+        assert iou >= 0.9, (category, rotation, color)
+    # the padding and the empty cells
+    assert np.abs(expected - grid).max() <= 48
+
+
+def test_async_media_logger():
+    media_logger = AsyncMediaLogger(max_queue_size=2)
+    logged: list[int] = []
+
+    def failing_task():
+        raise RuntimeError
+
+    media_logger.submit(failing_task)
+    for k in range(10):
+        media_logger.submit(lambda k=k: logged.append(k))
+    media_logger.flush()
+    assert logged == list(range(10))
+
+    media_logger.close()
+    media_logger.submit(lambda: logged.append(10))
+    media_logger.close()
+    assert logged == list(range(11))
+
+
+def test_split_samples():
+    samples = {"tokens": torch.arange(6), "attr": [torch.zeros(6, 2), torch.ones(6)]}
+    first, second = split_samples(samples, [4, 2])
+    assert torch.equal(first["tokens"], torch.arange(4))
+    assert second["attr"][0].shape == (2, 2)
+    assert second["attr"][1].shape == (2,)
+
+
+class DecodeCounter:
+    """Global workspace stub counting the decoded batches."""
+
+    device = torch.device("cpu")
+
+    def __init__(self):
+        self.decoded: list[tuple[str, int]] = []
+
+    def encode_domains(self, samples):
+        return samples
+
+    def __call__(self, latent_groups):
+        a, b = torch.zeros(4, 2), torch.ones(4, 2)
+        return {
+            "broadcasts": {frozenset(["v"]): {"v": a, "attr": b}},
+            "cycles": {frozenset(["v"]): {"v": b}, frozenset(["attr"]): {"attr": a}},
+        }
+
+    def decode_domain(self, x, domain):
+        self.decoded.append((domain, x.size(0)))
+        return x
+
+
+def test_gw_logger_decodes_once_per_domain():
+    pl_module = DecodeCounter()
+    callback = LogGWImagesCallback(
+        {},
+        log_key="images",
+        mode="val",
+        filter=["pred_trans_v_to_v", "pred_cycle_v_to_v", "pred_cycle_attr_to_attr"],
+    )
+    logged: dict[str, torch.Tensor] = {}
+    callback.log_samples = lambda logger, samples, domain, mode: logged.setdefault(
+        mode, samples
+    )
+    callback.on_callback([object()], pl_module)
+
+    assert sorted(pl_module.decoded) == [("attr", 4), ("v", 8)]
+    assert list(logged) == [
+        "pred_trans_v_to_v",
+        "pred_cycle_v_to_v",
+        "pred_cycle_attr_to_attr",
+    ]
+    assert (logged["pred_trans_v_to_v"] == 0).all()
+    assert (logged["pred_cycle_v_to_v"] == 1).all()
+
+
+class LatentDecodeCounter(DecodeCounter):
+    """Global workspace stub with a "v_latents" domain counting the decoded images."""
+
+    def __init__(self):
+        super().__init__()
+        self.domain_mods = {"v_latents": self}
+
+    def __call__(self, latent_groups):
+        a, b = torch.zeros(4, 2), torch.ones(4, 2)
+        return {
+            "broadcasts": {frozenset(["attr"]): {"v_latents": a}},
+            "cycles": {frozenset(["v_latents"]): {"v_latents": b}},
+        }
+
+    def decode_images(self, z):
+        self.decoded.append(("images", z.size(0)))
+        return z
+
+
+def test_gw_logger_decodes_latents_once():
+    pl_module = LatentDecodeCounter()
+    callback = LogGWImagesCallback({}, log_key="images", mode="val")
+    logged: list[tuple[str, str]] = []
+    callback.log_visual_samples = lambda logger, samples, mode: logged.append(
+        (logger, mode)
+    )
+    callback.on_callback(["logger_1", "logger_2"], pl_module)
+
+    # the images are decoded once for both predictions and both loggers
+    assert pl_module.decoded == [("v_latents", 8), ("images", 8)]
+    assert logged == [
+        ("logger_1", "pred_trans_attr_to_v_latents"),
+        ("logger_1", "pred_cycle_v_latents_to_v_latents"),
+        ("logger_2", "pred_trans_attr_to_v_latents"),
+        ("logger_2", "pred_cycle_v_latents_to_v_latents"),
+    ]
+
+
 def test_gw_logger():
     data_module = SimpleShapesDataModule(
         PROJECT_DIR / "sample_dataset",
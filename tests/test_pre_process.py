@@ -0,0 +1,76 @@
+import shutil
+from types import SimpleNamespace
+
+import numpy as np
+import torch
+from torch.utils.data import default_collate
+from utils import PROJECT_DIR
+
+from shimmer_ssd.dataset.data_module import (
+    BatchTransformsCollate,
+    apply_batch_transforms,
+)
+from shimmer_ssd.dataset.pre_process import (
+    BatchTokenizeCaptions,
+    CachedTokenizeCaptions,
+    TokenizeCaptions,
+    save_tokens_cache,
+)
+
+
+def test_cached_tokenize_captions(tmp_path):
+    for split in ["train", "val", "test"]:
+        shutil.copy(
+            PROJECT_DIR / f"sample_dataset/{split}_captions.npy",
+            tmp_path / f"{split}_captions.npy",
+        )
+    vocab = str(PROJECT_DIR / "tokenizer/vocab.json")
+    merges = str(PROJECT_DIR / "tokenizer/merges.txt")
+    save_tokens_cache(tmp_path, vocab, merges, 64)
+
+    tokenize = TokenizeCaptions(vocab, merges, 64)
+    cached_tokenize = CachedTokenizeCaptions(tmp_path, vocab, merges, 64)
+    cached_captions = np.load(tmp_path / "val_captions.npy").tolist()
+    for caption in cached_captions + ["a new caption"]:
+        text = SimpleNamespace(caption=caption, bert=torch.zeros(768))
+        expected = tokenize(text)["tokens"]  # type: ignore
+        tokens = cached_tokenize(text)["tokens"]  # type: ignore
+        assert tokens.dtype == torch.long
+        assert torch.equal(tokens, expected)
+        # the cached tokens are views of the memory-mapped cache
+        is_view = np.shares_memory(tokens.numpy(), cached_tokenize._tokens)
+        assert is_view == (caption in cached_captions)
+
+
+def test_batch_tokenize_captions():
+    vocab = str(PROJECT_DIR / "tokenizer/vocab.json")
+    merges = str(PROJECT_DIR / "tokenizer/merges.txt")
+    tokenize = TokenizeCaptions(vocab, merges, 64)
+    batch_tokenize = BatchTokenizeCaptions(vocab, merges, 64)
+    texts = [
+        SimpleNamespace(caption=caption, bert=torch.randn(768))
+        for caption in np.load(PROJECT_DIR / "sample_dataset/val_captions.npy")[:8]
+    ]
+    expected = torch.stack([tokenize(text)["tokens"] for text in texts])  # type: ignore
+
+    collated = batch_tokenize.collate(texts)  # type: ignore
+    assert torch.equal(collated["tokens"], expected)
+    assert torch.equal(collated["bert"], torch.stack([text.bert for text in texts]))
+
+    samples = [batch_tokenize(text) for text in texts]  # type: ignore
+    batch = {
+        frozenset(["t"]): {
+            "t": {
+                "bert": torch.stack([sample["bert"] for sample in samples]),
+                "caption": [sample["caption"] for sample in samples],
+            }
+        }
+    }
+    transformed = apply_batch_transforms(batch, {"t": batch_tokenize.batch_transform})
+    assert torch.equal(transformed[frozenset(["t"])]["t"]["tokens"], expected)
+
+    collate = BatchTransformsCollate(
+        default_collate, {"t": batch_tokenize.batch_transform}
+    )
+    collated = collate([{"t": sample} for sample in samples])
+    assert torch.equal(collated["t"]["tokens"], expected)
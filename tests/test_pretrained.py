@@ -0,0 +1,72 @@
+import torch
+from lightning.pytorch import LightningModule, Trainer
+
+from shimmer_ssd.config import DomainModuleVariant, LoadedDomainConfig
+from shimmer_ssd.modules.domains.attribute import (
+    AttributeDomainModule,
+    AttributeLegacyDomainModule,
+)
+from shimmer_ssd.modules.domains.pretrained import (
+    load_pretrained_domain,
+    load_pretrained_domains,
+    load_pretrained_module,
+)
+from shimmer_ssd.modules.domains.visual import VisualDomainModule
+
+
+def save_checkpoint(module: LightningModule, path):
+    trainer = Trainer(logger=False, enable_checkpointing=False)
+    trainer.strategy.connect(module)
+    trainer.save_checkpoint(path)
+
+
+def test_load_pretrained_domains_matches_sequential(tmp_path):
+    save_checkpoint(
+        VisualDomainModule(num_channels=3, latent_dim=8, ae_dim=16), tmp_path / "v.ckpt"
+    )
+    save_checkpoint(
+        AttributeDomainModule(latent_dim=8, hidden_dim=16), tmp_path / "attr.ckpt"
+    )
+    domains = [
+        LoadedDomainConfig(
+            domain_type=DomainModuleVariant.v_latents,
+            checkpoint_path=tmp_path / "v.ckpt",
+        ),
+        LoadedDomainConfig(
+            domain_type=DomainModuleVariant.attr, checkpoint_path=tmp_path / "attr.ckpt"
+        ),
+    ]
+    gw_args = (12, 16, 2, 16, 2, True)
+
+    # the domains loaded one after the other like before the concurrent loading
+    torch.manual_seed(0)
+    sequential = [load_pretrained_domain(domain, *gw_args) for domain in domains]
+
+    torch.manual_seed(0)
+    modules, gw_encoders, gw_decoders = load_pretrained_domains(domains, *gw_args)
+
+    for kind, (module, encoder, decoder) in zip(
+        ["v_latents", "attr"], sequential, strict=True
+    ):
+        for expected, loaded in [
+            (module, modules[kind]),
+            (encoder, gw_encoders[kind]),
+            (decoder, gw_decoders[kind]),
+        ]:
+            expected_state = expected.state_dict()
+            assert expected_state.keys() == loaded.state_dict().keys()
+            for key, val in loaded.state_dict().items():
+                assert torch.equal(val, expected_state[key])
+
+
+def test_load_attr_legacy_without_checkpoint(tmp_path):
+    # the legacy attribute modules have no weights, their checkpoint is not read
+    domain = LoadedDomainConfig(
+        domain_type=DomainModuleVariant.attr_legacy,
+        checkpoint_path=tmp_path / "missing.ckpt",
+    )
+    module = load_pretrained_module(domain)
+    assert isinstance(module, AttributeLegacyDomainModule)
+
+    modules, _, _ = load_pretrained_domains([domain], 12, 16, 2, 16, 2, True)
+    assert isinstance(modules["attr"], AttributeLegacyDomainModule)
@@ -0,0 +1,111 @@
+import json
+import time
+
+import torch
+from lightning.pytorch import LightningModule, Trainer
+from torch.utils.data import DataLoader, TensorDataset
+
+from shimmer_ssd.config import Profiling
+from shimmer_ssd.profiling import (
+    ProfilingCallback,
+    ThroughputCallback,
+    Timings,
+    batch_num_samples,
+    loss_method_names,
+    timed_methods,
+)
+
+
+class Losses:
+    def cycle_loss(self, x: float) -> float:
+        time.sleep(0.01)
+        return 2 * x
+
+    def step(self, x: float) -> float:
+        return self.cycle_loss(x) + 1
+
+
+def test_timed_methods():
+    losses = Losses()
+    timings = Timings()
+    assert loss_method_names(losses) == ["cycle_loss"]
+
+    with timed_methods(losses, ["cycle_loss"], timings):
+        assert losses.step(1) == 3
+        timings.enabled = False
+        losses.step(1)
+    losses.step(1)
+
+    assert timings.count("cycle_loss") == 1
+    assert timings.total("cycle_loss") >= 0.01
+    assert "cycle_loss" not in vars(losses)
+
+
+class ToyModule(LightningModule):
+    def __init__(self):
+        super().__init__()
+        self.layer = torch.nn.Linear(4, 1)
+
+    def mse_loss(self, x: torch.Tensor) -> torch.Tensor:
+        return self.layer(x).pow(2).mean()
+
+    def training_step(self, batch: list[torch.Tensor], batch_idx: int):
+        return self.mse_loss(batch[0])
+
+    def configure_optimizers(self):
+        return torch.optim.SGD(self.parameters(), lr=0.1)
+
+
+def test_profiling_callback(tmp_path):
+    dataloader = DataLoader(TensorDataset(torch.randn(32, 4)), batch_size=4)
+    config = Profiling(enabled=True, window=4, log_every_n_steps=2, trace_steps=3)
+    callback = ProfilingCallback(config)
+    module = ToyModule()
+    trainer = Trainer(
+        logger=False,
+        max_steps=6,
+        enable_checkpointing=False,
+        enable_progress_bar=False,
+        enable_model_summary=False,
+        callbacks=[callback],
+        accelerator="cpu",
+        default_root_dir=tmp_path,
+    )
+    trainer.fit(module, dataloader)
+
+    stages = ["dataloader", "transfer", "forward", "mse_loss", "backward", "optimizer"]
+    for stage in stages:
+        assert callback.timings.count(stage) == config.window
+        assert f"profiling/{stage}_p90_ms" in trainer.logged_metrics
+    assert "mse_loss" not in vars(module)
+
+    trace = json.loads((tmp_path / "profiling_trace.json").read_text())
+    names = [event["name"] for event in trace["traceEvents"]]
+    assert names.count("step") == 3
+
+
+def test_throughput_callback(tmp_path):
+    dataloader = DataLoader(TensorDataset(torch.randn(32, 4)), batch_size=4)
+    trainer = Trainer(
+        logger=False,
+        max_steps=6,
+        enable_checkpointing=False,
+        enable_progress_bar=False,
+        enable_model_summary=False,
+        callbacks=[ThroughputCallback(log_every_n_steps=3)],
+        accelerator="cpu",
+        default_root_dir=tmp_path,
+    )
+    trainer.fit(ToyModule(), dataloader)
+
+    metrics = trainer.logged_metrics
+    assert metrics["throughput/samples_per_s"] > 0
+    assert 0 < metrics["throughput/utilization"] <= 1
+    assert metrics["throughput/dataloader_wait_ms"] >= 0
+    assert metrics["throughput/peak_memory_mb"] > 0
+
+    batch = {
+        frozenset(["v"]): {"v": torch.zeros(4, 3)},
+        frozenset(["v", "attr"]): {"v": torch.zeros(2, 3), "attr": [torch.zeros(2)]},
+    }
+    assert batch_num_samples(batch) == 6
@@ -0,0 +1,65 @@
+import numpy as np
+import torch
+from utils import PROJECT_DIR
+
+from shimmer_ssd.dataset.latents import PresavedLatentsDomain
+from shimmer_ssd.dataset.synthetic import (
+    CAPTION_LENGTH,
+    alignment_split_name,
+    save_synthetic_dataset,
+    synthetic_split,
+)
+
+DOMAIN_PROPORTIONS = {
+    frozenset(["attr"]): 1.0,
+    frozenset(["v"]): 1.0,
+    frozenset(["attr", "v"]): 0.5,
+}
+
+
+def test_save_synthetic_dataset(tmp_path):
+    save_synthetic_dataset(
+        tmp_path,
+        {"train": 50, "val": 8},
+        DOMAIN_PROPORTIONS,
+        latent_dims={"v.npy": 12},
+        chunk_size=16,
+    )
+
+    sample_dir = PROJECT_DIR / "sample_dataset"
+    for name in ["labels", "latent", "captions", "unpaired", "odd_one_out_labels"]:
+        values = np.load(tmp_path / f"train_{name}.npy")
+        sample = np.load(sample_dir / f"train_{name}.npy")
+        assert values.shape == (50, *sample.shape[1:])
+        assert values.dtype.kind == sample.dtype.kind
+    labels = np.load(tmp_path / "train_labels.npy")
+    # each chunk is generated with its own seed
+    assert not np.array_equal(labels[:16], labels[16:32])
+    assert set(np.unique(labels[:, 0])) <= {0, 1, 2}
+
+    # same file names as the splits generated by `shapesd alignment add`
+    split_name = alignment_split_name(DOMAIN_PROPORTIONS, seed=0)
+    assert (sample_dir / f"domain_splits/val_{split_name}_domain_split.npy").exists()
+    assert (
+        sample_dir / f"domain_splits_v2/val_{split_name}_ms:2_domain_split.npy"
+    ).exists()
+    for split_path in [
+        f"domain_splits/val_{split_name}_domain_split.npy",
+        f"domain_splits_v2/val_{split_name}_ms:8_domain_split.npy",
+    ]:
+        split = np.load(tmp_path / split_path, allow_pickle=True).item()
+        assert split.keys() == DOMAIN_PROPORTIONS.keys()
+        assert len(split[frozenset(["attr", "v"])]) == 4
+        assert np.array_equal(split[frozenset(["v"])], np.arange(8))
+
+    dataset = PresavedLatentsDomain(
+        tmp_path, "val", additional_args={"presaved_path": "v.npy"}
+    )
+    assert len(dataset) == 8
+    assert dataset[0].shape == (12,) and dataset[0].dtype == torch.float32
+
+
+def test_synthetic_captions():
+    arrays = synthetic_split(1000, np.random.default_rng(0))
+    assert arrays["captions"].dtype == np.dtype(f"<U{CAPTION_LENGTH}")
+    assert all(caption.startswith("A ") for caption in arrays["captions"])
@@ -0,0 +1,139 @@
+import torch
+
+from shimmer_ssd.modules.decoding import (
+    BeamSearchDecoding,
+    GreedyDecoding,
+    SamplingDecoding,
+)
+from shimmer_ssd.modules.domains.text import GRUTextDomainModule
+
+
+def full_prefix_decode(
+    module: GRUTextDomainModule, z: torch.Tensor
+) -> dict[str, torch.Tensor]:
+    """Reference decoding re-running the GRU on the whole prefix at every step."""
+    context = z.unsqueeze(1)
+    pad_tokens = module.embeddings(
+        torch.zeros(z.size(0), module.seq_length - 1, dtype=torch.long)
+    )
+    seq = torch.cat([context, pad_tokens], dim=1)
+    for k in range(0, module.seq_length - 1):
+        out = module.decode_one(seq)
+        seq[:, k + 1] = module.embeddings(out["tokens"][:, k])
+    return module.decode_one(seq)
+
+
+def test_greedy_decode_matches_full_prefix():
+    torch.manual_seed(0)
+    module = GRUTextDomainModule(
+        latent_dim=8, hidden_dim=16, vocab_size=20, seq_length=12
+    )
+    module.eval()
+    z = torch.randn(5, 8)
+
+    with torch.no_grad():
+        expected = full_prefix_decode(module, z)
+        out = module.decode(z)
+
+    assert torch.equal(out["tokens"], expected["tokens"])
+    assert torch.allclose(out["token_dist"], expected["token_dist"], atol=1e-5)
+
+
+def test_greedy_decode_stop_on_padding():
+    torch.manual_seed(0)
+    module = GRUTextDomainModule(
+        latent_dim=8, hidden_dim=16, vocab_size=20, seq_length=12
+    )
+    module.eval()
+    # force the padding token to always be predicted
+    with torch.no_grad():
+        module.text_head.bias.fill_(-100)
+        module.text_head.bias[0] = 100
+        out = module.greedy_decode(torch.randn(3, 8), stop_on_padding=True)
+
+    assert out["tokens"].shape == (3, 12)
+    assert out["token_dist"].shape == (3, 12, 20)
+    assert (out["tokens"] == 0).all()
+    assert (out["token_dist"].argmax(-1) == 0).all()
+
+
+def test_sampling_top_k_1_is_greedy():
+    torch.manual_seed(0)
+    module = GRUTextDomainModule(
+        latent_dim=8, hidden_dim=16, vocab_size=20, seq_length=12
+    )
+    module.eval()
+    z = torch.randn(5, 8)
+
+    with torch.no_grad():
+        greedy = module.generate(z, GreedyDecoding())
+        sampled = module.generate(z, SamplingDecoding(temperature=0.5, top_k=1))
+
+    assert torch.equal(greedy["tokens"], sampled["tokens"])
+
+
+def test_beam_search():
+    torch.manual_seed(0)
+    module = GRUTextDomainModule(
+        latent_dim=8, hidden_dim=16, vocab_size=20, seq_length=12
+    )
+    module.eval()
+    z = torch.randn(5, 8)
+
+    with torch.no_grad():
+        greedy = module.generate(z, GreedyDecoding())["tokens"]
+        one_beam = module.generate(z, BeamSearchDecoding(num_beams=1))
+        beams = module.generate(z, BeamSearchDecoding(num_beams=3))
+
+    # with one beam, finished hypotheses are only extended with padding
+    is_padding = (greedy == module.padding_token).long().cummax(dim=1).values.bool()
+    expected = greedy.masked_fill(is_padding, module.padding_token)
+    assert torch.equal(one_beam["tokens"], expected)
+
+    assert beams["tokens"].shape == (5, 12)
+    assert beams["scores"].shape == (5,)
+    assert torch.isfinite(beams["scores"]).all()
+    assert beams["token_dist"].shape == (5, 12, 20)
+
+
+def test_beam_search_token_dist():
+    torch.manual_seed(0)
+    module = GRUTextDomainModule(
+        latent_dim=8, hidden_dim=16, vocab_size=20, seq_length=12
+    )
+    module.eval()
+    z = torch.randn(5, 8)
+
+    with torch.no_grad():
+        out = module.generate(z, BeamSearchDecoding(num_beams=3, length_penalty=0))
+        # token distributions along the best hypotheses, from the decoder
+        inputs = torch.cat(
+            [z.unsqueeze(1), module.embeddings(out["tokens"][:, :-1])], dim=1
+        )
+        expected = module.decode_one(inputs)["token_dist"].log_softmax(-1)
+
+    # without length penalty, the score is the log probability of the tokens
+    log_probs = out["token_dist"].gather(-1, out["tokens"].unsqueeze(-1))
+    assert torch.allclose(log_probs.sum((1, 2)), out["scores"], atol=1e-4)
+    # until the hypothesis emits padding, the distributions are the decoder's
+    is_padding = out["tokens"] == module.padding_token
+    finished = is_padding.long().cummax(dim=1).values.bool()
+    active = torch.cat([torch.ones(5, 1, dtype=torch.bool), ~finished[:, :-1]], 1)
+    assert torch.allclose(out["token_dist"][active], expected[active], atol=1e-5)
+
+
+def test_text_token_loss_acc():
+    torch.manual_seed(0)
+    module = GRUTextDomainModule(
+        latent_dim=8, hidden_dim=16, vocab_size=20, seq_length=6
+    )
+    z = torch.randn(4, 8)
+    tokens = torch.randint(1, 20, (4, 6))
+    tokens[:, 4:] = module.padding_token
+    _, acc = module.text_token_loss(z, {"tokens": tokens})
+
+    predicted = module.decode_one(
+        torch.cat([z.unsqueeze(1), module.embeddings(tokens[:, :-1])], dim=1)
+    )["tokens"]
+    mask = tokens != module.padding_token
+    assert torch.allclose(acc, (predicted[mask] == tokens[mask]).float().mean())
@@ -0,0 +1,82 @@
+import numpy as np
+import torch
+from PIL import Image
+
+from shimmer_ssd.modules.vae import dim_exploration_figure
+
+
+class StubVAE:
+    def __init__(self):
+        self.batch_sizes: list[int] = []
+
+    def decoder(self, z: torch.Tensor) -> list[torch.Tensor]:
+        self.batch_sizes.append(z.size(0))
+        return [z]
+
+
+def test_dim_exploration_figure():
+    vae = StubVAE()
+    pairs: list[torch.Tensor] = []
+
+    def ax_from_tensors(samples, image_size: int, ncols: int) -> Image.Image:
+        pairs.append(samples[0])
+        return Image.fromarray(np.zeros((ncols * image_size,) * 2, dtype=np.uint8))
+
+    fig = dim_exploration_figure(
+        vae,  # type: ignore
+        z_size=6,
+        device=torch.device("cpu"),
+        ax_from_tensors=ax_from_tensors,
+        num_samples=3,
+        image_size=4,
+        plot_dims=[0, 2, 5],
+        batch_size=4,
+    )
+
+    assert sum(vae.batch_sizes) == 3 * 3 * 3
+    assert max(vae.batch_sizes) == 4
+    assert len(pairs) == 3
+    # second pair varies dims 0 and 5 in the rows and columns of the grid
+    z = pairs[1].reshape(3, 3, 6)
+    assert torch.equal(z[:, 0, 0], torch.tensor([-6.0, 0.0, 6.0]))
+    assert torch.equal(z[0, :, 5], torch.tensor([-6.0, 0.0, 6.0]))
+    assert (z[..., [1, 2, 3, 4]] == 0).all()
+    assert len(fig.axes) == 1
+
+
+def test_dim_exploration_figure_chunks():
+    vae = StubVAE()
+    events: list[str] = []
+
+    def ax_from_tensors(samples, image_size: int, ncols: int) -> Image.Image:
+        events.append(f"draw {samples[0].size(0)}")
+        return Image.fromarray(np.zeros((ncols * image_size,) * 2, dtype=np.uint8))
+
+    decoder = vae.decoder
+
+    def decode(z: torch.Tensor) -> list[torch.Tensor]:
+        events.append(f"decode {z.size(0)}")
+        return decoder(z)
+
+    vae.decoder = decode  # type: ignore
+
+    dim_exploration_figure(
+        vae,  # type: ignore
+        z_size=6,
+        device=torch.device("cpu"),
+        ax_from_tensors=ax_from_tensors,
+        num_samples=3,
+        image_size=4,
+        plot_dims=[0, 2, 0, 5, 2],
+        batch_size=20,
+    )
+
+    # the repeated dims are only plotted once, and the pairs are decoded and drawn
+    # by chunks of 2 pairs (18 latent vectors)
+    assert events == [
+        "decode 18",
+        "draw 9",
+        "draw 9",
+        "decode 9",
+        "draw 9",
+    ]